@@ -1,15 +1,30 @@
 # app2.py - Versione anti-abuso con punti di interesse predefiniti
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
 import os
 import json
+import hashlib
+from werkzeug.http import parse_etags
 from dotenv import load_dotenv
 # from flask_cors import CORS
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from provider_clients import http_get, http_post, get_host_stats, get_pool_settings
+from cache_backends import create_cache_backend
+from memory_cache import BoundedDistanceCache, CompactDistanceCache, OriginIndex, ResponseCache, split_cache_key
+from geo import geohash_encode, geohash_decode
+from poi_index import PointIndex, more_than_steps, diff_points
+from shared_state import SharedState
+from rate_limiter import SlidingWindowRateLimiter, create_limiter_store
+from warmup import WarmupJob, service_bounds, build_grid, estimate_elements
+from strapi_client import StrapiPointsFetcher
+from walking_graph import load_walking_graph
+from provider_router import ProviderRouter
 from math import radians, cos, sin, sqrt, atan2
 import time
-from collections import defaultdict, deque
+import threading
+import atexit
+import signal
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait as wait_futures, as_completed
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,19 +32,14 @@ load_dotenv()
 app = Flask(__name__)
 # CORS(app)
 
-# Initialize Flask-Limiter
-limiter = Limiter(
-    key_func=get_remote_address,
-    app=app,
-    default_limits=["500 per day", "100 per hour", "20 per minute"]
-)
-
 # Configuration
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 OPENROUTE_API_KEY = os.getenv("OPENROUTE_API_KEY") 
 STRAPI_BEARER_TOKEN = os.getenv("STRAPI_BEARER_TOKEN", "abc123")
 ADMIN_SECRET = os.getenv("ADMIN_SECRET", "abcd1234")
 PORT = 5002
+# Debug e reloader di Werkzeug solo se richiesti esplicitamente (python app2.py in sviluppo)
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "false").lower() in ("1", "true", "yes")
 
 # File paths for persistence - usa cartella condivisa se disponibile
 SHARED_DIR = "/app/shared" if os.path.exists("/app/shared") else "./shared"
@@ -40,16 +50,221 @@ if not os.path.exists(SHARED_DIR):
     print(f"✅ Created directory: {SHARED_DIR}")
 
 POINTS_FILE = os.path.join(SHARED_DIR, "points_of_interest.json")
+# Registro (JSONL) delle differenze applicate ad ogni reload dei punti
+POINTS_CHANGES_FILE = os.path.join(SHARED_DIR, "points_changes.log")
 CACHE_FILE = os.path.join(SHARED_DIR, "distance_cache.json")
 
+# Stato condiviso tra più worker (gunicorn) o container: cache e rate limiting su SQLite
+# nella cartella condivisa, la memoria locale fa solo da primo livello
+SHARED_STATE = os.getenv("SHARED_STATE", "false").lower() in ("1", "true", "yes")
+STATE_SYNC_INTERVAL_SECONDS = float(os.getenv("STATE_SYNC_INTERVAL_SECONDS", "2"))
+SHARED_CACHE_TRIM_INTERVAL_SECONDS = float(os.getenv("SHARED_CACHE_TRIM_INTERVAL_SECONDS", "300"))
+shared_state = SharedState(os.path.join(SHARED_DIR, "shared_state.db")) if SHARED_STATE else None
+state_sync = {"checked_at": 0, "trimmed_at": 0, "points_mtime": 0, "cache_generation": 0, "shared_cache_hits": 0}
+
+# Backend di persistenza della cache, tutti con scritture proporzionali alle sole modifiche:
+# snapshot (binario mappato in memoria più log delle modifiche, default), log (append-only) o
+# sqlite (WAL). distance_cache.json esistente viene importato al primo avvio; json (riscrittura
+# dell'intero file a ogni salvataggio) resta disponibile solo con CACHE_BACKEND=json
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "snapshot")
+if SHARED_STATE and CACHE_BACKEND != "sqlite":
+    print(f"⚠️  SHARED_STATE requires the sqlite cache backend, ignoring CACHE_BACKEND={CACHE_BACKEND}")
+    CACHE_BACKEND = "sqlite"
+cache_backend = create_cache_backend(CACHE_BACKEND, SHARED_DIR)
+
+# Limiti della cache: numero massimo di entry (LRU) ed età massima (TTL, 0 = nessuna scadenza)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "200000"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# Rappresentazione in memoria: "compact" (array per origine, LRU per origine) oppure "dict" (un dict per entry, LRU per entry)
+CACHE_MEMORY_LAYOUT = os.getenv("CACHE_MEMORY_LAYOUT", "compact")
+
+# Chiave di cache dell'origine: "round" (4 decimali, ~11 m) oppure "geohash" (cella di CACHE_GEOHASH_PRECISION caratteri)
+CACHE_KEY_MODE = os.getenv("CACHE_KEY_MODE", "round")
+CACHE_GEOHASH_PRECISION = int(os.getenv("CACHE_GEOHASH_PRECISION", "8"))
+
+# Riuso dell'origine in cache più vicina entro CACHE_NEIGHBOR_RADIUS_M metri (0 = disabilitato)
+CACHE_NEIGHBOR_RADIUS_M = float(os.getenv("CACHE_NEIGHBOR_RADIUS_M", "0"))
+neighbor_stats = {"hits": 0, "total_error_m": 0, "max_error_m": 0}
+neighbor_stats_lock = threading.Lock()
+
+# Risposte di /all_distances già serializzate per cella di origine (0 = disabilitato), con ETag
+# e Cache-Control: nginx/Caddy e i client possono rivalidare con If-None-Match (304)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+RESPONSE_MAX_AGE_SECONDS = int(os.getenv("RESPONSE_MAX_AGE_SECONDS", "60"))
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+
 # In-memory storage
 points_of_interest = []
-distance_cache = {}
+point_index = PointIndex([])
+distance_cache = (CompactDistanceCache if CACHE_MEMORY_LAYOUT == "compact" else BoundedDistanceCache)(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    on_remove=lambda keys, reason: on_cache_removed(keys, reason)
+)
+
+# Chiavi aggiunte/modificate e chiavi rimosse dall'ultimo salvataggio
+dirty_cache_keys = set()
+removed_cache_keys = set()
+dirty_cache_lock = threading.Lock()
+# Un solo salvataggio alla volta (flusher, richieste, shutdown): senza questo lock due
+# salvataggi concorrenti possono scrivere sul backend in ordine inverso
+cache_save_lock = threading.Lock()
 
-# Rate limiting storage  
-request_history = defaultdict(deque)
+# Write-behind: le richieste non scrivono su disco, un thread in background salva
+# le chiavi modificate ogni CACHE_FLUSH_INTERVAL_SECONDS o appena sono CACHE_FLUSH_MAX_PENDING
+CACHE_WRITE_BEHIND = os.getenv("CACHE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+CACHE_FLUSH_INTERVAL_SECONDS = float(os.getenv("CACHE_FLUSH_INTERVAL_SECONDS", "5"))
+CACHE_FLUSH_MAX_PENDING = int(os.getenv("CACHE_FLUSH_MAX_PENDING", "500"))
+cache_flush_event = threading.Event()
+# Backend snapshot: i salvataggi vanno nel log delle modifiche, che viene compattato nello snapshot
+# ogni CACHE_SNAPSHOT_COMPACT_INTERVAL_SECONDS, appena supera CACHE_SNAPSHOT_COMPACT_LINES righe
+# e allo shutdown
+CACHE_SNAPSHOT_COMPACT_INTERVAL_SECONDS = float(os.getenv("CACHE_SNAPSHOT_COMPACT_INTERVAL_SECONDS", "600"))
+CACHE_SNAPSHOT_COMPACT_LINES = int(os.getenv("CACHE_SNAPSHOT_COMPACT_LINES", "100000"))
+cache_flush_state = {
+    "oldest_dirty_at": None,
+    "last_flush_at": None,
+    "last_flush_entries": 0,
+    "flushes": 0,
+    "flush_errors": 0
+}
+
+# Rate limiting: un solo motore (finestra scorrevole per IP, memoria fissa) per tutte le route.
+# Regole nome -> (max richieste, finestra in secondi)
 RATE_LIMIT_WINDOW = 60
 RATE_LIMIT_MAX_REQUESTS = 20
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Store condiviso dei contatori (memory://, sqlite:///percorso.db, redis://host:6379/0): con
+# SHARED_STATE il default è un file SQLite nella cartella condivisa. Gli incrementi vengono
+# inviati a blocchi ogni RATE_LIMIT_SYNC_INTERVAL_SECONDS o appena le chiavi in attesa sono
+# RATE_LIMIT_SYNC_MAX_PENDING
+RATE_LIMIT_STORAGE_URI = os.getenv(
+    "RATE_LIMIT_STORAGE_URI",
+    f"sqlite://{os.path.abspath(os.path.join(SHARED_DIR, 'rate_limit.db'))}" if SHARED_STATE else "memory://"
+)
+RATE_LIMIT_SYNC_INTERVAL_SECONDS = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL_SECONDS", "1"))
+RATE_LIMIT_SYNC_MAX_PENDING = int(os.getenv("RATE_LIMIT_SYNC_MAX_PENDING", "1000"))
+RATE_LIMIT_RULES = {
+    "per_minute": (20, 60),
+    "per_hour": (100, 3600),
+    "per_day": (500, 24 * 3600),
+    "distance_api": (RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW),
+    "all_distances": (5, 60),
+    "distances_batch": (10, 60),
+    "get_points": (5, 60),
+    "admin_stats": (10, 60)
+}
+# Regole per endpoint; le route non elencate usano DEFAULT_RATE_LIMITS.
+# /distance e /all_distances condividono il limite distance_api.
+ENDPOINT_RATE_LIMITS = {
+    "get_distance": ["distance_api"],
+    "get_all_distances": ["distance_api", "all_distances"],
+    "get_nearest": ["distance_api"],
+    "get_within": ["distance_api", "all_distances"],
+    "batch_distances": ["distance_api", "distances_batch"],
+    "get_points": ["get_points"],
+    "get_stats": ["admin_stats"]
+}
+DEFAULT_RATE_LIMITS = ["per_minute", "per_hour", "per_day"]
+rate_limiter = SlidingWindowRateLimiter(
+    RATE_LIMIT_RULES,
+    max_keys=RATE_LIMIT_MAX_KEYS,
+    store=create_limiter_store(RATE_LIMIT_STORAGE_URI)
+)
+
+# Batch provider settings (limiti per singola richiesta matrix)
+GOOGLE_MATRIX_MAX_DESTINATIONS = int(os.getenv("GOOGLE_MATRIX_MAX_DESTINATIONS", "25"))
+ORS_MATRIX_MAX_DESTINATIONS = int(os.getenv("ORS_MATRIX_MAX_DESTINATIONS", "50"))
+# Chiamate con più origini (/distances/batch): origini ed elementi (origini × destinazioni) massimi
+GOOGLE_MATRIX_MAX_ORIGINS = int(os.getenv("GOOGLE_MATRIX_MAX_ORIGINS", "25"))
+GOOGLE_MATRIX_MAX_ELEMENTS = int(os.getenv("GOOGLE_MATRIX_MAX_ELEMENTS", "100"))
+
+# Grafo pedonale locale (walking_graph.py): con WALKING_GRAPH_PRIMARY è il primo provider, Google
+# e ORS restano come fallback per i punti che non riesce a risolvere. Le ricerche usano la CPU:
+# girano su un pool dedicato di WALKING_GRAPH_WORKERS thread, non su quello delle chiamate upstream
+WALKING_GRAPH_PRIMARY = os.getenv("WALKING_GRAPH_PRIMARY", "false").lower() in ("1", "true", "yes")
+WALKING_GRAPH_FILE = os.getenv("WALKING_GRAPH_FILE", os.path.join(SHARED_DIR, "walking_graph.bin"))
+WALKING_SPEED_MPS = float(os.getenv("WALKING_SPEED_MPS", "1.39"))
+WALKING_GRAPH_MAX_SNAP_M = float(os.getenv("WALKING_GRAPH_MAX_SNAP_M", "200"))
+WALKING_GRAPH_WORKERS = int(os.getenv("WALKING_GRAPH_WORKERS", "2"))
+walking_graph = None
+if WALKING_GRAPH_PRIMARY:
+    walking_graph = load_walking_graph(WALKING_GRAPH_FILE, speed_mps=WALKING_SPEED_MPS, max_snap_m=WALKING_GRAPH_MAX_SNAP_M)
+elif os.path.exists(WALKING_GRAPH_FILE):
+    print(f"⚠️ Walking graph {WALKING_GRAPH_FILE} found but not used (set WALKING_GRAPH_PRIMARY=true)")
+graph_executor = ThreadPoolExecutor(max_workers=WALKING_GRAPH_WORKERS, thread_name_prefix="walking-graph")
+
+# Upstream worker pool: i cache miss vengono risolti in parallelo con una deadline per richiesta
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "8"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "8"))
+PROVIDER_MAX_CONCURRENCY = {
+    "google": int(os.getenv("GOOGLE_MAX_CONCURRENCY", "4")),
+    "openroute": int(os.getenv("OPENROUTE_MAX_CONCURRENCY", "4"))
+}
+
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix="upstream")
+upstream_stats = {"timed_out_requests": 0, "coalesced_lookups": 0, "skipped_after_deadline": 0}
+
+# Router dei provider (provider_router.py): ordine preferito, latenza ed errori per provider,
+# circuit breaker, limite di concorrenza (PROVIDER_MAX_CONCURRENCY) e hedging opzionale
+# (seconda richiesta al provider successivo dopo il p95)
+PROVIDER_ORDER = [name.strip() for name in os.getenv("PROVIDER_ORDER", "google,openroute").split(",")
+                  if name.strip() in PROVIDER_MAX_CONCURRENCY]
+PROVIDER_BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+PROVIDER_BREAKER_ERROR_RATE = float(os.getenv("PROVIDER_BREAKER_ERROR_RATE", "0.5"))
+PROVIDER_BREAKER_OPEN_SECONDS = float(os.getenv("PROVIDER_BREAKER_OPEN_SECONDS", "30"))
+PROVIDER_HEDGING = os.getenv("PROVIDER_HEDGING", "false").lower() in ("1", "true", "yes")
+PROVIDER_HEDGE_PERCENTILE = float(os.getenv("PROVIDER_HEDGE_PERCENTILE", "95"))
+PROVIDER_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("PROVIDER_HEDGE_MIN_DELAY_SECONDS", "0.2"))
+provider_router = ProviderRouter(
+    PROVIDER_ORDER,
+    failure_threshold=PROVIDER_BREAKER_FAILURES,
+    error_rate_threshold=PROVIDER_BREAKER_ERROR_RATE,
+    open_seconds=PROVIDER_BREAKER_OPEN_SECONDS,
+    hedge=PROVIDER_HEDGING,
+    hedge_percentile=PROVIDER_HEDGE_PERCENTILE,
+    hedge_min_delay=PROVIDER_HEDGE_MIN_DELAY_SECONDS,
+    max_workers=UPSTREAM_POOL_SIZE,
+    max_concurrency=PROVIDER_MAX_CONCURRENCY
+)
+
+# /nearest e /within: k massimo, candidati Haversine risolti per ogni punto richiesto (l'ordine
+# a piedi può differire da quello in linea d'aria) e raggio massimo (oltre la soglia di 10 km
+# non si calcola la distanza a piedi)
+NEAREST_DEFAULT_K = int(os.getenv("NEAREST_DEFAULT_K", "10"))
+NEAREST_MAX_K = int(os.getenv("NEAREST_MAX_K", "50"))
+NEAREST_CANDIDATE_FACTOR = float(os.getenv("NEAREST_CANDIDATE_FACTOR", "2"))
+WITHIN_MAX_RADIUS_M = int(os.getenv("WITHIN_MAX_RADIUS_M", "10000"))
+
+# /distances/batch: numero massimo di coppie per richiesta e deadline dei cache miss (sotto il
+# timeout dei worker gunicorn)
+BATCH_MAX_PAIRS = int(os.getenv("BATCH_MAX_PAIRS", "1000"))
+BATCH_DEADLINE_SECONDS = float(os.getenv("BATCH_DEADLINE_SECONDS", "20"))
+
+# Warm-up della cache su una griglia di origini (warmup.py): passo della griglia (modalità round),
+# margine attorno ai punti, budget di elementi per esecuzione e ritmo massimo verso i provider
+WARMUP_STEP_M = float(os.getenv("WARMUP_STEP_M", "100"))
+WARMUP_MARGIN_M = float(os.getenv("WARMUP_MARGIN_M", "1000"))
+WARMUP_MAX_ELEMENTS = int(os.getenv("WARMUP_MAX_ELEMENTS", "100000"))
+WARMUP_ELEMENTS_PER_SECOND = float(os.getenv("WARMUP_ELEMENTS_PER_SECOND", "50"))
+# Area esplicita "min_lat,min_lon,max_lat,max_lon" (vuota = bounding box dei punti più il margine)
+WARMUP_BOUNDS = os.getenv("WARMUP_BOUNDS", "")
+WARMUP_STATE_FILE = os.path.join(SHARED_DIR, "warmup_state.json")
+# Il warm-up usa un pool suo (non toglie thread alle richieste) e una deadline per ogni cella:
+# le destinazioni non risolte entro la deadline contano come fallite e la cella successiva parte
+WARMUP_POOL_SIZE = int(os.getenv("WARMUP_POOL_SIZE", "2"))
+WARMUP_CHUNK_DEADLINE_SECONDS = float(os.getenv("WARMUP_CHUNK_DEADLINE_SECONDS", "30"))
+warmup_executor = ThreadPoolExecutor(max_workers=WARMUP_POOL_SIZE, thread_name_prefix="warmup")
+# Dopo un /get_points avvia il warm-up dei soli punti nuovi o spostati (anche con ?warmup=1)
+POINTS_RELOAD_WARMUP = os.getenv("POINTS_RELOAD_WARMUP", "false").lower() in ("1", "true", "yes")
+# Stato dell'ultima lettura da Strapi (ETag, updatedAt, record) per i reload condizionali
+STRAPI_STATE_FILE = os.path.join(SHARED_DIR, "strapi_points_state.json")
+last_points_reload = {}
+
+# Single-flight: una sola chiamata upstream per chiave di cache, le richieste concorrenti attendono la stessa Future
+inflight_lookups = {}
+inflight_lock = threading.RLock()
 
 def load_points_from_file():
     """Carica i punti di interesse dal file"""
@@ -57,6 +272,8 @@ def load_points_from_file():
     try:
         with open(POINTS_FILE, 'r') as f:
             points_of_interest = json.load(f)
+        state_sync["points_mtime"] = os.path.getmtime(POINTS_FILE)
+        rebuild_point_index()
         print(f"✅ Loaded {len(points_of_interest)} points of interest from {POINTS_FILE}")
     except FileNotFoundError:
         print(f"⚠️  File {POINTS_FILE} not found, creating empty file")
@@ -72,64 +289,191 @@ def load_points_from_file():
         print(f"❌ Error loading points from file: {e}")
         points_of_interest = []
 
+def rebuild_point_index():
+    """Ricostruisce l'indice spaziale dopo il caricamento o il reload dei punti"""
+    global point_index
+    point_index = PointIndex(points_of_interest)
+
 def save_points_to_file():
-    """Salva i punti di interesse nel file"""
+    """Salva i punti di interesse nel file (in modo atomico, altri worker possono rileggerlo)"""
     try:
-        with open(POINTS_FILE, 'w') as f:
+        tmp_path = POINTS_FILE + ".tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(points_of_interest, f, indent=2)
+        os.replace(tmp_path, POINTS_FILE)
+        state_sync["points_mtime"] = os.path.getmtime(POINTS_FILE)
         print(f"✅ Saved {len(points_of_interest)} points to {POINTS_FILE}")
     except Exception as e:
         print(f"❌ Error saving points to file: {e}")
 
 def load_cache_from_file():
-    """Carica la cache dal file"""
-    global distance_cache
+    """Carica la cache dal backend di persistenza"""
     try:
-        with open(CACHE_FILE, 'r') as f:
-            distance_cache = json.load(f)
-        print(f"✅ Loaded {len(distance_cache)} cache entries from {CACHE_FILE}")
+        if cache_backend.name != "json" and not cache_backend.exists() and os.path.exists(CACHE_FILE):
+            # Primo avvio con il nuovo backend: importa la cache JSON esistente
+            with open(CACHE_FILE, 'r') as f:
+                distance_cache.load_entries(json.load(f))
+            if hasattr(cache_backend, "open_snapshot"):
+                cache_backend.compact(distance_cache)
+            else:
+                cache_backend.save(distance_cache, list(distance_cache.keys()))
+            print(f"✅ Imported {len(distance_cache)} cache entries from {CACHE_FILE} into {cache_backend.path}")
+        elif hasattr(cache_backend, "open_snapshot") and isinstance(distance_cache, CompactDistanceCache):
+            # Solo mmap e header: le righe delle origini vengono lette al primo accesso
+            distance_cache.attach_snapshot(cache_backend.open_snapshot())
+            # Modifiche salvate dopo l'ultima compattazione
+            distance_cache.replay(cache_backend.load_log())
+            print(f"✅ Loaded {len(distance_cache)} cache entries from {cache_backend.path}")
+        else:
+            distance_cache.load_entries(cache_backend.load())
+            print(f"✅ Loaded {len(distance_cache)} cache entries from {cache_backend.path}")
+        if CACHE_NEIGHBOR_RADIUS_M > 0:
+            origin_index.add_prefixes(distance_cache.origins())
     except FileNotFoundError:
-        print(f"⚠️  File {CACHE_FILE} not found, creating empty file")
-        distance_cache = {}
+        print(f"⚠️  File {cache_backend.path} not found, creating empty file")
+        distance_cache.clear()
         # Crea il file vuoto
         try:
-            with open(CACHE_FILE, 'w') as f:
-                json.dump({}, f, indent=2)
-            print(f"✅ Created empty cache file: {CACHE_FILE}")
+            cache_backend.clear()
+            print(f"✅ Created empty cache file: {cache_backend.path}")
         except Exception as e:
             print(f"❌ Error creating cache file: {e}")
     except Exception as e:
         print(f"❌ Error loading cache from file: {e}")
-        distance_cache = {}
+        distance_cache.clear()
+
+def mark_cache_dirty(keys, since=None):
+    """Segna le chiavi da persistere al prossimo salvataggio"""
+    if not keys:
+        return
+    with dirty_cache_lock:
+        dirty_cache_keys.update(keys)
+        if cache_flush_state["oldest_dirty_at"] is None:
+            cache_flush_state["oldest_dirty_at"] = since or time.time()
+        pending = len(dirty_cache_keys)
+    
+    if CACHE_WRITE_BEHIND and pending >= CACHE_FLUSH_MAX_PENDING:
+        cache_flush_event.set()
+
+def on_cache_removed(keys, reason):
+    """Callback della cache in memoria per le chiavi rimosse"""
+    prefixes = {split_cache_key(key)[0] for key in keys}
+    response_cache.invalidate(prefixes)
+    if CACHE_NEIGHBOR_RADIUS_M > 0:
+        # Le origini rimaste senza entry non vanno più proposte come vicine
+        origin_index.discard_prefixes(prefixes, distance_cache.has_origin)
+    # Con lo stato condiviso la memoria è solo un primo livello: l'eviction locale non
+    # cancella le entry dal database, che viene ridotto da trim_shared_cache()
+    if SHARED_STATE and reason == "eviction":
+        return
+    mark_cache_removed(keys)
+
+def mark_cache_removed(keys):
+    """Segna le chiavi eliminate (eviction, scadenza, invalidazione) da cancellare dal backend"""
+    with dirty_cache_lock:
+        dirty_cache_keys.difference_update(keys)
+        removed_cache_keys.update(keys)
+        if cache_flush_state["oldest_dirty_at"] is None:
+            cache_flush_state["oldest_dirty_at"] = time.time()
 
 def save_cache_to_file():
-    """Salva la cache nel file"""
+    """Salva le entry nuove o modificate tramite il backend di persistenza"""
+    global dirty_cache_keys, removed_cache_keys
+    with cache_save_lock:
+        with dirty_cache_lock:
+            keys = dirty_cache_keys
+            removed = removed_cache_keys
+            dirty_cache_keys = set()
+            removed_cache_keys = set()
+            dirty_since = cache_flush_state["oldest_dirty_at"]
+            cache_flush_state["oldest_dirty_at"] = None
+    
+        if not keys and not removed:
+            return
+    
+        try:
+            cache_backend.delete(distance_cache, removed)
+            cache_backend.save(distance_cache, keys)
+            cache_flush_state["last_flush_at"] = time.time()
+            cache_flush_state["last_flush_entries"] = len(keys)
+            cache_flush_state["flushes"] += 1
+            print(f"✅ Saved {len(keys)} new and removed {len(removed)} cache entries ({len(distance_cache)} total) in {cache_backend.path}")
+        except Exception as e:
+            # Le chiavi restano da salvare al prossimo tentativo
+            cache_flush_state["flush_errors"] += 1
+            with dirty_cache_lock:
+                removed_cache_keys.update(removed)
+            mark_cache_dirty(keys, since=dirty_since)
+            print(f"❌ Error saving cache to file: {e}")
+
+def persist_cache():
+    """Salva subito la cache oppure, in modalità write-behind, lascia il salvataggio al flusher"""
+    if not CACHE_WRITE_BEHIND:
+        save_cache_to_file()
+
+def cache_flusher_loop():
+    """Thread di write-behind: salva le chiavi modificate a intervalli o al superamento della soglia"""
+    while True:
+        cache_flush_event.wait(timeout=CACHE_FLUSH_INTERVAL_SECONDS)
+        cache_flush_event.clear()
+        save_cache_to_file()
+
+def compact_cache_snapshot():
+    """Riscrive lo snapshot della cache e svuota il log delle modifiche"""
     try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(distance_cache, f, indent=2)
-        print(f"✅ Saved {len(distance_cache)} cache entries to {CACHE_FILE}")
+        cache_backend.compact(distance_cache)
     except Exception as e:
-        print(f"❌ Error saving cache to file: {e}")
+        print(f"❌ Error compacting cache snapshot: {e}")
 
-def is_rate_limited(ip_address):
-    """Verifica se un IP ha superato il limite di richieste"""
-    current_time = time.time()
-    
-    # Pulisce le richieste vecchie
-    while request_history[ip_address] and current_time - request_history[ip_address][0] > RATE_LIMIT_WINDOW:
-        request_history[ip_address].popleft()
-    
-    # Verifica se ha superato il limite
-    if len(request_history[ip_address]) >= RATE_LIMIT_MAX_REQUESTS:
-        return True
+def cache_compactor_loop():
+    """Thread di compattazione dello snapshot: a intervalli o quando il log è troppo lungo"""
+    while True:
+        time.sleep(min(30, CACHE_SNAPSHOT_COMPACT_INTERVAL_SECONDS))
+        lines = cache_backend.log_lines
+        if lines >= CACHE_SNAPSHOT_COMPACT_LINES or (
+                lines and time.time() - cache_backend.compacted_at >= CACHE_SNAPSHOT_COMPACT_INTERVAL_SECONDS):
+            compact_cache_snapshot()
+
+def start_cache_flusher():
+    """Avvia il thread di write-behind e registra il salvataggio finale allo shutdown"""
+    if hasattr(cache_backend, "open_snapshot"):
+        # atexit esegue in ordine inverso: prima l'ultimo salvataggio, poi la compattazione
+        atexit.register(compact_cache_snapshot)
+        threading.Thread(target=cache_compactor_loop, name="cache-compactor", daemon=True).start()
+    atexit.register(save_cache_to_file)
+    if CACHE_WRITE_BEHIND:
+        threading.Thread(target=cache_flusher_loop, name="cache-flusher", daemon=True).start()
+        print(f"✅ Cache write-behind enabled (every {CACHE_FLUSH_INTERVAL_SECONDS}s or {CACHE_FLUSH_MAX_PENDING} entries)")
+
+def get_cache_persistence_stats():
+    """Ritorna lo stato della persistenza della cache per /admin/stats"""
+    now = time.time()
+    with dirty_cache_lock:
+        pending = len(dirty_cache_keys) + len(removed_cache_keys)
+        oldest_dirty_at = cache_flush_state["oldest_dirty_at"]
+    last_flush_at = cache_flush_state["last_flush_at"]
     
-    # Aggiunge la richiesta corrente
-    request_history[ip_address].append(current_time)
-    return False
+    return {
+        "backend": cache_backend.name,
+        "write_behind": CACHE_WRITE_BEHIND,
+        "flush_interval_seconds": CACHE_FLUSH_INTERVAL_SECONDS,
+        "flush_max_pending": CACHE_FLUSH_MAX_PENDING,
+        "pending_entries": pending,
+        "flush_lag_seconds": round(now - oldest_dirty_at, 3) if oldest_dirty_at else 0,
+        "seconds_since_last_flush": round(now - last_flush_at, 3) if last_flush_at else None,
+        "last_flush_entries": cache_flush_state["last_flush_entries"],
+        "flushes": cache_flush_state["flushes"],
+        "flush_errors": cache_flush_state["flush_errors"],
+        "snapshot_log_entries": getattr(cache_backend, "log_lines", None)
+    }
+
+def hit_rate_limit(ip_address, rule_names):
+    """Conta una richiesta dell'IP sulle regole indicate; ritorna (regola che limita oppure None, richieste)"""
+    return rate_limiter.hit(ip_address, rule_names)
 
-def log_suspicious_activity(ip_address, request_count):
+def log_suspicious_activity(ip_address, request_count, window_seconds=RATE_LIMIT_WINDOW):
     """Log delle attività sospette"""
-    print(f"⚠️  SUSPICIOUS ACTIVITY: IP {ip_address} made {request_count} requests in {RATE_LIMIT_WINDOW} seconds")
+    print(f"⚠️  SUSPICIOUS ACTIVITY: IP {ip_address} made {request_count} requests in {window_seconds} seconds")
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calcola la distanza usando la formula di Haversine (in metri)"""
@@ -147,166 +491,935 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     return int(distance)  # Ritorna in metri come intero
 
 def find_point_by_coordinates(lat, lon):
-    """Trova un punto di interesse dalle sue coordinate"""
-    for point in points_of_interest:
-        if abs(point['lat'] - lat) < 0.0001 and abs(point['lon'] - lon) < 0.0001:
-            return point
-    return None
+    """Trova un punto di interesse dalle sue coordinate (tramite l'indice spaziale)"""
+    return point_index.find(lat, lon)
 
 def round_coordinates(lat, lon, decimals=4):
     """Arrotonda le coordinate al numero specificato di decimali"""
     return round(lat, decimals), round(lon, decimals)
 
+def get_origin_key(origin_lat, origin_lon):
+    """Genera la parte della chiave di cache relativa all'origine"""
+    if CACHE_KEY_MODE == "geohash":
+        return geohash_encode(origin_lat, origin_lon, CACHE_GEOHASH_PRECISION)
+    rounded_origin = round_coordinates(origin_lat, origin_lon)
+    return f"{rounded_origin[0]},{rounded_origin[1]}"
+
+def decode_origin_key(origin_key):
+    """Ritorna le coordinate (lat, lon) rappresentate da una chiave di origine"""
+    if ',' in origin_key:
+        lat, lon = origin_key.split(',')
+        return float(lat), float(lon)
+    return geohash_decode(origin_key)
+
 def get_cache_key(origin_lat, origin_lon, dest_lat, dest_lon):
     """Genera una chiave per la cache"""
-    rounded_origin = round_coordinates(origin_lat, origin_lon)
-    return f"{rounded_origin[0]},{rounded_origin[1]},{dest_lat},{dest_lon}"
+    return f"{get_origin_key(origin_lat, origin_lon)},{dest_lat},{dest_lon}"
 
-def get_distance_with_google(origin_coords, dest_coords):
-    """Ottiene distanza e durata usando Google Maps API"""
-    origin_str = f"{origin_coords[0]},{origin_coords[1]}"
-    dest_str = f"{dest_coords[0]},{dest_coords[1]}"
+def invalidate_point_cache(points):
+    """Rimuove dalla cache tutte le entry che hanno come destinazione uno dei punti indicati"""
+    suffixes = {f",{point['lat']},{point['lon']}" for point in points}
+    # La chiave termina con ",dest_lat,dest_lon": confrontiamo gli ultimi due campi
+    invalidated = distance_cache.invalidate(lambda key: OriginIndex.split_key(key)[1] in suffixes)
     
-    url = (
-        "https://maps.googleapis.com/maps/api/distancematrix/json"
+    if SHARED_STATE:
+        # Il database contiene anche entry mai lette da questo worker
+        invalidated = max(invalidated, cache_backend.delete_suffixes(suffixes))
+        publish_cache_change()
+    return invalidated
+
+origin_index = OriginIndex(CACHE_NEIGHBOR_RADIUS_M, decode_origin_key)
+
+def get_neighbor_distance(origin_lat, origin_lon, point):
+    """Stima la distanza a piedi riusando l'origine in cache più vicina entro CACHE_NEIGHBOR_RADIUS_M.
+
+    La distanza del vicino viene corretta con la differenza tra le distanze Haversine verso il
+    punto; approximation_m è la distanza tra le due origini, cioè l'errore massimo sul tratto
+    in linea d'aria. Ritorna None se non c'è un vicino utilizzabile.
+    """
+    if CACHE_NEIGHBOR_RADIUS_M <= 0:
+        return None
+    
+    suffix = f",{point['lat']},{point['lon']}"
+    for offset, prefix in origin_index.neighbors(origin_lat, origin_lon, haversine_distance):
+        cached = distance_cache.get(prefix + suffix)
+        if cached is None:
+            continue
+        
+        neighbor_lat, neighbor_lon = decode_origin_key(prefix)
+        delta = (haversine_distance(origin_lat, origin_lon, point['lat'], point['lon'])
+                 - haversine_distance(neighbor_lat, neighbor_lon, point['lat'], point['lon']))
+        distance = max(0, cached["distance"] + delta)
+        duration = round(cached["duration"] * distance / cached["distance"]) if cached["distance"] else cached["duration"]
+        
+        with neighbor_stats_lock:
+            neighbor_stats["hits"] += 1
+            neighbor_stats["total_error_m"] += offset
+            neighbor_stats["max_error_m"] = max(neighbor_stats["max_error_m"], offset)
+        return {"distance": distance, "duration": duration, "approximate": True, "approximation_m": offset}
+    
+    return None
+
+def publish_cache_change():
+    """Segnala agli altri worker che la cache condivisa è cambiata (svuotano la memoria locale)"""
+    if shared_state is not None:
+        state_sync["cache_generation"] = shared_state.increment_value("cache_generation")
+
+def trim_shared_cache():
+    """Applica capacità e TTL alla cache condivisa su SQLite"""
+    removed = cache_backend.trim(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, time.time())
+    if removed:
+        print(f"✅ Trimmed {removed} entries from shared cache")
+
+def sync_shared_state(force=False):
+    """Allinea questo worker allo stato condiviso: reload dei punti e svuotamento della cache locale.
+
+    Eseguito al massimo ogni STATE_SYNC_INTERVAL_SECONDS: un /get_points o una pulizia della cache
+    su un worker raggiunge gli altri entro quell'intervallo.
+    """
+    now = time.monotonic()
+    if not force and now - state_sync["checked_at"] < STATE_SYNC_INTERVAL_SECONDS:
+        return
+    state_sync["checked_at"] = now
+    
+    try:
+        points_mtime = os.path.getmtime(POINTS_FILE)
+    except OSError:
+        points_mtime = 0
+    if points_mtime != state_sync["points_mtime"]:
+        state_sync["points_mtime"] = points_mtime
+        load_points_from_file()
+    
+    generation = shared_state.get_value("cache_generation")
+    if generation != state_sync["cache_generation"]:
+        state_sync["cache_generation"] = generation
+        # Solo la memoria locale: il database è già aggiornato
+        distance_cache.clear()
+        origin_index.clear()
+        response_cache.clear()
+        print(f"🔄 Shared cache changed (generation {generation}), local cache cleared")
+    
+    if now - state_sync["trimmed_at"] >= SHARED_CACHE_TRIM_INTERVAL_SECONDS:
+        state_sync["trimmed_at"] = now
+        trim_shared_cache()
+
+@app.before_request
+def before_request_sync():
+    """Con SHARED_STATE allinea periodicamente il worker allo stato condiviso"""
+    if SHARED_STATE:
+        try:
+            sync_shared_state()
+        except Exception as e:
+            print(f"❌ Error syncing shared state: {e}")
+
+@app.before_request
+def enforce_rate_limits():
+    """Applica le regole di rate limiting dell'endpoint richiesto"""
+    client_ip = get_client_ip(request.environ.get('HTTP_X_FORWARDED_FOR'), request.remote_addr)
+    limited = check_rate_limit(client_ip, request.endpoint)
+    if limited:
+        return jsonify(limited[0]), limited[1]
+
+def lookup_cached_many(cache_keys):
+    """Cerca le chiavi nella cache in memoria e, con SHARED_STATE, nella cache condivisa su SQLite.
+
+    Ritorna {chiave: valore} per le sole chiavi trovate.
+    """
+    # Con la cache compatta le chiavi della stessa origine sono una sola riga
+    found = distance_cache.lookup_many(cache_keys)
+    missing = [key for key in cache_keys if key not in found]
+    
+    if SHARED_STATE and missing:
+        # Entry scritte da altri worker: vengono copiate nella memoria locale
+        for key, value in cache_backend.get_many(missing).items():
+            distance_cache.insert(key, value)
+            found[key] = value
+            state_sync["shared_cache_hits"] += 1
+    
+    return found
+
+def lookup_cached(cache_key):
+    """Come lookup_cached_many per una sola chiave; ritorna il valore oppure None"""
+    return lookup_cached_many([cache_key]).get(cache_key)
+
+def drop_legacy_destination_keys():
+    """Elimina le entry la cui destinazione non sono le coordinate esatte di un punto di interesse.
+
+    /distance salvava le chiavi con le coordinate della richiesta: quelle entry non vengono più
+    lette. Viene eseguita all'avvio dopo il caricamento; con la cache già migrata confronta solo
+    l'elenco delle destinazioni e non elimina niente.
+    """
+    if not points_of_interest:
+        # Senza punti caricati ogni destinazione sembrerebbe obsoleta
+        return 0
+    current = {f",{point['lat']},{point['lon']}" for point in points_of_interest}
+    legacy = {suffix for suffix in distance_cache.destinations() if suffix not in current}
+    if not legacy:
+        return 0
+    
+    dropped = distance_cache.invalidate(lambda key: split_cache_key(key)[1] in legacy)
+    if SHARED_STATE:
+        dropped = max(dropped, cache_backend.delete_suffixes(legacy))
+    print(f"✅ Dropped {dropped} cache entries of {len(legacy)} destinations that are not points of interest")
+    return dropped
+
+def get_cache_key_stats():
+    """Ritorna configurazione e statistiche delle chiavi di cache per /admin/stats"""
+    with neighbor_stats_lock:
+        stats = dict(neighbor_stats)
+    hits = stats["hits"]
+    return {
+        "mode": CACHE_KEY_MODE,
+        "geohash_precision": CACHE_GEOHASH_PRECISION if CACHE_KEY_MODE == "geohash" else None,
+        "neighbor_radius_m": CACHE_NEIGHBOR_RADIUS_M,
+        "neighbor_origins": len(origin_index),
+        "neighbor_hits": hits,
+        "neighbor_avg_error_m": round(stats["total_error_m"] / hits, 1) if hits else None,
+        "neighbor_max_error_m": stats["max_error_m"]
+    }
+
+# Endpoint dei provider (condivisi tra il server sincrono e quello asincrono)
+GOOGLE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+# ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/foot-walking"
+ORS_DIRECTIONS_URL = "https://ors.fabvision.it/ors/v2/directions/foot-walking"
+ORS_MATRIX_URL = "https://ors.fabvision.it/ors/v2/matrix/foot-walking"
+ORS_HEADERS = {
+    # "Authorization": OPENROUTE_API_KEY,
+    "Content-Type": "application/json"
+}
+# Errori ORS che indicano una destinazione non raggiungibile (percorso o punto non trovato):
+# sono risposte valide, non errori del provider
+ORS_NO_ROUTE_CODES = {2009, 2010, 6010}
+STRAPI_POINTS_URL = os.getenv("STRAPI_POINTS_URL", "https://strapi2.lookupferrara.it/api/points")
+# Paginazione della lettura dei punti: record per pagina e pagine richieste in parallelo
+STRAPI_PAGE_SIZE = int(os.getenv("STRAPI_PAGE_SIZE", "100"))
+STRAPI_FETCH_CONCURRENCY = int(os.getenv("STRAPI_FETCH_CONCURRENCY", "4"))
+
+def build_google_matrix_url(origin_coords, dest_coords_list):
+    """URL Distance Matrix (walking) da origin verso le destinazioni indicate"""
+    return build_google_multi_matrix_url([origin_coords], dest_coords_list)
+
+def build_google_multi_matrix_url(origins, dest_coords_list):
+    """URL Distance Matrix (walking) da più origini verso le destinazioni indicate"""
+    origin_str = "|".join(f"{lat},{lon}" for lat, lon in origins)
+    dest_str = "|".join(f"{lat},{lon}" for lat, lon in dest_coords_list)
+    return (
+        f"{GOOGLE_MATRIX_URL}"
         f"?origins={requests.utils.quote(origin_str)}"
         f"&destinations={requests.utils.quote(dest_str)}"
         f"&key={GOOGLE_API_KEY}&mode=walking"
     )
-    
+
+def parse_google_matrix(data, size):
+    """Estrae da una risposta Distance Matrix la lista di (distance, duration), (None, None) se non risolta.
+
+    Un elemento ZERO_RESULTS o NOT_FOUND è una risposta valida (nessun percorso); uno stato di
+    errore della richiesta (OVER_QUERY_LIMIT, REQUEST_DENIED, ...) solleva un'eccezione.
+    """
+    return parse_google_matrix_rows(data, 1, size)[0]
+
+def parse_google_matrix_rows(data, origins, size):
+    """Come parse_google_matrix per più origini: una lista di risultati per origine"""
+    if data.get('status') != 'OK':
+        raise ValueError(f"Distance Matrix status {data.get('status')}: {data.get('error_message', '')}")
+    rows = []
+    for row in data['rows'][:origins]:
+        results = [(None, None)] * size
+        for i, element in enumerate(row['elements'][:size]):
+            if element['status'] == 'OK':
+                results[i] = (element['distance']['value'], element['duration']['value'])
+        rows.append(results)
+    if len(rows) < origins:
+        raise ValueError(f"Distance Matrix returned {len(rows)} rows for {origins} origins")
+    return rows
+
+def build_ors_directions_body(origin_coords, dest_coords):
+    """Corpo della richiesta ORS directions (coordinate [lon, lat])"""
+    return {
+        "coordinates": [[origin_coords[1], origin_coords[0]], [dest_coords[1], dest_coords[0]]]
+    }
+
+def parse_ors_directions(result):
+    """Estrae (distance, duration) da una risposta ORS directions"""
+    summary = result['routes'][0]['summary']
+    return int(summary['distance']), int(summary['duration'])
+
+def build_ors_matrix_body(origin_coords, dest_coords_list):
+    """Corpo della richiesta ORS matrix: la sorgente è sempre in posizione 0"""
+    return build_ors_multi_matrix_body([origin_coords], dest_coords_list)
+
+def build_ors_multi_matrix_body(origins, dest_coords_list):
+    """Corpo della richiesta ORS matrix con più sorgenti: prima le origini, poi le destinazioni"""
+    # ORS vuole [lon, lat]
+    locations = [[lon, lat] for lat, lon in origins] + [[lon, lat] for lat, lon in dest_coords_list]
+    return {
+        "locations": locations,
+        "sources": list(range(len(origins))),
+        "destinations": list(range(len(origins), len(locations))),
+        "metrics": ["distance", "duration"]
+    }
+
+def ors_no_route(response):
+    """True se la risposta di errore ORS dice solo che il percorso o il punto non esistono"""
+    if response.status_code != 404:
+        return False
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        element = data['rows'][0]['elements'][0]
-        if element['status'] == 'OK':
-            distance = element['distance']['value']  # in metri
-            duration = element['duration']['value']   # in secondi
-            return distance, duration
-        else:
-            return None, None
-    except Exception as e:
-        print(f"❌ Google API error: {e}")
-        return None, None
+        return response.json().get('error', {}).get('code') in ORS_NO_ROUTE_CODES
+    except (ValueError, AttributeError):
+        return False
+
+def parse_ors_matrix(result, size):
+    """Estrae da una risposta ORS matrix la lista di (distance, duration), (None, None) se non risolta"""
+    return parse_ors_matrix_rows(result, 1, size)[0]
+
+def parse_ors_matrix_rows(result, origins, size):
+    """Come parse_ors_matrix per più sorgenti: una lista di risultati per origine"""
+    rows = []
+    for distances, durations in zip(result['distances'][:origins], result['durations'][:origins]):
+        results = [(None, None)] * size
+        for i in range(size):
+            if distances[i] is not None and durations[i] is not None:
+                results[i] = (int(distances[i]), int(durations[i]))
+        rows.append(results)
+    if len(rows) < origins:
+        raise ValueError(f"ORS matrix returned {len(rows)} rows for {origins} sources")
+    return rows
+
+def get_distance_with_google(origin_coords, dest_coords):
+    """Ottiene distanza e durata usando Google Maps API.
+
+    (None, None) se Google non trova un percorso; gli errori (rete, HTTP, stato della risposta)
+    vengono sollevati e il router li conta come fallimenti del provider.
+    """
+    url = build_google_matrix_url(origin_coords, [dest_coords])
+    response = http_get(url, timeout=10)
+    response.raise_for_status()
+    return parse_google_matrix(response.json(), 1)[0]
 
 def get_distance_with_openroute(origin_coords, dest_coords):
-    """Ottiene distanza e durata usando OpenRouteService API"""
-    # url = "https://api.openrouteservice.org/v2/directions/foot-walking"
-    url = "https://ors.fabvision.it/ors/v2/directions/foot-walking"
-    headers = {
-        # "Authorization": OPENROUTE_API_KEY,
-        "Content-Type": "application/json"
-    }
+    """Ottiene distanza e durata usando OpenRouteService API (errori come get_distance_with_google)"""
+    data = build_ors_directions_body(origin_coords, dest_coords)
+    response = http_post(ORS_DIRECTIONS_URL, headers=ORS_HEADERS, json=data, timeout=10)
+    if ors_no_route(response):
+        return None, None
+    response.raise_for_status()
+    return parse_ors_directions(response.json())
+
+def chunked(items, size):
+    """Divide una lista in blocchi di dimensione massima size"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def get_distances_with_google_matrix(origin_coords, dest_coords_list):
+    """Ottiene distanza e durata verso più destinazioni con una sola chiamata Distance Matrix per blocco.
+
+    Ritorna una lista di tuple (distance, duration) nello stesso ordine di dest_coords_list,
+    con (None, None) per le destinazioni senza percorso. Un errore in un blocco viene sollevato
+    (il router prova il provider successivo per tutte le destinazioni).
+    """
+    results = [(None, None)] * len(dest_coords_list)
     
-    data = {
-        "coordinates": [[origin_coords[1], origin_coords[0]], [dest_coords[1], dest_coords[0]]]
-    }
+    offset = 0
+    for chunk in chunked(dest_coords_list, GOOGLE_MATRIX_MAX_DESTINATIONS):
+        response = http_get(build_google_matrix_url(origin_coords, chunk), timeout=10)
+        response.raise_for_status()
+        results[offset:offset + len(chunk)] = parse_google_matrix(response.json(), len(chunk))
+        offset += len(chunk)
+    
+    return results
+
+def get_distances_with_openroute_matrix(origin_coords, dest_coords_list):
+    """Ottiene distanza e durata verso più destinazioni usando l'endpoint matrix di OpenRouteService.
+
+    Ritorna una lista di tuple (distance, duration) nello stesso ordine di dest_coords_list,
+    con (None, None) per le destinazioni senza percorso; errori come get_distances_with_google_matrix.
+    """
+    results = [(None, None)] * len(dest_coords_list)
+    
+    offset = 0
+    for chunk in chunked(dest_coords_list, ORS_MATRIX_MAX_DESTINATIONS):
+        data = build_ors_matrix_body(origin_coords, chunk)
+        response = http_post(ORS_MATRIX_URL, headers=ORS_HEADERS, json=data, timeout=10)
+        if not ors_no_route(response):
+            response.raise_for_status()
+            results[offset:offset + len(chunk)] = parse_ors_matrix(response.json(), len(chunk))
+        offset += len(chunk)
+    
+    return results
+
+def matrix_block_parts(items):
+    """Origini e destinazioni distinte di un blocco di coppie (origin_coords, dest_coords, chiave)
+    e posizione (riga, colonna) di ogni coppia nella matrice"""
+    origins = {}
+    dests = {}
+    cells = []
+    for origin_coords, dest_coords, _ in items:
+        row = origins.setdefault(origin_coords, len(origins))
+        column = dests.setdefault(dest_coords, len(dests))
+        cells.append((row, column))
+    return list(origins), list(dests), cells
+
+def plan_matrix_blocks(items):
+    """Raggruppa le coppie (origin_coords, dest_coords, chiave) in blocchi da una sola chiamata matrix.
+
+    Ogni blocco ha al massimo GOOGLE_MATRIX_MAX_ORIGINS origini, GOOGLE_MATRIX_MAX_DESTINATIONS
+    destinazioni e GOOGLE_MATRIX_MAX_ELEMENTS elementi (origini × destinazioni). Le coppie di una
+    stessa origine restano insieme, così origini con destinazioni in comune condividono le colonne.
+    """
+    by_origin = group_by_origin(items)
+    
+    blocks = []
+    block, origins, dests = [], set(), set()
+    for origin_coords, origin_items in by_origin.items():
+        for piece in chunked(origin_items, GOOGLE_MATRIX_MAX_DESTINATIONS):
+            piece_dests = {dest_coords for _, dest_coords, _ in piece}
+            new_origins = origins | {origin_coords}
+            new_dests = dests | piece_dests
+            if block and (len(new_origins) > GOOGLE_MATRIX_MAX_ORIGINS
+                          or len(new_dests) > GOOGLE_MATRIX_MAX_DESTINATIONS
+                          or len(new_origins) * len(new_dests) > GOOGLE_MATRIX_MAX_ELEMENTS):
+                blocks.append(block)
+                block, new_origins, new_dests = [], {origin_coords}, piece_dests
+            block.extend(piece)
+            origins, dests = new_origins, new_dests
+    if block:
+        blocks.append(block)
+    return blocks
+
+def get_distances_with_google_multi_matrix(items):
+    """Una chiamata Distance Matrix per un blocco di plan_matrix_blocks; un risultato per coppia"""
+    origins, dests, cells = matrix_block_parts(items)
+    response = http_get(build_google_multi_matrix_url(origins, dests), timeout=10)
+    response.raise_for_status()
+    rows = parse_google_matrix_rows(response.json(), len(origins), len(dests))
+    return [rows[row][column] for row, column in cells]
+
+def get_distances_with_openroute_multi_matrix(items):
+    """Una chiamata ORS matrix (sources/destinations) per un blocco di plan_matrix_blocks"""
+    origins, dests, cells = matrix_block_parts(items)
+    data = build_ors_multi_matrix_body(origins, dests)
+    response = http_post(ORS_MATRIX_URL, headers=ORS_HEADERS, json=data, timeout=10)
+    if ors_no_route(response):
+        return [(None, None)] * len(items)
+    response.raise_for_status()
+    rows = parse_ors_matrix_rows(response.json(), len(origins), len(dests))
+    return [rows[row][column] for row, column in cells]
+
+def get_distances_with_walking_graph(origin_coords, dest_coords_list):
+    """Ottiene distanza e durata verso più destinazioni dal grafo pedonale locale (una sola ricerca).
+
+    Ritorna una lista di tuple (distance, duration) nello stesso ordine di dest_coords_list,
+    con (None, None) per gli elementi non risolti o se il grafo non è configurato.
+    """
+    if walking_graph is None:
+        return [(None, None)] * len(dest_coords_list)
     
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=10)
-        response.raise_for_status()
-        result = response.json()
-        
-        summary = result['routes'][0]['summary']
-        distance = int(summary['distance'])  # in metri
-        duration = int(summary['duration'])   # in secondi
-        return distance, duration
+        return walking_graph.distances_from(origin_coords, dest_coords_list)
     except Exception as e:
-        print(f"❌ OpenRoute API error: {e}")
-        return None, None
+        print(f"❌ Walking graph error: {e}")
+        return [(None, None)] * len(dest_coords_list)
 
-@app.route('/get_points', methods=['GET', 'POST'])
-@limiter.limit("5 per minute")
-def get_points():
-    """Endpoint per ricaricare i punti di interesse da Strapi"""
-    secret = request.args.get('secret')
+def store_distance_results(cache_keys, results):
+    """Salva in cache (in memoria) i risultati validi"""
+    stored = []
+    for cache_key, (distance, duration) in zip(cache_keys, results):
+        if distance is not None:
+            distance_cache.store(cache_key, distance, duration)
+            stored.append(cache_key)
+    response_cache.invalidate({split_cache_key(cache_key)[0] for cache_key in stored})
+    mark_cache_dirty(stored)
+    if CACHE_NEIGHBOR_RADIUS_M > 0:
+        origin_index.add_keys(stored)
+
+def distance_found(value):
+    """Risultato da usare per una destinazione; senza percorso il router prova il provider
+    successivo (la chiamata conta comunque come riuscita per il circuit breaker)"""
+    return value[0] is not None
+
+def any_distance_found(values):
+    """Come distance_found per una chiamata matrix: da usare se ha risolto almeno una destinazione"""
+    return any(distance is not None for distance, _ in values)
+
+def route_missing_steps(results, dest_coords_list, provider_calls):
+    """Logica di route_missing condivisa tra thread e asyncio (app2_asgi.route_missing).
+
+    Generatore: produce le chiamate {provider: funzione} da passare al router e riceve il suo
+    esito (provider, valori); completa results e termina quando non manca niente o nessun
+    provider risponde.
+    """
+    tried = set()
+    missing = [i for i, (distance, _) in enumerate(results) if distance is None]
+    while missing:
+        calls = provider_calls([dest_coords_list[i] for i in missing])
+        provider, values = yield {name: call for name, call in calls.items() if name not in tried}
+        if provider is None:
+            break
+        tried.add(provider)
+        for i, value in zip(missing, values):
+            results[i] = value
+        missing = [i for i, (distance, _) in enumerate(results) if distance is None]
+
+def route_missing(results, dest_coords_list, provider_calls):
+    """Completa gli elementi (None, None) di results con i provider scelti dal router.
+
+    provider_calls(dests) ritorna {provider: funzione} per le destinazioni (o le coppie) indicate;
+    gli elementi ancora mancanti dopo un provider riuscito passano al successivo.
+    """
+    steps = route_missing_steps(results, dest_coords_list, provider_calls)
+    try:
+        calls = next(steps)
+        while True:
+            calls = steps.send(provider_router.run(calls, any_distance_found))
+    except StopIteration:
+        return results
+
+def resolve_distance(origin_coords, dest_coords, cache_key):
+    """Risolve una singola destinazione con i provider nell'ordine del router e la salva in cache
+    (il grafo locale è già stato interrogato da resolve_with_walking_graph)"""
+    _, (distance, duration) = provider_router.run({
+        "google": lambda: get_distance_with_google(origin_coords, dest_coords),
+        "openroute": lambda: get_distance_with_openroute(origin_coords, dest_coords)
+    }, distance_found, default=(None, None))
     
-    if secret != ADMIN_SECRET:
-        return jsonify({"error": "Invalid secret"}), 401
+    store_distance_results([cache_key], [(distance, duration)])
+    return distance, duration
+
+def resolve_distances_chunk(origin_coords, dest_coords_list, cache_keys):
+    """Risolve un blocco di destinazioni non trovate nel grafo locale con Google Matrix e ORS
+    matrix, nell'ordine scelto dal router"""
+    results = [(None, None)] * len(dest_coords_list)
+    
+    route_missing(results, dest_coords_list, lambda dests: {
+        "google": lambda: get_distances_with_google_matrix(origin_coords, dests),
+        "openroute": lambda: get_distances_with_openroute_matrix(origin_coords, dests)
+    })
     
+    # Anche se la richiesta è già scaduta, il risultato resta in cache per la prossima
+    store_distance_results(cache_keys, results)
+    return results
+
+def resolve_distances_block(items):
+    """Risolve un blocco di coppie di /distances/batch con Google Matrix o ORS matrix (più origini
+    in una chiamata), nell'ordine scelto dal router, e lo salva in cache"""
+    results = [(None, None)] * len(items)
+    
+    route_missing(results, items, lambda pairs: {
+        "google": lambda: get_distances_with_google_multi_matrix(pairs),
+        "openroute": lambda: get_distances_with_openroute_multi_matrix(pairs)
+    })
+    
+    store_distance_results([cache_key for _, _, cache_key in items], results)
+    return results
+
+def claim_inflight(cache_keys):
+    """Single-flight: associa ad ogni chiave la Future della chiamata upstream in corso.
+
+    Ritorna (futures, owned): futures mappa chiave -> Future, owned sono le posizioni in
+    cache_keys per cui questa richiesta deve effettivamente chiamare il provider.
+    """
+    futures = {}
+    owned = []
+    with inflight_lock:
+        for position, key in enumerate(cache_keys):
+            if key in futures:
+                continue
+            future = inflight_lookups.get(key)
+            if future is not None:
+                upstream_stats["coalesced_lookups"] += 1
+            else:
+                future = Future()
+                cached = distance_cache.get(key)
+                if cached is not None:
+                    # Un'altra richiesta ha appena completato la stessa chiave
+                    future.set_result((cached["distance"], cached["duration"]))
+                else:
+                    inflight_lookups[key] = future
+                    owned.append(position)
+            futures[key] = future
+    return futures, owned
+
+def run_inflight(futures, cache_keys, func, *args):
+    """Esegue func (che ritorna un risultato per chiave) e completa le Future delle chiavi"""
     try:
-        # Interroga Strapi
-        headers = {"Authorization": f"Bearer {STRAPI_BEARER_TOKEN}"}
-        response = requests.get("https://strapi2.lookupferrara.it/api/points", headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        strapi_data = response.json()
+        results = func(*args)
+    except Exception as e:
+        print(f"❌ Upstream task error: {e}")
+        results = [(None, None)] * len(cache_keys)
+    complete_inflight(futures, cache_keys, results)
 
-        print("------------")
-        print(f"Received {len(strapi_data.get('data', []))} points from Strapi")
-        print("------------")
-        
-        # Estrae i punti di interesse nel formato richiesto
-        global points_of_interest
-        points_of_interest = []
-        
-        for item in strapi_data.get('data', []):
-            # I dati sono direttamente nell'item, non in 'attributes'
-            points_of_interest.append({
-                'id': item['id'],
-                'lat': float(item.get('Latitude', 0)),
-                'lon': float(item.get('Longitude', 0)),
-                'name': item.get('Name', f"Point {item['id']}")  # Aggiungiamo anche il nome per debug
-            })
-        
-        # Salva nel file
-        save_points_to_file()
-        
-        return jsonify({
-            "success": True,
-            "points_loaded": len(points_of_interest),
-            "points": points_of_interest
+def complete_inflight(futures, cache_keys, results):
+    """Toglie le chiavi dalle chiamate in corso e ne completa le Future con i risultati"""
+    with inflight_lock:
+        for key in cache_keys:
+            if inflight_lookups.get(key) is futures[key]:
+                del inflight_lookups[key]
+    
+    for key, value in zip(cache_keys, results):
+        if not futures[key].done():
+            futures[key].set_result(value)
+
+def complete_found(futures, cache_keys, results):
+    """Salva in cache e completa le chiavi già risolte (dal grafo pedonale) prima dei provider"""
+    if not cache_keys:
+        return
+    try:
+        store_distance_results(cache_keys, results)
+    except Exception as e:
+        print(f"❌ Upstream task error: {e}")
+    complete_inflight(futures, cache_keys, results)
+
+def split_graph_results(items, results):
+    """Divide le coppie (origin_coords, dest_coords, chiave) secondo l'esito del grafo pedonale.
+
+    Ritorna (chiavi trovate, loro risultati, coppie rimaste per i provider).
+    """
+    found = [(item[2], value) for item, value in zip(items, results) if value[0] is not None]
+    leftover = [item for item, value in zip(items, results) if value[0] is None]
+    return [key for key, _ in found], [value for _, value in found], leftover
+
+def group_by_origin(items):
+    """Coppie (origin_coords, dest_coords, chiave) raggruppate per origine, nell'ordine ricevuto"""
+    by_origin = {}
+    for item in items:
+        by_origin.setdefault(item[0], []).append(item)
+    return by_origin
+
+def skip_after_deadline(futures, block, deadline):
+    """Se la deadline della richiesta è passata completa il blocco con None senza chiamare i
+    provider (la richiesta ha già risposto con un timeout) e ritorna True"""
+    if time.monotonic() < deadline:
+        return False
+    cache_keys = [cache_key for _, _, cache_key in block]
+    upstream_stats["skipped_after_deadline"] += len(cache_keys)
+    complete_inflight(futures, cache_keys, [None] * len(cache_keys))
+    return True
+
+def submit_provider_chunks(futures, origin_coords, dest_coords_list, cache_keys, executor=None):
+    """Divide le destinazioni in blocchi di GOOGLE_MATRIX_MAX_DESTINATIONS, un task per blocco
+    (sul pool upstream o su executor)"""
+    executor = executor or upstream_executor
+    for offset in range(0, len(cache_keys), GOOGLE_MATRIX_MAX_DESTINATIONS):
+        chunk = dest_coords_list[offset:offset + GOOGLE_MATRIX_MAX_DESTINATIONS]
+        keys = cache_keys[offset:offset + GOOGLE_MATRIX_MAX_DESTINATIONS]
+        executor.submit(run_inflight, futures, keys, resolve_distances_chunk, origin_coords, chunk, keys)
+
+def resolve_with_walking_graph(futures, items, submit_leftover):
+    """Task sul pool del grafo: una sola ricerca per origine verso tutte le sue destinazioni, poi
+    submit_leftover(coppie rimaste) affida le altre ai provider sul pool upstream"""
+    leftover = []
+    for origin_coords, origin_items in group_by_origin(items).items():
+        results = get_distances_with_walking_graph(origin_coords, [dest for _, dest, _ in origin_items])
+        found_keys, found_results, rest = split_graph_results(origin_items, results)
+        complete_found(futures, found_keys, found_results)
+        leftover.extend(rest)
+    if leftover:
+        submit_leftover(leftover)
+
+def start_with_walking_graph(futures, items, submit_leftover):
+    """Con il grafo pedonale lo interroga sul suo pool prima dei provider, altrimenti passa
+    subito tutte le coppie a submit_leftover"""
+    if walking_graph is not None and items:
+        graph_executor.submit(resolve_with_walking_graph, futures, items, submit_leftover)
+    elif items:
+        submit_leftover(items)
+
+def start_distances_batch(origin_coords, dest_coords_list, cache_keys, executor=None):
+    """Avvia la risoluzione delle destinazioni sul pool upstream senza attenderla.
+
+    Ritorna il dizionario chiave -> Future (single-flight: le chiavi già in corso per altre
+    richieste riusano la loro Future). Con il grafo pedonale un primo task lo interroga una volta
+    per tutte le destinazioni; quelle rimaste, o tutte senza grafo, vengono divise in blocchi di
+    GOOGLE_MATRIX_MAX_DESTINATIONS e ogni blocco diventa un task (sul pool upstream o su executor).
+    """
+    futures, owned = claim_inflight(cache_keys)
+    items = [(origin_coords, dest_coords_list[i], cache_keys[i]) for i in owned]
+    start_with_walking_graph(futures, items, lambda rest: submit_provider_chunks(
+        futures, origin_coords, [dest for _, dest, _ in rest], [key for _, _, key in rest], executor
+    ))
+    return futures
+
+def get_distances_batch(origin_coords, dest_coords_list, cache_keys, deadline=None, executor=None):
+    """Risolve un insieme di destinazioni in parallelo sul pool upstream (o su executor).
+
+    Le chiavi già in corso di risoluzione da parte di altre richieste vengono attese invece di
+    essere richieste di nuovo; le altre vengono divise in blocchi di GOOGLE_MATRIX_MAX_DESTINATIONS
+    e ogni blocco diventa un task. Ritorna una lista di tuple (distance, duration) nello stesso
+    ordine di dest_coords_list; gli elementi non completati entro la deadline (time.monotonic())
+    valgono None.
+    """
+    if not dest_coords_list:
+        return []
+    
+    futures = start_distances_batch(origin_coords, dest_coords_list, cache_keys, executor)
+    remaining = None if deadline is None else max(0, deadline - time.monotonic())
+    _, pending = wait_futures(list(futures.values()), timeout=remaining)
+    
+    if pending:
+        upstream_stats["timed_out_requests"] += 1
+    
+    return [futures[key].result() if futures[key].done() else None for key in cache_keys]
+
+def warmup_cached_keys(cache_keys):
+    """Chiavi già in cache (memoria e, con SHARED_STATE, database) senza toccare le statistiche"""
+    found = {key for key in cache_keys if distance_cache.get(key) is not None}
+    if SHARED_STATE:
+        found.update(cache_backend.get_many([key for key in cache_keys if key not in found]))
+    return found
+
+warmup_job = WarmupJob(
+    WARMUP_STATE_FILE,
+    resolve=lambda origin, dests, keys: get_distances_batch(
+        origin, dests, keys, deadline=time.monotonic() + WARMUP_CHUNK_DEADLINE_SECONDS, executor=warmup_executor
+    ),
+    cached_keys=warmup_cached_keys,
+    cache_key=get_cache_key,
+    persist=persist_cache
+)
+
+def run_warmup(step_m=None, margin_m=None, max_elements=None, elements_per_second=None, restart=False,
+               background=True, bounds=None, points=None):
+    """Costruisce la griglia sull'area dei punti attuali e avvia il warm-up (in un thread se background).
+
+    Con points il warm-up riguarda solo quei punti (es. quelli nuovi dopo un reload), sempre sulla
+    griglia dell'intera area. Ritorna lo stato del job; in background False se un warm-up è già in corso.
+    """
+    if background and warmup_job.is_running():
+        return False
+    if not len(point_index):
+        return {"state": "idle", "error": "No points of interest loaded"}
+    index = PointIndex(points) if points else point_index
+    
+    step_m = WARMUP_STEP_M if step_m is None else step_m
+    margin_m = WARMUP_MARGIN_M if margin_m is None else margin_m
+    precision = CACHE_GEOHASH_PRECISION if CACHE_KEY_MODE == "geohash" else None
+    # In modalità round un'origine fuori griglia trova la cella precalcolata solo con il riuso dei
+    # vicini: il punto più lontano dai nodi di una griglia a passo step_m dista step_m/√2
+    if not precision and CACHE_NEIGHBOR_RADIUS_M < step_m / sqrt(2):
+        return {
+            "state": "idle",
+            "error": f"Warm-up with CACHE_KEY_MODE=round needs CACHE_NEIGHBOR_RADIUS_M >= {step_m / sqrt(2):.1f} "
+                     f"(step_m/√2), or CACHE_KEY_MODE=geohash"
+        }
+    bounds = bounds or WARMUP_BOUNDS
+    if bounds:
+        # Area esplicita: un punto isolato non allarga la griglia a tutta la provincia
+        bounds = tuple(map(float, bounds.split(',')))
+    else:
+        bounds = service_bounds(point_index.points, margin_m)
+    origins = build_grid(bounds, step_m, precision)
+    # Il checkpoint vale solo per la stessa griglia
+    signature = {
+        "bounds": [round(value, 6) for value in bounds],
+        "step_m": None if precision else step_m,
+        "key_mode": CACHE_KEY_MODE,
+        "geohash_precision": precision,
+        "cells": len(origins),
+        "points": sorted(point['id'] for point in points) if points else None
+    }
+    options = {
+        "max_elements": WARMUP_MAX_ELEMENTS if max_elements is None else max_elements,
+        "elements_per_second": WARMUP_ELEMENTS_PER_SECOND if elements_per_second is None else elements_per_second,
+        "restart": restart
+    }
+    estimated = estimate_elements(index, origins)
+    print(f"🔄 Warm-up grid: {len(origins)} origins x {len(index)} points, about {estimated} elements")
+    # Oltre la capacità della cache il warm-up eliminerebbe (LRU) le entry appena calcolate
+    if CACHE_MAX_ENTRIES > 0 and estimated > CACHE_MAX_ENTRIES:
+        return {
+            "state": "idle",
+            "error": f"Warm-up grid needs about {estimated} cache entries, more than CACHE_MAX_ENTRIES={CACHE_MAX_ENTRIES}: "
+                     f"use a larger step_m, smaller bounds or a larger cache"
+        }
+    if options["max_elements"] and estimated > options["max_elements"]:
+        runs = -(-estimated // options["max_elements"])
+        print(f"⚠️  Warm-up needs about {estimated} elements, budget is {options['max_elements']} per run: "
+              f"about {runs} runs to complete (resumed from the checkpoint)")
+    options["estimated_elements"] = estimated
+    
+    if not background:
+        return warmup_job.run(index, origins, signature, **options)
+    if not warmup_job.start(index, origins, signature, **options):
+        return False
+    return warmup_job.get_status()
+
+def parse_strapi_points(strapi_data):
+    """Converte la risposta di Strapi nella lista dei punti di interesse"""
+    new_points = []
+    for item in strapi_data.get('data', []):
+        # I dati sono direttamente nell'item, non in 'attributes'
+        new_points.append({
+            'id': item['id'],
+            'lat': float(item.get('Latitude', 0)),
+            'lon': float(item.get('Longitude', 0)),
+            'name': item.get('Name', f"Point {item['id']}")  # Aggiungiamo anche il nome per debug
         })
-        
+    return new_points
+
+def record_points_changes(summary):
+    """Registra le differenze di un reload in POINTS_CHANGES_FILE"""
+    try:
+        with open(POINTS_CHANGES_FILE, 'a') as f:
+            f.write(json.dumps(summary, separators=(',', ':')) + "\n")
     except Exception as e:
-        return jsonify({"error": f"Failed to load points from Strapi: {str(e)}"}), 500
+        print(f"❌ Error recording points changes: {e}")
 
-@app.route('/distance', methods=['GET'])
-@limiter.limit("20 per minute")
-def get_distance():
-    """Endpoint per calcolare la distanza tra origin e destination"""
-    # Rate limiting personalizzato
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+def apply_points(new_points, warmup=False):
+    """Applica un nuovo elenco di punti confrontandolo con quello attuale.
+
+    Indice e file vengono sostituiti; dalla cache si tolgono solo le entry dei punti spostati o
+    rimossi (la chiave contiene le coordinate della destinazione, quelle dei punti invariati
+    restano valide). Con warmup avvia il warm-up dei punti nuovi o spostati. Ritorna il riepilogo.
+    """
+    global points_of_interest
+    changes = diff_points(points_of_interest, new_points)
+    
+    points_of_interest = new_points
+    rebuild_point_index()
+    save_points_to_file()
+    
+    # Coordinate non più usate da nessun punto: le loro entry non verrebbero più lette
+    current = {(point['lat'], point['lon']) for point in new_points}
+    stale = [point for point in changes["removed"] + [old for old, _ in changes["moved"]]
+             if (point['lat'], point['lon']) not in current]
+    invalidated = invalidate_point_cache(stale) if stale else 0
+    if invalidated:
+        persist_cache()
+    
+    summary = {
+        "reloaded_at": time.time(),
+        "added": [point['id'] for point in changes["added"]],
+        "removed": [point['id'] for point in changes["removed"]],
+        "moved": [point['id'] for _, point in changes["moved"]],
+        "updated": [point['id'] for point in changes["updated"]],
+        "unchanged": changes["unchanged"],
+        "invalidated_entries": invalidated
+    }
+    record_points_changes(summary)
+    print(f"✅ Points reload: {len(summary['added'])} added, {len(summary['removed'])} removed, "
+          f"{len(summary['moved'])} moved, {len(summary['updated'])} updated, {summary['unchanged']} unchanged, "
+          f"{invalidated} cache entries invalidated")
+    
+    warm_points = changes["added"] + [point for _, point in changes["moved"]]
+    if warmup and warm_points:
+        status = run_warmup(points=warm_points)
+        summary["warmup"] = status if status else "already running"
+    
+    last_points_reload.clear()
+    last_points_reload.update(summary)
+    return summary
+
+strapi_fetcher = StrapiPointsFetcher(
+    STRAPI_POINTS_URL,
+    STRAPI_BEARER_TOKEN,
+    STRAPI_STATE_FILE,
+    page_size=STRAPI_PAGE_SIZE,
+    concurrency=STRAPI_FETCH_CONCURRENCY
+)
+
+def reload_points(warmup=False, full=False):
+    """Rilegge i punti da Strapi e applica le differenze.
+
+    Ritorna (riepilogo delle modifiche, riepilogo della lettura); se Strapi indica che nulla è
+    cambiato i punti attuali restano come sono.
+    """
+    items, fetch_info = strapi_fetcher.fetch(full=full)
+    if items is None:
+        print(f"✅ Points unchanged on Strapi ({fetch_info['requests']} request)")
+        changes = {
+            "reloaded_at": time.time(),
+            "added": [],
+            "removed": [],
+            "moved": [],
+            "updated": [],
+            "unchanged": len(points_of_interest),
+            "invalidated_entries": 0
+        }
+        return changes, fetch_info
+    
+    print(f"Received {len(items)} points from Strapi ({fetch_info['mode']}, {fetch_info['requests']} requests)")
+    return apply_points(parse_strapi_points({"data": items}), warmup=warmup), fetch_info
+
+def get_client_ip(forwarded_for, remote_addr):
+    """IP del client: primo indirizzo di X-Forwarded-For se presente"""
+    client_ip = forwarded_for or remote_addr
     if client_ip and ',' in client_ip:
         client_ip = client_ip.split(',')[0].strip()
-    
-    if is_rate_limited(client_ip):
-        log_suspicious_activity(client_ip, len(request_history[client_ip]))
-        return jsonify({
+    return client_ip
+
+def check_rate_limit(client_ip, endpoint):
+    """Rate limiting dell'endpoint: ritorna (risposta, status) se l'IP è limitato, altrimenti None"""
+    rule, request_count = hit_rate_limit(client_ip, ENDPOINT_RATE_LIMITS.get(endpoint, DEFAULT_RATE_LIMITS))
+    if rule is not None:
+        window = RATE_LIMIT_RULES[rule][1]
+        log_suspicious_activity(client_ip, request_count, window)
+        return {
             "error": "Too many requests. Please wait before making another request.",
-            "retry_after": RATE_LIMIT_WINDOW
-        }), 429
-    
+            "retry_after": window
+        }, 429
+    return None
+
+def health_payload():
+    """Corpo della risposta di /health"""
+    return {
+        "status": "healthy",
+        "service": "Distance API v2",
+        "version": "2.0",
+        "timestamp": time.time(),
+        "uptime": "service running",
+        "points_loaded": len(points_of_interest),
+        "cache_entries": len(distance_cache),
+        "endpoints": [
+            "/health",
+            "/get_points",
+            "/distance", 
+            "/all_distances",
+            "/nearest",
+            "/within",
+            "/distances/batch",
+            "/admin/cache/clear",
+            "/admin/cache/invalidate"
+        ],
+        "message": "All systems operational"
+    }
+
+def prepare_distance(origin, destination):
+    """Prima parte di /distance, senza chiamate esterne.
+
+    Ritorna (risposta, status, None) se la richiesta è già conclusa (errore, more_than, cache
+    o origine vicina), altrimenti (None, None, miss) con miss = (origin_coords, dest_coords,
+    cache_key, dest_point) da risolvere presso i provider.
+    """
     # Parsing dei parametri
     try:
-        origin = request.args.get('origin')
-        destination = request.args.get('destination')
-        
         if not origin or not destination:
-            return jsonify({"error": "Both origin and destination are required"}), 400
+            return {"error": "Both origin and destination are required"}, 400, None
         
         # Health check endpoint
         if origin == "test" and destination == "test":
-            return jsonify({
+            return {
                 "status": "healthy",
                 "service": "Distance API v2",
                 "timestamp": time.time(),
                 "points_loaded": len(points_of_interest),
                 "cache_entries": len(distance_cache),
                 "message": "Service is running correctly"
-            }), 200
+            }, 200, None
         
         origin_lat, origin_lon = map(float, origin.split(','))
         dest_lat, dest_lon = map(float, destination.split(','))
         
     except ValueError:
-        return jsonify({"error": "Invalid coordinate format. Use lat,lon"}), 400
+        return {"error": "Invalid coordinate format. Use lat,lon"}, 400, None
     
     # Verifica che destination sia un punto valido
     dest_point = find_point_by_coordinates(dest_lat, dest_lon)
     if not dest_point:
-        return jsonify({"error": "Invalid destination point"}), 400
+        return {"error": "Invalid destination point"}, 400, None
+    
+    # Da qui in poi la destinazione è il punto: chiave di cache e provider usano le sue coordinate,
+    # come in /all_distances, anche se la richiesta le indica con qualche decimale di differenza
+    dest_lat, dest_lon = dest_point['lat'], dest_point['lon']
     
     # Calcola distanza Haversine per controllo soglia
     haversine_dist = haversine_distance(origin_lat, origin_lon, dest_lat, dest_lon)
@@ -317,137 +1430,642 @@ def get_distance():
         step = int((haversine_km // 10) * 10)
         if step < haversine_km:
             step += 10
-        return jsonify({"more_than": step})
+        return {"more_than": step}, 200, None
     
     # Controlla cache
     cache_key = get_cache_key(origin_lat, origin_lon, dest_lat, dest_lon)
-    if cache_key in distance_cache:
+    cached = lookup_cached(cache_key)
+    if cached is not None:
         print(f"🎯 Cache hit for {cache_key}")
-        cached_result = distance_cache[cache_key].copy()
-        cached_result["id"] = dest_point['id']
-        return jsonify(cached_result)
+        return {"distance": cached["distance"], "duration": cached["duration"], "id": dest_point['id']}, 200, None
+    
+    # Origine in cache abbastanza vicina: risposta approssimata senza chiamate esterne
+    approximated = get_neighbor_distance(origin_lat, origin_lon, dest_point)
+    if approximated is not None:
+        approximated["id"] = dest_point['id']
+        return approximated, 200, None
     
     # Cache miss - chiama API esterna
     print(f"🔄 Cache miss for {cache_key}, calling external API")
+    return None, None, ((origin_lat, origin_lon), (dest_lat, dest_lon), cache_key, dest_point)
+
+def finish_distance(dest_point, value):
+    """Risposta di /distance dal risultato upstream (None = deadline scaduta)"""
+    if value is None:
+        upstream_stats["timed_out_requests"] += 1
+        return {"error": "Distance calculation timed out, please retry"}, 504
     
-    # Prova prima Google, poi OpenRoute come fallback
-    distance, duration = get_distance_with_google((origin_lat, origin_lon), (dest_lat, dest_lon))
-    
-    if distance is None:
-        distance, duration = get_distance_with_openroute((origin_lat, origin_lon), (dest_lat, dest_lon))
-    
+    distance, duration = value
     if distance is None:
-        return jsonify({"error": "Unable to calculate distance"}), 500
-    
-    # Salva in cache
-    result = {"distance": distance, "duration": duration}
-    distance_cache[cache_key] = result
-    save_cache_to_file()
+        return {"error": "Unable to calculate distance"}, 500
     
     # Aggiungi ID e ritorna
-    result["id"] = dest_point['id']
-    return jsonify(result)
+    return {"distance": distance, "duration": duration, "id": dest_point['id']}, 200
 
-@app.route('/all_distances', methods=['GET'])
-@limiter.limit("5 per minute")
-def get_all_distances():
-    """Endpoint per calcolare distanze da origin a tutti i punti di interesse"""
-    # Rate limiting personalizzato
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    if client_ip and ',' in client_ip:
-        client_ip = client_ip.split(',')[0].strip()
-    
-    if is_rate_limited(client_ip):
-        log_suspicious_activity(client_ip, len(request_history[client_ip]))
-        return jsonify({
-            "error": "Too many requests. Please wait before making another request.",
-            "retry_after": RATE_LIMIT_WINDOW
-        }), 429
-    
+def prepare_all_distances(origin):
+    """Prima parte di /all_distances, senza chiamate esterne.
+
+    Ritorna (errore, origin_coords, results, misses): errore è (risposta, status) se i parametri
+    non sono validi; results ha None nelle posizioni dei cache miss, elencati in misses come
+    (posizione, punto, cache_key).
+    """
     # Parsing parametri
     try:
-        origin = request.args.get('origin')
         if not origin:
-            return jsonify({"error": "Origin is required"}), 400
+            return ({"error": "Origin is required"}, 400), None, None, None
         
         origin_lat, origin_lon = map(float, origin.split(','))
         
     except ValueError:
-        return jsonify({"error": "Invalid coordinate format. Use lat,lon"}), 400
+        return ({"error": "Invalid coordinate format. Use lat,lon"}, 400), None, None, None
+    
+    # Distanze Haversine e soglie "more_than" verso tutti i punti in un solo passaggio vettoriale
+    index = point_index
+    steps = more_than_steps(index.haversine_from(origin_lat, origin_lon))
+    results, misses = lookup_point_distances(origin_lat, origin_lon, index.points, steps)
     
+    if misses:
+        print(f"🔄 {len(misses)} cache misses, calling external matrix API")
+    return None, (origin_lat, origin_lon), results, misses
+
+def lookup_point_distances(origin_lat, origin_lon, points, steps):
+    """Risultati da cache (o origine vicina) verso i punti indicati, senza chiamate esterne.
+
+    steps sono le soglie "more_than" dei punti (0 = entro la soglia). Ritorna (results, misses)
+    come prepare_all_distances.
+    """
     results = []
+    in_range = []
+    misses = []
     
-    for point in points_of_interest:
+    for point, step in zip(points, steps):
         dest_lat, dest_lon = point['lat'], point['lon']
         
-        # Calcola distanza Haversine per controllo soglia
-        haversine_dist = haversine_distance(origin_lat, origin_lon, dest_lat, dest_lon)
-        haversine_km = haversine_dist / 1000
-        
         # Se troppo distante
-        if haversine_km > 10:
-            step = int((haversine_km // 10) * 10)
-            if step < haversine_km:
-                step += 10
+        if step:
             results.append({"id": point['id'], "more_than": step})
             continue
         
-        # Controlla cache
-        cache_key = get_cache_key(origin_lat, origin_lon, dest_lat, dest_lon)
-        if cache_key in distance_cache:
-            cached_result = distance_cache[cache_key].copy()
-            cached_result["id"] = point['id']
-            results.append(cached_result)
+        # Punto entro la soglia: segna la posizione, la cache viene letta dopo in un colpo solo
+        results.append(None)
+        in_range.append((len(results) - 1, point, get_cache_key(origin_lat, origin_lon, dest_lat, dest_lon)))
+    
+    # Controlla cache
+    found = lookup_cached_many([cache_key for _, _, cache_key in in_range])
+    
+    for index, point, cache_key in in_range:
+        cached = found.get(cache_key)
+        if cached is not None:
+            results[index] = {"distance": cached["distance"], "duration": cached["duration"], "id": point['id']}
             continue
         
-        # Cache miss - calcola
-        distance, duration = get_distance_with_google((origin_lat, origin_lon), (dest_lat, dest_lon))
+        approximated = get_neighbor_distance(origin_lat, origin_lon, point)
+        if approximated is not None:
+            approximated["id"] = point['id']
+            results[index] = approximated
+            continue
         
-        if distance is None:
-            distance, duration = get_distance_with_openroute((origin_lat, origin_lon), (dest_lat, dest_lon))
+        # Cache miss - risolto dopo in batch
+        misses.append((index, point, cache_key))
+    return results, misses
+
+def prepare_nearby(origin, k=None, radius=None):
+    """Prima parte di /nearest (k punti più vicini) e /within (punti entro radius metri).
+
+    I candidati vengono scelti in linea d'aria dall'indice dei punti: solo quelli vengono
+    risolti a piedi. Ritorna (errore, origin_coords, results, misses, haversine) come
+    prepare_all_distances, con in più la distanza in linea d'aria di ogni elemento di results.
+    """
+    try:
+        if not origin:
+            return ({"error": "Origin is required"}, 400), None, None, None, None
+        origin_lat, origin_lon = map(float, origin.split(','))
+    except ValueError:
+        return ({"error": "Invalid coordinate format. Use lat,lon"}, 400), None, None, None, None
+    
+    if radius is None:
+        try:
+            k = NEAREST_DEFAULT_K if k is None else int(k)
+        except ValueError:
+            return ({"error": "k must be an integer"}, 400), None, None, None, None
+        if not 1 <= k <= NEAREST_MAX_K:
+            return ({"error": f"k must be between 1 and {NEAREST_MAX_K}"}, 400), None, None, None, None
+        candidates = point_index.nearest(origin_lat, origin_lon, max(k, int(k * NEAREST_CANDIDATE_FACTOR)))
+    else:
+        if not radius:
+            return ({"error": "Radius is required"}, 400), None, None, None, None
+        try:
+            radius = float(radius)
+        except ValueError:
+            return ({"error": "radius must be a number of meters"}, 400), None, None, None, None
+        if not 0 < radius <= WITHIN_MAX_RADIUS_M:
+            return ({"error": f"radius must be between 0 and {WITHIN_MAX_RADIUS_M} meters"}, 400), None, None, None, None
+        candidates = point_index.within(origin_lat, origin_lon, radius)
+    
+    haversine = [distance for distance, _ in candidates]
+    results, misses = lookup_point_distances(
+        origin_lat, origin_lon, [point for _, point in candidates], more_than_steps(haversine)
+    )
+    if misses:
+        print(f"🔄 {len(misses)} cache misses out of {len(candidates)} candidates, calling external matrix API")
+    return None, (origin_lat, origin_lon), results, misses, haversine
+
+def finish_nearby(results, haversine, limit=None):
+    """Ordina i risultati per distanza a piedi (in linea d'aria per quelli senza, es. timeout o
+    more_than) e tiene i primi limit"""
+    ordered = []
+    for position, (entry, straight) in enumerate(zip(results, haversine)):
+        entry["haversine"] = straight
+        ordered.append((entry.get("distance", straight), position, entry))
+    ordered.sort()
+    return [entry for _, _, entry in ordered[:limit]]
+
+def distance_entry(point, value):
+    """Elemento di /all_distances per il risultato upstream di un cache miss (None = deadline scaduta)"""
+    # Risultati parziali: i punti non risolti entro la deadline sono segnalati singolarmente
+    if value is None:
+        return {"id": point['id'], "error": "Distance calculation timed out, please retry"}
+    
+    distance, duration = value
+    if distance is None:
+        return {"id": point['id'], "error": "Unable to calculate distance"}
+    
+    # Già salvato in cache dal worker
+    return {"distance": distance, "duration": duration, "id": point['id']}
+
+def finish_all_distances(results, misses, batch):
+    """Completa results con i risultati upstream dei cache miss (None = deadline scaduta)"""
+    for (index, point, cache_key), value in zip(misses, batch):
+        results[index] = distance_entry(point, value)
+    return results
+
+def serialize_json(data):
+    """Serializza come jsonify (chiavi ordinate, formato compatto, newline finale)"""
+    return (json.dumps(data, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+def lookup_response_cache(origin):
+    """Risposta di /all_distances già pronta per la cella di origin.
+
+    Ritorna (prefisso, versione, (body, etag) oppure None); il prefisso è None se origin non è
+    valido o la cache delle risposte è disabilitata. La versione è l'indice dei punti corrente:
+    dopo un /get_points le risposte precedenti non vengono più servite.
+    """
+    version = point_index
+    if RESPONSE_CACHE_MAX_ENTRIES <= 0:
+        return None, version, None
+    try:
+        origin_lat, origin_lon = map(float, origin.split(','))
+    except (AttributeError, ValueError):
+        return None, version, None
+    prefix = get_origin_key(origin_lat, origin_lon)
+    return prefix, version, response_cache.get(prefix, version)
+
+def store_response(prefix, version, results, misses, started_at):
+    """Serializza results e, se è stata servita tutta dalla cache, la salva per la cella.
+
+    Le risposte con cache miss, timeout o distanze approssimate dall'origine vicina non vengono
+    salvate: la richiesta successiva, ormai tutta in cache, lo farà. Ritorna (body, etag) oppure
+    None se la risposta non è salvabile.
+    """
+    if prefix is None or misses or any("approximate" in entry for entry in results):
+        return None
+    body = serialize_json(results)
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    response_cache.put(prefix, version, body, etag, started_at)
+    return body, etag
+
+def response_cache_headers(etag):
+    return {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={RESPONSE_MAX_AGE_SECONDS}"}
+
+def etag_matches(if_none_match, etag):
+    """True se l'header If-None-Match contiene l'ETag (anche in forma debole, es. dopo il gzip di nginx)"""
+    return bool(if_none_match) and parse_etags(if_none_match).contains_weak(etag)
+
+def cached_json_response(body, etag):
+    """Risposta da bytes già serializzati, 304 se il client ha già questa versione"""
+    headers = response_cache_headers(etag)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+def parse_batch_pairs(body, content_type):
+    """Coppie di /distances/batch: lista JSON (anche {"pairs": [...]}) oppure NDJSON, una per riga.
+
+    Ritorna (errore, coppie) con errore (risposta, status) se il corpo non è valido.
+    """
+    try:
+        text = body.decode("utf-8")
+        if content_type and "ndjson" in content_type:
+            pairs = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            data = json.loads(text)
+            pairs = data.get("pairs") if isinstance(data, dict) else data
+    except ValueError:
+        return ({"error": "Invalid JSON body"}, 400), None
+    
+    if not isinstance(pairs, list) or not pairs:
+        return ({"error": "A non-empty list of pairs is required"}, 400), None
+    if len(pairs) > BATCH_MAX_PAIRS:
+        return ({"error": f"Too many pairs, the maximum is {BATCH_MAX_PAIRS}"}, 413), None
+    return None, pairs
+
+def validate_batch_pair(pair):
+    """Controlla una coppia {"origin": "lat,lon", "destination": "lat,lon"} (oppure "id" del punto).
+
+    Ritorna (errore, origin_coords, punto): la destinazione deve essere un punto di interesse.
+    """
+    if not isinstance(pair, dict) or not pair.get("origin"):
+        return "Origin is required", None, None
+    try:
+        origin_lat, origin_lon = map(float, str(pair["origin"]).split(','))
+        if pair.get("id") is not None:
+            point = point_index.get(int(pair["id"]))
+        elif pair.get("destination"):
+            dest_lat, dest_lon = map(float, str(pair["destination"]).split(','))
+            point = find_point_by_coordinates(dest_lat, dest_lon)
+        else:
+            return "Destination or id is required", None, None
+    except (TypeError, ValueError):
+        return "Invalid coordinate format. Use lat,lon", None, None
+    
+    if not point:
+        return "Invalid destination point", None, None
+    return None, (origin_lat, origin_lon), point
+
+def prepare_distances_batch(pairs):
+    """Prima parte di /distances/batch, senza chiamate esterne.
+
+    Le coppie con la stessa chiave di cache vengono unite e la cache viene letta una volta sola.
+    Ritorna (results, misses, summary): results ha None per le coppie ancora da risolvere,
+    misses mappa cache_key -> (origin_coords, punto, posizioni in pairs).
+    """
+    results = [None] * len(pairs)
+    pending = {}
+    summary = {"pairs": len(pairs), "invalid": 0, "more_than": 0, "timed_out": 0}
+    
+    for position, pair in enumerate(pairs):
+        error, origin_coords, point = validate_batch_pair(pair)
+        if error:
+            summary["invalid"] += 1
+            results[position] = {"error": error}
+            continue
         
-        if distance is None:
-            results.append({"id": point['id'], "error": "Unable to calculate distance"})
+        step = more_than_steps([haversine_distance(*origin_coords, point['lat'], point['lon'])])[0]
+        if step:
+            summary["more_than"] += 1
+            results[position] = {"origin": pair["origin"], "id": point['id'], "more_than": step}
             continue
         
-        # Salva in cache
-        result = {"distance": distance, "duration": duration}
-        distance_cache[cache_key] = result
+        cache_key = get_cache_key(*origin_coords, point['lat'], point['lon'])
+        pending.setdefault(cache_key, (origin_coords, point, []))[2].append(position)
+    
+    found = lookup_cached_many(list(pending))
+    misses = {}
+    for cache_key, (origin_coords, point, positions) in pending.items():
+        cached = found.get(cache_key)
+        if cached is not None:
+            value = {"distance": cached["distance"], "duration": cached["duration"], "id": point['id']}
+        else:
+            value = get_neighbor_distance(*origin_coords, point)
+            if value is None:
+                misses[cache_key] = (origin_coords, point, positions)
+                continue
+            value["id"] = point['id']
+        for position in positions:
+            results[position] = dict(value, origin=pairs[position]["origin"])
+    
+    summary["unique"] = len(pending)
+    summary["cache_hits"] = len(found)
+    summary["misses"] = len(misses)
+    if misses:
+        print(f"🔄 {len(misses)} cache misses out of {len(pending)} unique pairs, calling external matrix API")
+    return results, misses, summary
+
+def batch_miss_items(misses, cache_keys):
+    """Coppie (origin_coords, dest_coords, chiave) dei miss indicati; le coppie della stessa cella
+    di origine usano le coordinate della prima, così finiscono nella stessa riga della matrice"""
+    origins = {}
+    items = []
+    for cache_key in cache_keys:
+        origin_coords, point, _ = misses[cache_key]
+        origin_coords = origins.setdefault(split_cache_key(cache_key)[0], origin_coords)
+        items.append((origin_coords, (point['lat'], point['lon']), cache_key))
+    return items
+
+def start_batch_misses(misses, deadline):
+    """Avvia la risoluzione dei cache miss di /distances/batch; ritorna cache_key -> Future.
+
+    Le chiavi già in corso per altre richieste riusano la loro Future. Un task interroga il grafo
+    pedonale una volta per origine, poi le coppie rimaste vengono raggruppate in chiamate matrix
+    con più origini e più destinazioni (plan_matrix_blocks), un task per blocco.
+    """
+    cache_keys = list(misses)
+    futures, owned = claim_inflight(cache_keys)
+    items = batch_miss_items(misses, [cache_keys[i] for i in owned])
+    start_with_walking_graph(futures, items, lambda rest: submit_batch_blocks(futures, rest, deadline))
+    return futures
+
+def submit_batch_blocks(futures, items, deadline):
+    """Un task upstream per blocco matrix di /distances/batch"""
+    for block in plan_matrix_blocks(items):
+        upstream_executor.submit(run_batch_block, futures, block, deadline)
+
+def run_batch_block(futures, block, deadline):
+    """Risolve un blocco matrix; se è rimasto in coda oltre la deadline viene saltato"""
+    if skip_after_deadline(futures, block, deadline):
+        return
+    run_inflight(futures, [cache_key for _, _, cache_key in block], resolve_distances_block, block)
+
+def finish_distances_batch(pairs, results, misses, futures, summary):
+    """Completa results con i risultati upstream (non completati = timeout, come /all_distances)"""
+    if not all(future.done() for future in futures.values()):
+        upstream_stats["timed_out_requests"] += 1
+    for cache_key, (_, point, positions) in misses.items():
+        future = futures[cache_key]
+        value = future.result() if future.done() else None
+        if value is None:
+            summary["timed_out"] += 1
+        entry = distance_entry(point, value)
+        for position in positions:
+            results[position] = dict(entry, origin=pairs[position]["origin"])
+    return results
+
+def batch_response(results, summary, content_type):
+    """Corpo e content type di /distances/batch nello stesso formato della richiesta: NDJSON una
+    riga per coppia nell'ordine ricevuto, altrimenti JSON con results e summary"""
+    if content_type and "ndjson" in content_type:
+        return "".join(format_stream_entry(entry, "ndjson") for entry in results), STREAM_CONTENT_TYPES["ndjson"]
+    return serialize_json({"results": results, "summary": summary}), "application/json"
+
+# Formati di /all_distances in streaming (?stream=ndjson|sse oppure header Accept)
+STREAM_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+def get_stream_format(stream, accept):
+    """Ritorna "ndjson", "sse" oppure None (risposta JSON unica)"""
+    if stream in STREAM_CONTENT_TYPES:
+        return stream
+    for stream_format, content_type in STREAM_CONTENT_TYPES.items():
+        if accept and content_type in accept:
+            return stream_format
+    return None
+
+def stream_headers():
+    # Niente buffering nel proxy (nginx) né cache: ogni elemento deve arrivare subito al client
+    return {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def stream_json(data):
+    """JSON compatto e con chiavi ordinate, lo stesso per ogni riga o evento dello stream"""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+def format_stream_entry(entry, stream_format):
+    """Serializza un elemento: una riga JSON (NDJSON) o un evento "data:" (SSE)"""
+    line = stream_json(entry)
+    if stream_format == "sse":
+        return f"data: {line}\n\n"
+    return line + "\n"
+
+def format_stream_end(stream_format, count):
+    """Chiusura dello stream: con SSE un evento "end", così EventSource non si riconnette"""
+    if stream_format == "sse":
+        return f"event: end\ndata: {stream_json({'count': count})}\n\n"
+    return ""
+
+def miss_destinations(misses):
+    """Coordinate e chiavi di cache dei miss di prepare_all_distances / prepare_nearby"""
+    return [(point['lat'], point['lon']) for _, point, _ in misses], [cache_key for _, _, cache_key in misses]
+
+def stream_waiting(misses, futures):
+    """Future -> punti in attesa (più punti possono avere le stesse coordinate)"""
+    waiting = {}
+    for _, point, cache_key in misses:
+        waiting.setdefault(futures[cache_key], []).append(point)
+    return waiting
+
+def stream_timeouts(waiting, stream_format):
+    """Elementi dei punti ancora in attesa alla deadline"""
+    upstream_stats["timed_out_requests"] += 1
+    for points in waiting.values():
+        for point in points:
+            yield format_stream_entry(distance_entry(point, None), stream_format)
+
+def stream_all_distances(origin_coords, results, misses, stream_format):
+    """Generatore di /all_distances in streaming: prima gli elementi già pronti (cache e
+    more_than), poi ogni blocco upstream appena completato, infine i timeout alla deadline"""
+    for entry in results:
+        if entry is not None:
+            yield format_stream_entry(entry, stream_format)
+    
+    if misses:
+        deadline = time.monotonic() + REQUEST_DEADLINE_SECONDS
+        futures = start_distances_batch(origin_coords, *miss_destinations(misses))
+        waiting = stream_waiting(misses, futures)
+        
+        try:
+            for future in as_completed(list(waiting), timeout=max(0, deadline - time.monotonic())):
+                for point in waiting.pop(future):
+                    yield format_stream_entry(distance_entry(point, future.result()), stream_format)
+        except FutureTimeoutError:
+            yield from stream_timeouts(waiting, stream_format)
         
-        # Aggiungi alla risposta
-        result["id"] = point['id']
-        results.append(result)
+        persist_cache()
     
-    # Salva cache se è stata modificata
-    save_cache_to_file()
+    yield format_stream_end(stream_format, len(results))
+
+@app.route('/get_points', methods=['GET', 'POST'])
+def get_points():
+    """Endpoint per ricaricare i punti di interesse da Strapi"""
+    secret = request.args.get('secret')
+    
+    if secret != ADMIN_SECRET:
+        return jsonify({"error": "Invalid secret"}), 401
+    
+    try:
+        # Interroga Strapi (solo le modifiche) e applica le differenze; full=1 rilegge tutto
+        warmup = POINTS_RELOAD_WARMUP or request.args.get('warmup') in ('1', 'true')
+        full = request.args.get('full') in ('1', 'true')
+        changes, fetch_info = reload_points(warmup=warmup, full=full)
+        
+        return jsonify({
+            "success": True,
+            "points_loaded": len(points_of_interest),
+            "points": points_of_interest,
+            "changes": changes,
+            "strapi": fetch_info
+        })
+        
+    except Exception as e:
+        return jsonify({"error": f"Failed to load points from Strapi: {str(e)}"}), 500
+
+@app.route('/distance', methods=['GET'])
+def get_distance():
+    """Endpoint per calcolare la distanza tra origin e destination"""
+    body, status, miss = prepare_distance(request.args.get('origin'), request.args.get('destination'))
+    if miss is None:
+        return jsonify(body), status
+    origin_coords, dest_coords, cache_key, dest_point = miss
     
+    # Prova prima Google, poi OpenRoute come fallback, sul pool upstream con deadline;
+    # richieste concorrenti per la stessa chiave condividono la stessa chiamata
+    futures, owned = claim_inflight([cache_key])
+    if owned:
+        start_with_walking_graph(futures, [(origin_coords, dest_coords, cache_key)], lambda rest: upstream_executor.submit(
+            run_inflight, futures, [cache_key], lambda: [resolve_distance(origin_coords, dest_coords, cache_key)]
+        ))
+    try:
+        value = futures[cache_key].result(timeout=REQUEST_DEADLINE_SECONDS)
+    except FutureTimeoutError:
+        value = None
+    
+    body, status = finish_distance(dest_point, value)
+    if status == 200:
+        # Salva cache su file
+        persist_cache()
+    return jsonify(body), status
+
+@app.route('/all_distances', methods=['GET'])
+def get_all_distances():
+    """Endpoint per calcolare distanze da origin a tutti i punti di interesse"""
+    started_at = time.monotonic()
+    stream_format = get_stream_format(request.args.get('stream'), request.headers.get('Accept'))
+    if not stream_format:
+        # Origine già servita tutta dalla cache: bytes pronti, senza rileggere le distanze
+        prefix, version, cached = lookup_response_cache(request.args.get('origin'))
+        if cached:
+            return cached_json_response(*cached)
+    
+    error, origin_coords, results, misses = prepare_all_distances(request.args.get('origin'))
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    # Modalità streaming: gli elementi vengono inviati appena pronti, in ordine di arrivo
+    if stream_format:
+        return Response(
+            stream_all_distances(origin_coords, results, misses, stream_format),
+            mimetype=STREAM_CONTENT_TYPES[stream_format],
+            headers=stream_headers()
+        )
+    
+    resolve_misses(origin_coords, results, misses)
+    stored = store_response(prefix, version, results, misses, started_at)
+    if stored:
+        return cached_json_response(*stored)
     return jsonify(results)
 
+def resolve_misses(origin_coords, results, misses):
+    """Risolve in batch i cache miss entro la deadline della richiesta e completa results"""
+    if not misses:
+        return results
+    
+    batch = get_distances_batch(
+        origin_coords, *miss_destinations(misses), deadline=time.monotonic() + REQUEST_DEADLINE_SECONDS
+    )
+    finish_all_distances(results, misses, batch)
+    
+    # Salva cache se è stata modificata
+    persist_cache()
+    return results
+
+@app.route('/nearest', methods=['GET'])
+def get_nearest():
+    """Endpoint per i k punti di interesse più vicini a origin (a piedi)"""
+    k = request.args.get('k') or None
+    error, origin_coords, results, misses, haversine = prepare_nearby(request.args.get('origin'), k=k)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    resolve_misses(origin_coords, results, misses)
+    return jsonify(finish_nearby(results, haversine, int(k) if k else NEAREST_DEFAULT_K))
+
+@app.route('/within', methods=['GET'])
+def get_within():
+    """Endpoint per i punti di interesse entro radius metri in linea d'aria da origin"""
+    error, origin_coords, results, misses, haversine = prepare_nearby(
+        request.args.get('origin'), radius=request.args.get('radius') or ""
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    resolve_misses(origin_coords, results, misses)
+    return jsonify(finish_nearby(results, haversine))
+
+@app.route('/distances/batch', methods=['POST'])
+def batch_distances():
+    """Endpoint per le distanze di molte coppie (origine, punto di interesse) in una richiesta"""
+    error, pairs = parse_batch_pairs(request.get_data(), request.content_type)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    results, misses, summary = prepare_distances_batch(pairs)
+    if misses:
+        deadline = time.monotonic() + BATCH_DEADLINE_SECONDS
+        futures = start_batch_misses(misses, deadline)
+        wait_futures(list(futures.values()), timeout=BATCH_DEADLINE_SECONDS)
+        finish_distances_batch(pairs, results, misses, futures, summary)
+        # Un solo salvataggio della cache per tutto il batch
+        persist_cache()
+    
+    body, mimetype = batch_response(results, summary, request.content_type)
+    return Response(body, mimetype=mimetype)
+
 @app.route('/admin/stats', methods=['GET'])
-@limiter.limit("10 per minute")
 def get_stats():
     """Endpoint per monitorare le statistiche"""
     current_time = time.time()
     stats = {}
     
-    for ip, requests_deque in request_history.items():
-        recent_requests = sum(1 for req_time in requests_deque 
-                            if current_time - req_time <= RATE_LIMIT_WINDOW)
-        if recent_requests > 0:
-            stats[ip] = {
-                "recent_requests": recent_requests,
-                "total_requests": len(requests_deque),
-                "is_rate_limited": recent_requests >= RATE_LIMIT_MAX_REQUESTS
-            }
+    # Solo gli IP attualmente limitati: il riepilogo non scorre tutte le chiavi
+    rate_limit_stats = rate_limiter.get_stats()
+    limited = rate_limiter.limited_keys(current_time)
+    
+    for ip, (rule, count) in limited.items():
+        stats[ip] = {
+            "recent_requests": count,
+            "total_requests": rate_limiter.total(ip, rule),
+            "is_rate_limited": True,
+            "rule": rule
+        }
     
     return jsonify({
-        "active_ips": len(stats),
+        "active_ips": rate_limit_stats["tracked_keys"]["distance_api"],
         "points_of_interest_count": len(points_of_interest),
         "cache_entries": len(distance_cache),
+        "cache_persistence": get_cache_persistence_stats(),
+        "cache_stats": distance_cache.get_stats(),
+        "cache_keys": get_cache_key_stats(),
+        "response_cache": response_cache.get_stats(),
         "rate_limit_settings": {
             "window_seconds": RATE_LIMIT_WINDOW,
-            "max_requests": RATE_LIMIT_MAX_REQUESTS
+            "max_requests": RATE_LIMIT_MAX_REQUESTS,
+            "rules": RATE_LIMIT_RULES,
+            "max_keys": RATE_LIMIT_MAX_KEYS,
+            "sync_interval_seconds": RATE_LIMIT_SYNC_INTERVAL_SECONDS
         },
+        "rate_limit_stats": rate_limit_stats,
+        "upstream_settings": {
+            "pool_size": UPSTREAM_POOL_SIZE,
+            "request_deadline_seconds": REQUEST_DEADLINE_SECONDS,
+            "provider_max_concurrency": PROVIDER_MAX_CONCURRENCY,
+            "timed_out_requests": upstream_stats["timed_out_requests"],
+            "coalesced_lookups": upstream_stats["coalesced_lookups"],
+            "skipped_after_deadline": upstream_stats["skipped_after_deadline"],
+            "inflight_lookups": len(inflight_lookups)
+        },
+        "provider_router": provider_router.get_stats(),
+        "shared_state": {
+            "enabled": SHARED_STATE,
+            "sync_interval_seconds": STATE_SYNC_INTERVAL_SECONDS,
+            "cache_generation": state_sync["cache_generation"],
+            "shared_cache_hits": state_sync["shared_cache_hits"],
+            "worker_pid": os.getpid()
+        },
+        "warmup": warmup_job.get_status(),
+        "walking_graph": walking_graph.get_stats() if walking_graph is not None else None,
+        "last_points_reload": last_points_reload,
+        "http_pools": get_pool_settings(),
+        "upstream_hosts": get_host_stats(),
         "ip_stats": stats
     })
 
@@ -458,33 +2076,82 @@ def clear_cache():
     if secret != ADMIN_SECRET:
         return jsonify({"error": "Invalid secret"}), 401
     
-    global distance_cache
     cache_size = len(distance_cache)
-    distance_cache = {}
-    save_cache_to_file()
+    distance_cache.clear()
+    origin_index.clear()
+    response_cache.clear()
+    with cache_save_lock:
+        with dirty_cache_lock:
+            dirty_cache_keys.clear()
+            removed_cache_keys.clear()
+            cache_flush_state["oldest_dirty_at"] = None
+        cache_backend.clear()
+    publish_cache_change()
     
     return jsonify({"success": True, "cleared_entries": cache_size})
 
+@app.route('/admin/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Endpoint per invalidare la cache di un solo punto di interesse (richiede secret)"""
+    secret = request.args.get('secret')
+    if secret != ADMIN_SECRET:
+        return jsonify({"error": "Invalid secret"}), 401
+    
+    try:
+        point_id = int(request.args.get('id', ''))
+    except ValueError:
+        return jsonify({"error": "A numeric point id is required"}), 400
+    
+    point = point_index.get(point_id)
+    if not point:
+        return jsonify({"error": "Unknown point id"}), 404
+    
+    invalidated = invalidate_point_cache([point])
+    persist_cache()
+    
+    return jsonify({"success": True, "id": point_id, "invalidated_entries": invalidated})
+
+@app.route('/admin/warmup', methods=['GET', 'POST'])
+def warmup_cache():
+    """Avvia (action=start) o ferma (action=stop) il warm-up della cache; in GET ritorna l'avanzamento"""
+    secret = request.args.get('secret')
+    if secret != ADMIN_SECRET:
+        return jsonify({"error": "Invalid secret"}), 401
+    
+    if request.method == 'GET':
+        return jsonify(warmup_job.get_status())
+    
+    action = request.args.get('action', 'start')
+    if action == 'stop':
+        warmup_job.stop()
+        return jsonify({"success": True, "status": warmup_job.get_status()})
+    if action != 'start':
+        return jsonify({"error": "action must be start or stop"}), 400
+    
+    try:
+        options = {
+            "step_m": float(request.args['step_m']) if 'step_m' in request.args else None,
+            "margin_m": float(request.args['margin_m']) if 'margin_m' in request.args else None,
+            "max_elements": int(request.args['max_elements']) if 'max_elements' in request.args else None,
+            "elements_per_second": float(request.args['rate']) if 'rate' in request.args else None,
+            "bounds": request.args.get('bounds')
+        }
+        if options["bounds"] and len(list(map(float, options["bounds"].split(',')))) != 4:
+            raise ValueError(options["bounds"])
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    
+    status = run_warmup(restart=request.args.get('restart') in ('1', 'true'), **options)
+    if status is False:
+        return jsonify({"error": "Warm-up already running", "status": warmup_job.get_status()}), 409
+    if status.get("error"):
+        return jsonify(status), 400
+    return jsonify({"success": True, "status": status}), 202
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint dedicato per health check"""
-    return jsonify({
-        "status": "healthy",
-        "service": "Distance API v2",
-        "version": "2.0",
-        "timestamp": time.time(),
-        "uptime": "service running",
-        "points_loaded": len(points_of_interest),
-        "cache_entries": len(distance_cache),
-        "endpoints": [
-            "/health",
-            "/get_points",
-            "/distance", 
-            "/all_distances",
-            "/admin/clear_cache"
-        ],
-        "message": "All systems operational"
-    }), 200
+    return jsonify(health_payload()), 200
 
 @app.route('/', methods=['GET'])
 def root():
@@ -497,6 +2164,9 @@ def root():
             "health": "/health",
             "distance": "/distance?origin=lat,lon&destination=lat,lon",
             "all_distances": "/all_distances?origin=lat,lon",
+            "nearest": "/nearest?origin=lat,lon&k=5",
+            "within": "/within?origin=lat,lon&radius=1000",
+            "distances_batch": "POST /distances/batch",
             "get_points": "/get_points?secret=YOUR_SECRET"
         },
         "documentation": "See API_MANUAL.md for complete documentation"
@@ -505,6 +2175,11 @@ def root():
 # Carica dati all'avvio
 load_points_from_file()
 load_cache_from_file()
+drop_legacy_destination_keys()
+start_cache_flusher()
+rate_limiter.start_sync(RATE_LIMIT_SYNC_INTERVAL_SECONDS, RATE_LIMIT_SYNC_MAX_PENDING)
+if SHARED_STATE:
+    sync_shared_state(force=True)
 
 # Start the Flask server
 if __name__ == '__main__':
@@ -512,4 +2187,6 @@ if __name__ == '__main__':
     print(f"📍 Loaded {len(points_of_interest)} points of interest")
     print(f"💾 Loaded {len(distance_cache)} cache entries")
     print(f"🌐 Server running at http://localhost:{PORT}")
-    app.run(host='0.0.0.0', port=PORT, debug=True)
\ No newline at end of file
+    # docker stop invia SIGTERM: usciamo in modo pulito così atexit salva la cache
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    app.run(host='0.0.0.0', port=PORT, debug=FLASK_DEBUG)
\ No newline at end of file
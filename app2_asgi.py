@@ -0,0 +1,468 @@
+# app2_asgi.py - Modalità di servizio asincrona (ASGI) di app2
+#
+# /distance, /all_distances, /nearest, /within, /distances/batch, /health e /get_points girano su Starlette con
+# un client HTTP asincrono (httpx): un cache miss non occupa un thread mentre aspetta Google o
+# ORS, quindi un solo processo regge centinaia di chiamate upstream in corso. Stato, cache, rate
+# limiting, single-flight e formato delle risposte sono quelli di app2 (cambia solo l'I/O, qui
+# asincrono): una chiave in corso su un thread Flask viene attesa anche da una richiesta ASGI e
+# viceversa. Le altre route (admin, /) vengono servite dall'app Flask montata come WSGI.
+#
+# Avvio: uvicorn app2_asgi:app --host 0.0.0.0 --port 5002
+#   oppure GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py app2_asgi:app
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app2
+from provider_clients import async_http_get, async_http_post, close_async_client
+
+# Task upstream in corso: continuano anche dopo la deadline della richiesta, il risultato va in cache
+upstream_tasks = set()
+
+class ApiResponse(JSONResponse):
+    """Risposta JSON serializzata come jsonify di Flask (chiavi ordinate, formato compatto)"""
+
+    def render(self, content):
+        return app2.serialize_json(content)
+
+def cached_json_response(request, body, etag):
+    """Risposta da bytes già serializzati, 304 se il client ha già questa versione"""
+    headers = app2.response_cache_headers(etag)
+    if app2.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+async def run_blocking(func, *args):
+    """Con SHARED_STATE le funzioni di app2 leggono e scrivono SQLite: girano su un thread per
+    non bloccare l'event loop; altrimenti lavorano solo in memoria e vengono chiamate direttamente"""
+    if app2.SHARED_STATE:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+async def get_distance_with_google(origin_coords, dest_coords):
+    """Ottiene distanza e durata usando Google Maps API (errori sollevati, come app2.get_distance_with_google)"""
+    response = await async_http_get(app2.build_google_matrix_url(origin_coords, [dest_coords]), timeout=10)
+    response.raise_for_status()
+    return app2.parse_google_matrix(response.json(), 1)[0]
+
+async def get_distance_with_openroute(origin_coords, dest_coords):
+    """Ottiene distanza e durata usando OpenRouteService API"""
+    data = app2.build_ors_directions_body(origin_coords, dest_coords)
+    response = await async_http_post(app2.ORS_DIRECTIONS_URL, headers=app2.ORS_HEADERS, json=data, timeout=10)
+    if app2.ors_no_route(response):
+        return None, None
+    response.raise_for_status()
+    return app2.parse_ors_directions(response.json())
+
+async def get_distances_with_google_matrix(origin_coords, dest_coords_list):
+    """Distance Matrix verso un blocco di destinazioni (al massimo GOOGLE_MATRIX_MAX_DESTINATIONS)"""
+    response = await async_http_get(app2.build_google_matrix_url(origin_coords, dest_coords_list), timeout=10)
+    response.raise_for_status()
+    return app2.parse_google_matrix(response.json(), len(dest_coords_list))
+
+async def get_distances_with_openroute_matrix(origin_coords, dest_coords_list):
+    """ORS matrix verso un blocco di destinazioni, diviso in richieste da ORS_MATRIX_MAX_DESTINATIONS"""
+    results = []
+    for chunk in app2.chunked(dest_coords_list, app2.ORS_MATRIX_MAX_DESTINATIONS):
+        data = app2.build_ors_matrix_body(origin_coords, chunk)
+        response = await async_http_post(app2.ORS_MATRIX_URL, headers=app2.ORS_HEADERS, json=data, timeout=10)
+        if app2.ors_no_route(response):
+            results.extend([(None, None)] * len(chunk))
+            continue
+        response.raise_for_status()
+        results.extend(app2.parse_ors_matrix(response.json(), len(chunk)))
+    return results
+
+async def get_distances_with_google_multi_matrix(items):
+    """Una chiamata Distance Matrix per un blocco di app2.plan_matrix_blocks"""
+    origins, dests, cells = app2.matrix_block_parts(items)
+    response = await async_http_get(app2.build_google_multi_matrix_url(origins, dests), timeout=10)
+    response.raise_for_status()
+    rows = app2.parse_google_matrix_rows(response.json(), len(origins), len(dests))
+    return [rows[row][column] for row, column in cells]
+
+async def get_distances_with_openroute_multi_matrix(items):
+    """Una chiamata ORS matrix (sources/destinations) per un blocco di app2.plan_matrix_blocks"""
+    origins, dests, cells = app2.matrix_block_parts(items)
+    data = app2.build_ors_multi_matrix_body(origins, dests)
+    response = await async_http_post(app2.ORS_MATRIX_URL, headers=app2.ORS_HEADERS, json=data, timeout=10)
+    if app2.ors_no_route(response):
+        return [(None, None)] * len(items)
+    response.raise_for_status()
+    rows = app2.parse_ors_matrix_rows(response.json(), len(origins), len(dests))
+    return [rows[row][column] for row, column in cells]
+
+async def get_distances_with_walking_graph(origin_coords, dest_coords_list):
+    """Grafo pedonale locale sul pool dedicato di app2 (la ricerca usa la CPU, non deve fermare
+    l'event loop né occupare i thread delle chiamate upstream)"""
+    if app2.walking_graph is None:
+        return [(None, None)] * len(dest_coords_list)
+    return await asyncio.get_running_loop().run_in_executor(
+        app2.graph_executor, app2.get_distances_with_walking_graph, origin_coords, dest_coords_list
+    )
+
+async def resolve_distance(origin_coords, dest_coords, cache_key):
+    """Risolve una singola destinazione (grafo locale, poi i provider nell'ordine del router) e la salva in cache"""
+    distance, duration = (await get_distances_with_walking_graph(origin_coords, [dest_coords]))[0]
+
+    if distance is None:
+        _, (distance, duration) = await app2.provider_router.run_async({
+            "google": lambda: get_distance_with_google(origin_coords, dest_coords),
+            "openroute": lambda: get_distance_with_openroute(origin_coords, dest_coords)
+        }, app2.distance_found, default=(None, None))
+
+    app2.store_distance_results([cache_key], [(distance, duration)])
+    return [(distance, duration)]
+
+async def route_missing(results, dest_coords_list, provider_calls):
+    """Versione asincrona di app2.route_missing (stessa logica, app2.route_missing_steps)"""
+    steps = app2.route_missing_steps(results, dest_coords_list, provider_calls)
+    try:
+        calls = next(steps)
+        while True:
+            calls = steps.send(await app2.provider_router.run_async(calls, app2.any_distance_found))
+    except StopIteration:
+        return results
+
+async def resolve_distances_chunk(origin_coords, dest_coords_list, cache_keys):
+    """Risolve un blocco di destinazioni non trovate nel grafo locale con Google Matrix e ORS
+    matrix, nell'ordine scelto dal router"""
+    results = [(None, None)] * len(dest_coords_list)
+
+    await route_missing(results, dest_coords_list, lambda dests: {
+        "google": lambda: get_distances_with_google_matrix(origin_coords, dests),
+        "openroute": lambda: get_distances_with_openroute_matrix(origin_coords, dests)
+    })
+
+    app2.store_distance_results(cache_keys, results)
+    return results
+
+async def resolve_distances_block(items):
+    """Versione asincrona di app2.resolve_distances_block (più origini per chiamata)"""
+    results = [(None, None)] * len(items)
+
+    await route_missing(results, items, lambda pairs: {
+        "google": lambda: get_distances_with_google_multi_matrix(pairs),
+        "openroute": lambda: get_distances_with_openroute_multi_matrix(pairs)
+    })
+
+    app2.store_distance_results([cache_key for _, _, cache_key in items], results)
+    return results
+
+async def run_inflight(futures, cache_keys, coroutine):
+    """Attende coroutine (che ritorna un risultato per chiave) e completa le Future delle chiavi"""
+    try:
+        results = await coroutine
+    except Exception as e:
+        print(f"❌ Upstream task error: {e}")
+        results = [(None, None)] * len(cache_keys)
+    app2.complete_inflight(futures, cache_keys, results)
+
+def start_upstream_task(futures, cache_keys, coroutine):
+    """Avvia la risoluzione upstream in un task che sopravvive alla richiesta"""
+    task = asyncio.create_task(run_inflight(futures, cache_keys, coroutine))
+    upstream_tasks.add(task)
+    task.add_done_callback(upstream_tasks.discard)
+
+async def wait_results(futures, cache_keys, deadline):
+    """Attende le Future di app2.claim_inflight fino alla deadline (time.monotonic()); None per
+    quelle non completate"""
+    pending = [asyncio.wrap_future(future) for future in futures.values() if not future.done()]
+    if pending:
+        await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()))
+    return [futures[key].result() if futures[key].done() else None for key in cache_keys]
+
+def start_provider_chunks(futures, origin_coords, dest_coords_list, cache_keys):
+    """Divide le destinazioni in blocchi di GOOGLE_MATRIX_MAX_DESTINATIONS, un task per blocco"""
+    step = app2.GOOGLE_MATRIX_MAX_DESTINATIONS
+    for offset in range(0, len(cache_keys), step):
+        chunk = dest_coords_list[offset:offset + step]
+        keys = cache_keys[offset:offset + step]
+        start_upstream_task(futures, keys, resolve_distances_chunk(origin_coords, chunk, keys))
+
+async def resolve_with_walking_graph(futures, origin_coords, dest_coords_list, cache_keys):
+    """Versione asincrona di app2.resolve_with_walking_graph"""
+    results = await get_distances_with_walking_graph(origin_coords, dest_coords_list)
+    items = [(origin_coords, dest, key) for dest, key in zip(dest_coords_list, cache_keys)]
+    found_keys, found_results, leftover = app2.split_graph_results(items, results)
+    app2.complete_found(futures, found_keys, found_results)
+    start_provider_chunks(
+        futures, origin_coords, [dest for _, dest, _ in leftover], [key for _, _, key in leftover]
+    )
+
+def start_distances_batch(origin_coords, dest_coords_list, cache_keys):
+    """Versione asincrona di app2.start_distances_batch: una ricerca nel grafo per tutte le
+    destinazioni, poi un task per blocco di quelle rimaste"""
+    futures, owned = app2.claim_inflight(cache_keys)
+    own_dests = [dest_coords_list[i] for i in owned]
+    own_keys = [cache_keys[i] for i in owned]
+
+    if app2.walking_graph is not None and own_keys:
+        task = asyncio.create_task(resolve_with_walking_graph(futures, origin_coords, own_dests, own_keys))
+        upstream_tasks.add(task)
+        task.add_done_callback(upstream_tasks.discard)
+    else:
+        start_provider_chunks(futures, origin_coords, own_dests, own_keys)
+    return futures
+
+async def get_distances_batch(origin_coords, dest_coords_list, cache_keys, deadline):
+    """Versione asincrona di app2.get_distances_batch: un task per blocco di destinazioni"""
+    if not dest_coords_list:
+        return []
+
+    futures = start_distances_batch(origin_coords, dest_coords_list, cache_keys)
+    results = await wait_results(futures, cache_keys, deadline)
+    if any(value is None for value in results):
+        app2.upstream_stats["timed_out_requests"] += 1
+    return results
+
+def start_batch_misses(misses, deadline):
+    """Versione asincrona di app2.start_batch_misses; ritorna cache_key -> Future"""
+    cache_keys = list(misses)
+    futures, owned = app2.claim_inflight(cache_keys)
+    items = app2.batch_miss_items(misses, [cache_keys[i] for i in owned])
+    if items:
+        task = asyncio.create_task(resolve_batch_items(futures, items, deadline))
+        upstream_tasks.add(task)
+        task.add_done_callback(upstream_tasks.discard)
+    return futures
+
+async def resolve_batch_items(futures, items, deadline):
+    """Grafo pedonale una volta per origine, poi un task per blocco matrix"""
+    if app2.walking_graph is not None:
+        leftover = []
+        for origin_coords, origin_items in app2.group_by_origin(items).items():
+            results = await get_distances_with_walking_graph(origin_coords, [dest for _, dest, _ in origin_items])
+            found_keys, found_results, rest = app2.split_graph_results(origin_items, results)
+            app2.complete_found(futures, found_keys, found_results)
+            leftover.extend(rest)
+        items = leftover
+
+    for block in app2.plan_matrix_blocks(items):
+        if not app2.skip_after_deadline(futures, block, deadline):
+            start_upstream_task(futures, [cache_key for _, _, cache_key in block], resolve_distances_block(block))
+
+async def check_request(request, endpoint):
+    """Allineamento allo stato condiviso e rate limiting dell'endpoint; ritorna la risposta 429 o None"""
+    await run_blocking(app2.before_request_sync)
+
+    client_ip = app2.get_client_ip(
+        request.headers.get("x-forwarded-for"),
+        request.client.host if request.client else None
+    )
+    limited = await run_blocking(app2.check_rate_limit, client_ip, endpoint)
+    if limited:
+        return ApiResponse(limited[0], status_code=limited[1])
+    return None
+
+async def get_distance(request):
+    """Endpoint per calcolare la distanza tra origin e destination"""
+    limited = await check_request(request, "get_distance")
+    if limited:
+        return limited
+
+    body, status, miss = await run_blocking(
+        app2.prepare_distance, request.query_params.get("origin"), request.query_params.get("destination")
+    )
+    if miss is None:
+        return ApiResponse(body, status_code=status)
+    origin_coords, dest_coords, cache_key, dest_point = miss
+
+    futures, owned = app2.claim_inflight([cache_key])
+    if owned:
+        start_upstream_task(futures, [cache_key], resolve_distance(origin_coords, dest_coords, cache_key))
+    value = (await wait_results(futures, [cache_key], time.monotonic() + app2.REQUEST_DEADLINE_SECONDS))[0]
+
+    body, status = app2.finish_distance(dest_point, value)
+    if status == 200:
+        # Salvataggio su disco fuori dall'event loop
+        await asyncio.to_thread(app2.persist_cache)
+    return ApiResponse(body, status_code=status)
+
+async def stream_all_distances(origin_coords, results, misses, stream_format):
+    """Versione asincrona di app2.stream_all_distances"""
+    for entry in results:
+        if entry is not None:
+            yield app2.format_stream_entry(entry, stream_format)
+
+    if misses:
+        deadline = time.monotonic() + app2.REQUEST_DEADLINE_SECONDS
+        futures = start_distances_batch(origin_coords, *app2.miss_destinations(misses))
+        waiting = app2.stream_waiting(misses, futures)
+        # Future asyncio -> Future di app2 (quelle del single-flight condiviso)
+        wrapped = {asyncio.wrap_future(future): future for future in waiting}
+
+        while wrapped:
+            done, _ = await asyncio.wait(
+                list(wrapped), timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                for line in app2.stream_timeouts(waiting, stream_format):
+                    yield line
+                break
+            for future in done:
+                for point in waiting.pop(wrapped.pop(future)):
+                    yield app2.format_stream_entry(app2.distance_entry(point, future.result()), stream_format)
+
+        await asyncio.to_thread(app2.persist_cache)
+
+    yield app2.format_stream_end(stream_format, len(results))
+
+async def get_all_distances(request):
+    """Endpoint per calcolare distanze da origin a tutti i punti di interesse"""
+    limited = await check_request(request, "get_all_distances")
+    if limited:
+        return limited
+
+    started_at = time.monotonic()
+    stream_format = app2.get_stream_format(request.query_params.get("stream"), request.headers.get("accept"))
+    if not stream_format:
+        prefix, version, cached = app2.lookup_response_cache(request.query_params.get("origin"))
+        if cached:
+            return cached_json_response(request, *cached)
+
+    error, origin_coords, results, misses = await run_blocking(
+        app2.prepare_all_distances, request.query_params.get("origin")
+    )
+    if error:
+        return ApiResponse(error[0], status_code=error[1])
+
+    if stream_format:
+        return StreamingResponse(
+            stream_all_distances(origin_coords, results, misses, stream_format),
+            media_type=app2.STREAM_CONTENT_TYPES[stream_format],
+            headers=app2.stream_headers()
+        )
+
+    await resolve_misses(origin_coords, results, misses)
+    stored = app2.store_response(prefix, version, results, misses, started_at)
+    if stored:
+        return cached_json_response(request, *stored)
+    return ApiResponse(results)
+
+async def resolve_misses(origin_coords, results, misses):
+    """Versione asincrona di app2.resolve_misses"""
+    if not misses:
+        return results
+
+    batch = await get_distances_batch(
+        origin_coords, *app2.miss_destinations(misses), deadline=time.monotonic() + app2.REQUEST_DEADLINE_SECONDS
+    )
+    app2.finish_all_distances(results, misses, batch)
+    await asyncio.to_thread(app2.persist_cache)
+    return results
+
+async def batch_distances(request):
+    """Endpoint per le distanze di molte coppie (origine, punto di interesse) in una richiesta"""
+    limited = await check_request(request, "batch_distances")
+    if limited:
+        return limited
+
+    content_type = request.headers.get("content-type")
+    error, pairs = app2.parse_batch_pairs(await request.body(), content_type)
+    if error:
+        return ApiResponse(error[0], status_code=error[1])
+
+    results, misses, summary = await run_blocking(app2.prepare_distances_batch, pairs)
+    if misses:
+        deadline = time.monotonic() + app2.BATCH_DEADLINE_SECONDS
+        futures = start_batch_misses(misses, deadline)
+        await wait_results(futures, list(futures), deadline)
+        app2.finish_distances_batch(pairs, results, misses, futures, summary)
+        await asyncio.to_thread(app2.persist_cache)
+
+    body, media_type = app2.batch_response(results, summary, content_type)
+    return Response(body, media_type=media_type)
+
+async def get_nearest(request):
+    """Endpoint per i k punti di interesse più vicini a origin (a piedi)"""
+    limited = await check_request(request, "get_nearest")
+    if limited:
+        return limited
+
+    k = request.query_params.get("k") or None
+    error, origin_coords, results, misses, haversine = await run_blocking(
+        app2.prepare_nearby, request.query_params.get("origin"), k
+    )
+    if error:
+        return ApiResponse(error[0], status_code=error[1])
+
+    await resolve_misses(origin_coords, results, misses)
+    return ApiResponse(app2.finish_nearby(results, haversine, int(k) if k else app2.NEAREST_DEFAULT_K))
+
+async def get_within(request):
+    """Endpoint per i punti di interesse entro radius metri in linea d'aria da origin"""
+    limited = await check_request(request, "get_within")
+    if limited:
+        return limited
+
+    error, origin_coords, results, misses, haversine = await run_blocking(
+        app2.prepare_nearby, request.query_params.get("origin"), None, request.query_params.get("radius") or ""
+    )
+    if error:
+        return ApiResponse(error[0], status_code=error[1])
+
+    await resolve_misses(origin_coords, results, misses)
+    return ApiResponse(app2.finish_nearby(results, haversine))
+
+async def get_points(request):
+    """Endpoint per ricaricare i punti di interesse da Strapi"""
+    limited = await check_request(request, "get_points")
+    if limited:
+        return limited
+
+    if request.query_params.get("secret") != app2.ADMIN_SECRET:
+        return ApiResponse({"error": "Invalid secret"}, status_code=401)
+
+    try:
+        # Lettura paginata (pagine in parallelo su thread), differenze, indice e file fuori dall'event loop
+        warmup = app2.POINTS_RELOAD_WARMUP or request.query_params.get("warmup") in ("1", "true")
+        full = request.query_params.get("full") in ("1", "true")
+        changes, fetch_info = await asyncio.to_thread(app2.reload_points, warmup, full)
+
+        return ApiResponse({
+            "success": True,
+            "points_loaded": len(app2.points_of_interest),
+            "points": app2.points_of_interest,
+            "changes": changes,
+            "strapi": fetch_info
+        })
+
+    except Exception as e:
+        return ApiResponse({"error": f"Failed to load points from Strapi: {str(e)}"}, status_code=500)
+
+async def health_check(request):
+    """Endpoint dedicato per health check"""
+    limited = await check_request(request, "health_check")
+    if limited:
+        return limited
+
+    return ApiResponse(app2.health_payload())
+
+@asynccontextmanager
+async def lifespan(app):
+    print(f"🚀 Distance Lookup Service v2 (ASGI)")
+    print(f"📍 Loaded {len(app2.points_of_interest)} points of interest")
+    print(f"💾 Loaded {len(app2.distance_cache)} cache entries")
+    yield
+    await close_async_client()
+
+app = Starlette(
+    routes=[
+        Route("/health", health_check, methods=["GET"]),
+        Route("/get_points", get_points, methods=["GET", "POST"]),
+        Route("/distance", get_distance, methods=["GET"]),
+        Route("/all_distances", get_all_distances, methods=["GET"]),
+        Route("/nearest", get_nearest, methods=["GET"]),
+        Route("/within", get_within, methods=["GET"]),
+        Route("/distances/batch", batch_distances, methods=["POST"]),
+        # Tutto il resto (admin, /) resta sull'app Flask
+        Mount("/", app=WSGIMiddleware(app2.app))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,420 @@
+# cache_backends.py - Backend di persistenza per distance_cache
+#
+# Backend disponibili (variabile CACHE_BACKEND):
+#   json   - riscrive l'intero file distance_cache.json in modo atomico (comportamento storico,
+#            solo se richiesto esplicitamente: il JSON esistente viene importato dagli altri backend)
+#   log    - log append-only JSONL con compattazione periodica
+#   sqlite   - database SQLite in modalità WAL
+#   snapshot - snapshot binario mappato in memoria (cache_snapshot), avvio a costo costante,
+#              più un log append-only delle modifiche compattato nello snapshot periodicamente
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+
+from cache_snapshot import CacheSnapshot, write_snapshot, rows_from_entries
+
+class JsonCacheBackend:
+    """Salva l'intera cache in un unico file JSON ad ogni salvataggio"""
+
+    name = "json"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, cache, keys):
+        # Scrittura atomica: file temporaneo + os.replace, un crash non tronca la cache
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(cache), f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def delete(self, cache, keys):
+        # Il file viene riscritto per intero al prossimo save
+        pass
+
+    def clear(self):
+        self.save({}, [])
+
+    def close(self):
+        pass
+
+def read_log(path, changes):
+    """Applica a changes ({chiave: valore oppure None se cancellata}) le righe di un log JSONL.
+
+    Una riga troncata da un crash viene ignorata e tolta dal file, così le prossime append
+    partono da una riga nuova. Ritorna il numero di righe valide.
+    """
+    lines = 0
+    valid_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Riga incompleta (scrittura interrotta): viene scartata
+                break
+            valid_size += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            lines += 1
+            changes[record["k"]] = None if record.get("d") else record["v"]
+    
+    if valid_size < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_size)
+    return lines
+
+def append_log(path, records):
+    """Aggiunge i record in fondo al log JSONL (con fsync)"""
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def log_records(cache, keys):
+    """Record del log per le chiavi salvate (le chiavi non più in cache vengono saltate)"""
+    records = []
+    for key in keys:
+        value = cache.get(key)
+        if value is not None:
+            records.append({"k": key, "v": value})
+    return records
+
+class AppendLogCacheBackend:
+    """Log append-only: ogni salvataggio aggiunge solo le entry nuove o modificate.
+
+    Una riga per entry ({"k": chiave, "v": valore} oppure {"k": chiave, "d": 1} per le
+    cancellazioni). Al caricamento l'ultima riga per chiave vince e una riga troncata da un
+    crash viene ignorata. Quando le righe superano COMPACT_RATIO volte le entry vive il log
+    viene riscritto su un file temporaneo e sostituito con os.replace.
+    """
+
+    name = "log"
+    COMPACT_RATIO = 2
+    COMPACT_MIN_LINES = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.lines = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        changes = {}
+        self.lines = read_log(self.path, changes)
+        return {key: value for key, value in changes.items() if value is not None}
+
+    def _append(self, records):
+        append_log(self.path, records)
+        self.lines += len(records)
+
+    def save(self, cache, keys):
+        records = log_records(cache, keys)
+        if not records:
+            return
+        with self.lock:
+            self._append(records)
+            if self.lines >= self.COMPACT_MIN_LINES and self.lines > self.COMPACT_RATIO * len(cache):
+                self._compact(cache)
+
+    def delete(self, cache, keys):
+        records = [{"k": key, "d": 1} for key in keys]
+        if not records:
+            return
+        with self.lock:
+            self._append(records)
+
+    def _compact(self, cache):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for key, value in list(cache.items()):
+                f.write(json.dumps({"k": key, "v": value}, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.lines = len(cache)
+        print(f"✅ Compacted cache log to {self.lines} entries")
+
+    def compact(self, cache):
+        with self.lock:
+            self._compact(cache)
+
+    def clear(self):
+        with self.lock:
+            self._compact({})
+
+    def close(self):
+        pass
+
+class SqliteCacheBackend:
+    """Cache su SQLite in modalità WAL: ogni salvataggio è una transazione con le sole entry nuove"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS distance_cache ("
+                "key TEXT PRIMARY KEY, distance INTEGER NOT NULL, duration INTEGER NOT NULL, "
+                "cached_at INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(distance_cache)")]
+            if "cached_at" not in columns:
+                self.conn.execute("ALTER TABLE distance_cache ADD COLUMN cached_at INTEGER NOT NULL DEFAULT 0")
+            self.conn.commit()
+        return self.conn
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with self.lock:
+            rows = self._connect().execute("SELECT key, distance, duration, cached_at FROM distance_cache").fetchall()
+        cache = {}
+        for key, distance, duration, cached_at in rows:
+            cache[key] = {"distance": distance, "duration": duration}
+            if cached_at:
+                cache[key]["cached_at"] = cached_at
+        return cache
+
+    def save(self, cache, keys):
+        rows = []
+        for key in keys:
+            value = cache.get(key)
+            if value is not None:
+                rows.append((key, value["distance"], value["duration"], value.get("cached_at", 0)))
+        if not rows:
+            return
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO distance_cache (key, distance, duration, cached_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+
+    def get_many(self, keys):
+        """Legge dal database le entry indicate (usato come cache condivisa tra worker)"""
+        keys = list(keys)
+        cache = {}
+        with self.lock:
+            conn = self._connect()
+            # SQLite limita il numero di parametri per query
+            for offset in range(0, len(keys), 500):
+                chunk = keys[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, distance, duration, cached_at FROM distance_cache WHERE key IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for key, distance, duration, cached_at in rows:
+                    cache[key] = {"distance": distance, "duration": duration, "cached_at": cached_at}
+        return cache
+
+    def delete(self, cache, keys):
+        rows = [(key,) for key in keys]
+        if not rows:
+            return
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("DELETE FROM distance_cache WHERE key = ?", rows)
+
+    def delete_suffixes(self, suffixes):
+        """Elimina le entry la cui chiave termina con uno dei suffissi (destinazioni ",lat,lon")"""
+        removed = 0
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                for suffix in suffixes:
+                    removed += conn.execute(
+                        "DELETE FROM distance_cache WHERE substr(key, -?) = ?", (len(suffix), suffix)
+                    ).rowcount
+        return removed
+
+    def trim(self, max_entries, ttl_seconds, now):
+        """Applica capacità e TTL direttamente sul database (modalità condivisa); ritorna le righe eliminate"""
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                removed = 0
+                if ttl_seconds > 0:
+                    removed += conn.execute(
+                        "DELETE FROM distance_cache WHERE cached_at > 0 AND cached_at < ?", (int(now - ttl_seconds),)
+                    ).rowcount
+                if max_entries > 0:
+                    removed += conn.execute(
+                        "DELETE FROM distance_cache WHERE key IN ("
+                        "SELECT key FROM distance_cache ORDER BY cached_at DESC LIMIT -1 OFFSET ?)",
+                        (max_entries,)
+                    ).rowcount
+        return removed
+
+    def clear(self):
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM distance_cache")
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class SnapshotCacheBackend:
+    """Snapshot binario della cache (vedi cache_snapshot) più un log delle modifiche.
+
+    All'avvio lo snapshot viene solo mappato in memoria (open_snapshot) e la cache compatta legge
+    le righe al primo accesso; le modifiche successive allo snapshot (load_log) vengono riapplicate
+    sopra. Ogni salvataggio aggiunge al log solo le entry nuove, modificate o cancellate, nello
+    stesso formato di AppendLogCacheBackend, quindi costa come la modifica e non come la cache.
+    compact() riscrive lo snapshot e svuota il log: va chiamata in background e allo shutdown.
+    Il JSON resta il formato di import/export.
+    """
+
+    name = "snapshot"
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + ".log"
+        # Log della compattazione in corso (o interrotta): cancellato solo dopo aver scritto lo snapshot
+        self.old_log_path = self.log_path + ".old"
+        # lock protegge append e rotazione del log, compact_lock permette una compattazione alla volta
+        self.lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.log_lines = 0
+        self.compacted_at = time.time()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open_snapshot(self):
+        return CacheSnapshot(self.path)
+
+    def load_log(self):
+        """Modifiche successive allo snapshot: {chiave: valore oppure None se cancellata}"""
+        changes = {}
+        with self.lock:
+            self.log_lines = 0
+            for path in (self.old_log_path, self.log_path):
+                if os.path.exists(path):
+                    self.log_lines += read_log(path, changes)
+        return changes
+
+    def load(self):
+        snapshot = CacheSnapshot(self.path)
+        try:
+            cache = snapshot.to_dict()
+        finally:
+            snapshot.close()
+        for key, value in self.load_log().items():
+            if value is None:
+                cache.pop(key, None)
+            else:
+                cache[key] = value
+        return cache
+
+    def _append(self, records):
+        if not records:
+            return
+        with self.lock:
+            append_log(self.log_path, records)
+            self.log_lines += len(records)
+
+    def save(self, cache, keys):
+        self._append(log_records(cache, keys))
+
+    def delete(self, cache, keys):
+        self._append([{"k": key, "d": 1} for key in keys])
+
+    def _rotate_log(self):
+        """Sposta il log corrente in old_log_path: i salvataggi durante la compattazione vanno nel log nuovo"""
+        if not os.path.exists(self.log_path):
+            return
+        if os.path.exists(self.old_log_path):
+            # Compattazione precedente interrotta: il suo log serve ancora, si accoda
+            with open(self.log_path, 'rb') as source, open(self.old_log_path, 'ab') as target:
+                shutil.copyfileobj(source, target)
+                target.flush()
+                os.fsync(target.fileno())
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.old_log_path)
+
+    def compact(self, cache):
+        """Riscrive lo snapshot con il contenuto della cache e svuota il log.
+
+        Il log viene ruotato prima di copiare la cache: ciò che è nel log ruotato è già in memoria,
+        ciò che viene salvato durante la copia finisce nel log nuovo e viene riapplicato all'avvio.
+        Ritorna il numero di entry scritte oppure None se non c'era niente da compattare o la cache
+        è stata svuotata durante la copia (il log ruotato resta e verrà compattato la volta dopo).
+        """
+        with self.compact_lock:
+            with self.lock:
+                if not self.log_lines and not os.path.exists(self.old_log_path) and os.path.exists(self.path):
+                    return None
+                self._rotate_log()
+                self.log_lines = 0
+            if hasattr(cache, "snapshot_data"):
+                data = cache.snapshot_data()
+            else:
+                data = rows_from_entries(dict(cache.items()))
+            if data is None:
+                return None
+            entries = write_snapshot(self.path, *data)
+            if os.path.exists(self.old_log_path):
+                os.remove(self.old_log_path)
+            self.compacted_at = time.time()
+            print(f"✅ Compacted cache snapshot to {entries} entries")
+            return entries
+
+    def clear(self):
+        with self.compact_lock, self.lock:
+            write_snapshot(self.path, [], [])
+            for path in (self.old_log_path, self.log_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.log_lines = 0
+
+    def close(self):
+        pass
+
+def create_cache_backend(kind, shared_dir):
+    """Crea il backend di persistenza indicato da CACHE_BACKEND"""
+    if kind == "log":
+        return AppendLogCacheBackend(os.path.join(shared_dir, "distance_cache.log"))
+    if kind == "sqlite":
+        return SqliteCacheBackend(os.path.join(shared_dir, "distance_cache.db"))
+    if kind == "snapshot":
+        return SnapshotCacheBackend(os.path.join(shared_dir, "distance_cache.snap"))
+    if kind == "json":
+        # Solo su richiesta esplicita: riscrive l'intero file a ogni salvataggio
+        return JsonCacheBackend(os.path.join(shared_dir, "distance_cache.json"))
+    print(f"⚠️  Unknown CACHE_BACKEND '{kind}', using log")
+    return AppendLogCacheBackend(os.path.join(shared_dir, "distance_cache.log"))
@@ -0,0 +1,213 @@
+# cache_snapshot.py - Snapshot binario di distance_cache letto con mmap
+#
+# All'avvio il file viene solo mappato in memoria (costo costante qualunque sia la dimensione
+# della cache): le righe delle origini vengono copiate nella cache in memoria al primo accesso.
+# Formato (little-endian, versione 1):
+#
+#   header    "DISTSNAP", uint16 versione, uint16 larghezza prefisso, uint32 destinazioni,
+#             uint32 origini, uint32 entry, uint32 byte delle destinazioni, uint32 creato il
+#   dests     suffissi ",lat,lon" delle destinazioni separati da "\n" (numero colonna = posizione)
+#   rows      per origine: prefisso (larghezza fissa, completato con \0), uint32 prima entry,
+#             uint32 numero entry; dalla meno usata di recente
+#   index     uint32 numero riga per ogni origine, in ordine di prefisso (ricerca binaria)
+#   columns   uint32[entry]  \
+#   distances int32[entry]    | entry di ogni origine contigue, ordinate per colonna
+#   durations int32[entry]    |
+#   cached_at uint32[entry]  /
+#
+# Il JSON resta il formato di import/export:
+#   python cache_snapshot.py export shared/distance_cache.snap distance_cache.json
+#   python cache_snapshot.py import distance_cache.json shared/distance_cache.snap
+import os
+import sys
+import mmap
+import json
+import time
+import struct
+import argparse
+from array import array
+
+MAGIC = b"DISTSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIIII")
+ROW = struct.Struct("<II")
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def _split_key(key):
+    cut = key.rfind(',', 0, key.rfind(','))
+    return key[:cut], key[cut:]
+
+class CacheSnapshot:
+    """Snapshot in sola lettura su un file mappato in memoria"""
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("cache snapshots are little-endian")
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.prefix_width, dest_count, self.row_count, self.entry_count,
+         dests_size, self.created_at) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a cache snapshot")
+        if version != VERSION:
+            raise ValueError(f"unsupported cache snapshot version {version}")
+
+        offset = HEADER.size
+        dests = self.mm[offset:offset + dests_size].decode("utf-8")
+        self.dest_keys = dests.split("\n") if dest_count else []
+        offset = _align(offset + dests_size)
+        self.row_width = self.prefix_width + ROW.size
+        self.rows_offset = offset
+        offset = _align(offset + self.row_count * self.row_width)
+        view = memoryview(self.mm)
+        self.index = view[offset:offset + 4 * self.row_count].cast('I')
+        offset = _align(offset + 4 * self.row_count)
+        self.columns_offset = offset
+        self.distances_offset = offset + 4 * self.entry_count
+        self.durations_offset = offset + 8 * self.entry_count
+        self.cached_at_offset = offset + 12 * self.entry_count
+
+    def prefix(self, row):
+        start = self.rows_offset + row * self.row_width
+        return self.mm[start:start + self.prefix_width].rstrip(b"\0").decode("utf-8")
+
+    def row_range(self, row):
+        """(prima entry, numero entry) della riga"""
+        return ROW.unpack_from(self.mm, self.rows_offset + row * self.row_width + self.prefix_width)
+
+    def find(self, prefix):
+        """Numero di riga dell'origine oppure None (ricerca binaria sull'indice)"""
+        target = prefix.encode("utf-8")
+        if len(target) > self.prefix_width:
+            return None
+        low, high = 0, self.row_count
+        while low < high:
+            middle = (low + high) // 2
+            row = self.index[middle]
+            start = self.rows_offset + row * self.row_width
+            current = self.mm[start:start + self.prefix_width].rstrip(b"\0")
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                return row
+        return None
+
+    def row_bytes(self, row):
+        """Bytes di columns, distances, durations e cached_at della riga"""
+        first, count = self.row_range(row)
+        return tuple(
+            self.mm[offset + 4 * first:offset + 4 * (first + count)]
+            for offset in (self.columns_offset, self.distances_offset, self.durations_offset, self.cached_at_offset)
+        )
+
+    def read_row(self, row, into):
+        """Copia le entry della riga negli array di into (columns, distances, durations, cached_at)"""
+        for target, data in zip(into, self.row_bytes(row)):
+            target.frombytes(data)
+        return len(into[0])
+
+    def used_columns(self):
+        """Numeri di colonna delle destinazioni con almeno una entry"""
+        return set(array('I', self.mm[self.columns_offset:self.columns_offset + 4 * self.entry_count]))
+
+    def to_dict(self):
+        """Tutte le entry come {chiave: valore} (per la cache non compatta e l'export JSON)"""
+        entries = {}
+        for row in range(self.row_count):
+            prefix = self.prefix(row)
+            columns, distances, durations, cached_at = array('I'), array('i'), array('i'), array('I')
+            self.read_row(row, (columns, distances, durations, cached_at))
+            for column, distance, duration, added in zip(columns, distances, durations, cached_at):
+                entries[prefix + self.dest_keys[column]] = {"distance": distance, "duration": duration, "cached_at": added}
+        return entries
+
+    def close(self):
+        self.index.release()
+        self.mm.close()
+
+def write_snapshot(path, dest_keys, rows):
+    """Scrive uno snapshot in modo atomico.
+
+    dest_keys sono i suffissi delle destinazioni (colonne), rows una lista di (prefisso, columns,
+    distances, durations, cached_at) dalla meno usata di recente, con gli array (o bytes) di
+    ogni origine già ordinati per colonna.
+    """
+    dests = "\n".join(dest_keys).encode("utf-8")
+    prefixes = [prefix.encode("utf-8") for prefix, *_ in rows]
+    # Larghezza multipla di 4 per mantenere allineati i campi uint32 delle righe
+    prefix_width = (max((len(prefix) for prefix in prefixes), default=0) + 3) & ~3
+
+    table = bytearray()
+    sections = ([], [], [], [])
+    entry_count = 0
+    for prefix, (_, *arrays) in zip(prefixes, rows):
+        count = len(arrays[0]) // (1 if isinstance(arrays[0], array) else 4)
+        table += prefix.ljust(prefix_width, b"\0") + ROW.pack(entry_count, count)
+        for section, values in zip(sections, arrays):
+            section.append(values.tobytes() if isinstance(values, array) else values)
+        entry_count += count
+    index = array('I', sorted(range(len(rows)), key=prefixes.__getitem__))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        def pad():
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+
+        f.write(HEADER.pack(MAGIC, VERSION, prefix_width, len(dest_keys), len(rows), entry_count, len(dests), int(time.time())))
+        f.write(dests)
+        pad()
+        f.write(table)
+        pad()
+        f.write(index.tobytes())
+        pad()
+        for section in sections:
+            for chunk in section:
+                f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return entry_count
+
+def rows_from_entries(entries):
+    """Converte {chiave: valore} in (dest_keys, rows) per write_snapshot"""
+    dest_columns = {}
+    grouped = {}
+    now = int(time.time())
+    for key, value in sorted(entries.items(), key=lambda item: item[1].get("cached_at", now)):
+        prefix, suffix = _split_key(key)
+        column = dest_columns.setdefault(suffix, len(dest_columns))
+        grouped.setdefault(prefix, {})[column] = value
+    rows = []
+    for prefix, values in grouped.items():
+        columns = sorted(values)
+        rows.append((
+            prefix,
+            array('I', columns),
+            array('i', (int(values[column]["distance"]) for column in columns)),
+            array('i', (int(values[column]["duration"]) for column in columns)),
+            array('I', (int(values[column].get("cached_at", now)) for column in columns))
+        ))
+    return list(dest_columns), rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import/export of the binary distance cache snapshot")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("source")
+    parser.add_argument("target")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        entries = CacheSnapshot(args.source).to_dict()
+        with open(args.target, 'w') as f:
+            json.dump(entries, f, indent=2)
+        print(f"✅ Exported {len(entries)} cache entries to {args.target}")
+    else:
+        with open(args.source, 'r') as f:
+            entries = json.load(f)
+        count = write_snapshot(args.target, *rows_from_entries(entries))
+        print(f"✅ Imported {count} cache entries into {args.target}")
@@ -0,0 +1,19 @@
+# gunicorn.conf.py - Serving di produzione per app2.py (gunicorn -c gunicorn.conf.py app2:app)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# Modalità asincrona: GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker con app2_asgi:app
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 30
+accesslog = "-"
+
+# Niente preload: ogni worker importa app2 dopo il fork e crea i propri thread
+# (pool upstream, flusher della cache) e le proprie connessioni SQLite
+preload_app = False
+
+# Con più worker cache e rate limiting devono stare nello stato condiviso su SQLite
+if workers > 1:
+    os.environ.setdefault("SHARED_STATE", "true")
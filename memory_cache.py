@@ -0,0 +1,787 @@
+# memory_cache.py - Cache in memoria delle distanze con limite di capacità (LRU) e scadenza (TTL)
+# e indice delle origini in cache per il riuso dell'origine più vicina
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from math import floor, ceil, cos, radians
+
+class BoundedDistanceCache(OrderedDict):
+    """Cache LRU con TTL per le distanze.
+
+    Ogni valore è {"distance": ..., "duration": ..., "cached_at": epoch}. Le entry più vecchie
+    di ttl_seconds vengono scartate alla lettura; oltre max_entries viene eliminata la meno
+    usata di recente. Le chiavi rimosse vengono notificate a on_remove(keys, reason), con reason
+    tra "eviction", "expiration" e "invalidation", così che il backend di persistenza possa
+    cancellarle.
+    """
+
+    def __init__(self, max_entries=0, ttl_seconds=0, on_remove=None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_remove = on_remove
+        self.lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        # prefisso origine -> numero di chiavi in cache (per has_origin e origins)
+        self.origin_counts = {}
+
+    def _is_expired(self, value, now):
+        return self.ttl_seconds > 0 and now - value.get("cached_at", now) > self.ttl_seconds
+
+    def _put(self, key, value):
+        if not OrderedDict.__contains__(self, key):
+            prefix = split_cache_key(key)[0]
+            self.origin_counts[prefix] = self.origin_counts.get(prefix, 0) + 1
+        OrderedDict.__setitem__(self, key, value)
+        self.move_to_end(key)
+
+    def _forget(self, key):
+        """Aggiorna i conteggi per origine di una chiave già tolta dal dict"""
+        prefix = split_cache_key(key)[0]
+        count = self.origin_counts[prefix] - 1
+        if count:
+            self.origin_counts[prefix] = count
+        else:
+            del self.origin_counts[prefix]
+
+    def _removed(self, keys, reason):
+        if keys and self.on_remove:
+            self.on_remove(keys, reason)
+
+    def load_entries(self, entries):
+        """Carica le entry persistite (le più recenti in coda), scartando quelle scadute"""
+        now = time.time()
+        expired = []
+        with self.lock:
+            self.clear()
+            for key, value in sorted(entries.items(), key=lambda item: item[1].get("cached_at", now)):
+                value.setdefault("cached_at", int(now))
+                if self._is_expired(value, now):
+                    expired.append(key)
+                    continue
+                self._put(key, value)
+            self.stats["expirations"] += len(expired)
+            evicted = self._evict()
+        self._removed(expired, "expiration")
+        self._removed(evicted, "eviction")
+
+    def lookup(self, key):
+        """Ritorna il valore in cache (aggiornando l'ordine LRU) oppure None"""
+        expired = False
+        with self.lock:
+            value = OrderedDict.get(self, key)
+            if value is not None and self._is_expired(value, time.time()):
+                OrderedDict.__delitem__(self, key)
+                self._forget(key)
+                self.stats["expirations"] += 1
+                expired = True
+                value = None
+            if value is None:
+                self.stats["misses"] += 1
+            else:
+                self.move_to_end(key)
+                self.stats["hits"] += 1
+        if expired:
+            self._removed([key], "expiration")
+        return value
+
+    def store(self, key, distance, duration):
+        """Inserisce una entry ed elimina le meno usate oltre la capacità"""
+        with self.lock:
+            self._put(key, {"distance": distance, "duration": duration, "cached_at": int(time.time())})
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def insert(self, key, value):
+        """Inserisce una entry già completa (es. letta dalla cache condivisa) mantenendo cached_at"""
+        with self.lock:
+            self._put(key, value)
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def replay(self, changes):
+        """Riapplica le modifiche del log di persistenza ({chiave: valore oppure None se cancellata}).
+
+        Le cancellazioni sono già persistite e non vengono notificate a on_remove.
+        """
+        with self.lock:
+            for key, value in changes.items():
+                if value is None:
+                    if OrderedDict.pop(self, key, None) is not None:
+                        self._forget(key)
+                else:
+                    self._put(key, value)
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def _evict(self):
+        evicted = []
+        if self.max_entries > 0:
+            while len(self) > self.max_entries:
+                key, _ = self.popitem(last=False)
+                self._forget(key)
+                evicted.append(key)
+        self.stats["evictions"] += len(evicted)
+        return evicted
+
+    def lookup_many(self, keys):
+        """Come lookup per più chiavi; ritorna {chiave: valore} per le sole chiavi trovate"""
+        found = {}
+        for key in keys:
+            value = self.lookup(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def destinations(self):
+        """Suffissi ",lat,lon" delle destinazioni con almeno una entry"""
+        with self.lock:
+            return list({split_cache_key(key)[1] for key in self.keys()})
+
+    def invalidate(self, predicate):
+        """Rimuove tutte le chiavi per cui predicate(key) è vero, ritorna quante"""
+        with self.lock:
+            keys = [key for key in self.keys() if predicate(key)]
+            for key in keys:
+                OrderedDict.__delitem__(self, key)
+                self._forget(key)
+            self.stats["invalidations"] += len(keys)
+        self._removed(keys, "invalidation")
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self.origin_counts.clear()
+
+    def origins(self):
+        """Prefissi di tutte le origini in cache"""
+        with self.lock:
+            return list(self.origin_counts)
+
+    def has_origin(self, prefix):
+        """True se l'origine ha almeno una entry in cache"""
+        return prefix in self.origin_counts
+
+    def get_stats(self):
+        """Ritorna contatori e configurazione"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            entries=len(self),
+            max_entries=self.max_entries,
+            ttl_seconds=self.ttl_seconds,
+            hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else None
+        )
+
+def split_cache_key(key):
+    """Divide una chiave di cache in (prefisso origine, suffisso destinazione ",lat,lon")"""
+    cut = key.rfind(',', 0, key.rfind(','))
+    return key[:cut], key[cut:]
+
+class _OriginRow:
+    """Distanze in cache da una stessa origine: array paralleli ordinati per colonna (destinazione)"""
+
+    __slots__ = ("columns", "distances", "durations", "cached_at")
+
+    def __init__(self):
+        self.columns = array('I')
+        self.distances = array('i')
+        self.durations = array('i')
+        self.cached_at = array('I')
+
+    def find(self, column):
+        position = bisect_left(self.columns, column)
+        if position < len(self.columns) and self.columns[position] == column:
+            return position
+        return -1
+
+    def set(self, column, distance, duration, cached_at):
+        """Inserisce o aggiorna la colonna; ritorna True se è nuova"""
+        position = bisect_left(self.columns, column)
+        if position < len(self.columns) and self.columns[position] == column:
+            self.distances[position] = distance
+            self.durations[position] = duration
+            self.cached_at[position] = cached_at
+            return False
+        self.columns.insert(position, column)
+        self.distances.insert(position, distance)
+        self.durations.insert(position, duration)
+        self.cached_at.insert(position, cached_at)
+        return True
+
+    def remove(self, position):
+        del self.columns[position]
+        del self.distances[position]
+        del self.durations[position]
+        del self.cached_at[position]
+
+    def value(self, position):
+        return {
+            "distance": self.distances[position],
+            "duration": self.durations[position],
+            "cached_at": self.cached_at[position]
+        }
+
+class CompactDistanceCache:
+    """Cache LRU con TTL per le distanze in forma compatta, con la stessa interfaccia di
+    BoundedDistanceCache (le chiavi restano le stringhe di get_cache_key).
+
+    Le chiavi vengono divise in origine e destinazione: ogni destinazione riceve un numero di
+    colonna, ogni origine una riga (_OriginRow) con array int32 di colonne, distanze, durate e
+    istanti di inserimento, circa 16 byte per entry invece di una stringa e un dict. I valori
+    ritornati sono dict costruiti alla lettura. La riga è anche l'unità LRU: un /all_distances
+    legge tutte le destinazioni con un solo accesso alla riga e oltre max_entries si elimina
+    l'origine usata meno di recente con tutte le sue entry.
+
+    Con attach_snapshot le righe restano nello snapshot mappato in memoria finché non servono:
+    la prima lettura o scrittura di un'origine ne copia la riga negli array in memoria. Le righe
+    ancora nello snapshot contano nella capacità e sono le prime ad essere eliminate.
+    """
+
+    def __init__(self, max_entries=0, ttl_seconds=0, on_remove=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_remove = on_remove
+        self.lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        # prefisso origine -> _OriginRow, dalla meno usata di recente
+        self.rows = OrderedDict()
+        # suffisso destinazione -> colonna e viceversa
+        self.columns = {}
+        self.column_keys = []
+        self.size = 0
+        # Incrementata a ogni svuotamento o sostituzione del contenuto (numeri di colonna non più validi)
+        self.generation = 0
+        self._detach_snapshot()
+
+    def _detach_snapshot(self):
+        self.snapshot = None
+        # 1 per le righe dello snapshot già copiate in memoria o eliminate
+        self.snapshot_taken = bytearray()
+        self.snapshot_entries = 0
+        self.snapshot_rows = 0
+        self.snapshot_cursor = 0
+
+    def _column(self, suffix):
+        column = self.columns.get(suffix)
+        if column is None:
+            column = self.columns[suffix] = len(self.column_keys)
+            self.column_keys.append(suffix)
+        return column
+
+    def _is_expired(self, cached_at, now):
+        return self.ttl_seconds > 0 and now - cached_at > self.ttl_seconds
+
+    def _removed(self, keys, reason):
+        if keys and self.on_remove:
+            self.on_remove(keys, reason)
+
+    def _take_snapshot_row(self, index):
+        """Toglie la riga dallo snapshot; ritorna il numero di entry"""
+        self.snapshot_taken[index] = 1
+        self.snapshot_rows -= 1
+        _, count = self.snapshot.row_range(index)
+        self.snapshot_entries -= count
+        return count
+
+    def _row(self, prefix):
+        """Riga dell'origine, copiata dallo snapshot al primo accesso; None se non c'è"""
+        row = self.rows.get(prefix)
+        if row is None and self.snapshot_rows:
+            index = self.snapshot.find(prefix)
+            if index is not None and not self.snapshot_taken[index]:
+                row = self.rows[prefix] = _OriginRow()
+                self.snapshot.read_row(index, (row.columns, row.distances, row.durations, row.cached_at))
+                self.size += self._take_snapshot_row(index)
+        return row
+
+    def _load_snapshot_rows(self):
+        """Copia in memoria tutte le righe rimaste nello snapshot (più vecchie di quelle già in memoria)"""
+        if not self.snapshot_rows:
+            return
+        rows = OrderedDict()
+        for index in range(self.snapshot.row_count):
+            if not self.snapshot_taken[index]:
+                row = rows[self.snapshot.prefix(index)] = _OriginRow()
+                self.snapshot.read_row(index, (row.columns, row.distances, row.durations, row.cached_at))
+                self.size += self._take_snapshot_row(index)
+        rows.update(self.rows)
+        self.rows = rows
+
+    def _set(self, key, distance, duration, cached_at):
+        prefix, suffix = split_cache_key(key)
+        row = self._row(prefix)
+        if row is None:
+            row = self.rows[prefix] = _OriginRow()
+        else:
+            self.rows.move_to_end(prefix)
+        if row.set(self._column(suffix), int(distance), int(duration), int(cached_at)):
+            self.size += 1
+
+    def _locate(self, key):
+        """Ritorna (prefisso, riga, posizione) della chiave oppure None"""
+        prefix, suffix = split_cache_key(key)
+        column = self.columns.get(suffix)
+        row = self._row(prefix) if column is not None else None
+        if row is None or column is None:
+            return None
+        position = row.find(column)
+        return (prefix, row, position) if position >= 0 else None
+
+    def _delete(self, prefix, row, position):
+        row.remove(position)
+        self.size -= 1
+        if not len(row.columns):
+            del self.rows[prefix]
+
+    def _evict(self):
+        evicted = []
+        if self.max_entries > 0:
+            # Prima le righe mai lette dello snapshot, nell'ordine LRU in cui sono state salvate
+            while self.size + self.snapshot_entries > self.max_entries and self.snapshot_rows:
+                index = self.snapshot_cursor
+                self.snapshot_cursor += 1
+                if self.snapshot_taken[index]:
+                    continue
+                columns = array('I')
+                self.snapshot.read_row(index, (columns, array('i'), array('i'), array('I')))
+                prefix = self.snapshot.prefix(index)
+                evicted.extend(prefix + self.column_keys[column] for column in columns)
+                self._take_snapshot_row(index)
+            while self.size > self.max_entries and self.rows:
+                prefix, row = self.rows.popitem(last=False)
+                evicted.extend(prefix + self.column_keys[column] for column in row.columns)
+                self.size -= len(row.columns)
+        self.stats["evictions"] += len(evicted)
+        return evicted
+
+    def load_entries(self, entries):
+        """Carica le entry persistite (le più recenti in coda), scartando quelle scadute"""
+        now = time.time()
+        expired = []
+        with self.lock:
+            self._clear()
+            for key, value in sorted(entries.items(), key=lambda item: item[1].get("cached_at", now)):
+                cached_at = value.get("cached_at") or int(now)
+                if self._is_expired(cached_at, now):
+                    expired.append(key)
+                    continue
+                self._set(key, value["distance"], value["duration"], cached_at)
+            self.stats["expirations"] += len(expired)
+            evicted = self._evict()
+        self._removed(expired, "expiration")
+        self._removed(evicted, "eviction")
+
+    def attach_snapshot(self, snapshot):
+        """Sostituisce il contenuto con uno snapshot (cache_snapshot.CacheSnapshot) letto in modo lazy.
+
+        Costo costante: le righe vengono lette al primo accesso, le entry scadute scartate
+        alla lettura come per quelle in memoria.
+        """
+        with self.lock:
+            self._clear()
+            self.snapshot = snapshot
+            self.snapshot_taken = bytearray(snapshot.row_count)
+            self.snapshot_entries = snapshot.entry_count
+            self.snapshot_rows = snapshot.row_count
+            self.column_keys = list(snapshot.dest_keys)
+            self.columns = {suffix: column for column, suffix in enumerate(self.column_keys)}
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def snapshot_data(self, batch_rows=256):
+        """Contenuto per cache_snapshot.write_snapshot: (dest_keys, rows) con le righe ancora nello
+        snapshot copiate così come sono, dalla meno usata di recente.
+
+        Il lock viene preso per blocchi di batch_rows righe, così le richieste non restano ferme per
+        tutta la copia: una riga modificata nel frattempo può essere copiata prima o dopo la modifica
+        (il chiamante la ritrova nel proprio log). Ritorna None se la cache è stata svuotata o
+        sostituita durante la copia.
+        """
+        with self.lock:
+            generation = self.generation
+            # (riga dello snapshot, None) oppure (None, prefisso in memoria)
+            pending = [
+                (index, None)
+                for index in range(self.snapshot.row_count if self.snapshot_rows else 0)
+                if not self.snapshot_taken[index]
+            ]
+            pending.extend((None, prefix) for prefix in self.rows)
+        rows = []
+        copied = set()
+        for start in range(0, len(pending), batch_rows):
+            with self.lock:
+                if self.generation != generation:
+                    return None
+                for index, prefix in pending[start:start + batch_rows]:
+                    if index is not None:
+                        prefix = self.snapshot.prefix(index)
+                        if not self.snapshot_taken[index]:
+                            copied.add(prefix)
+                            rows.append((prefix, *self.snapshot.row_bytes(index)))
+                            continue
+                    # Righe dello snapshot lette in memoria dopo l'elenco: si copia la versione in memoria
+                    row = self.rows.get(prefix)
+                    if row is not None and prefix not in copied:
+                        copied.add(prefix)
+                        rows.append((prefix, row.columns.tobytes(), row.distances.tobytes(),
+                                     row.durations.tobytes(), row.cached_at.tobytes()))
+        with self.lock:
+            if self.generation != generation:
+                return None
+            return list(self.column_keys), rows
+
+    def origins(self):
+        """Prefissi di tutte le origini in cache, senza leggere le righe dello snapshot"""
+        with self.lock:
+            prefixes = list(self.rows)
+            if self.snapshot_rows:
+                prefixes.extend(
+                    self.snapshot.prefix(index)
+                    for index in range(self.snapshot.row_count)
+                    if not self.snapshot_taken[index]
+                )
+            return prefixes
+
+    def has_origin(self, prefix):
+        """True se l'origine ha almeno una entry in cache (in memoria o nello snapshot)"""
+        with self.lock:
+            if prefix in self.rows:
+                return True
+            if not self.snapshot_rows:
+                return False
+            index = self.snapshot.find(prefix)
+            return index is not None and not self.snapshot_taken[index]
+
+    def destinations(self):
+        """Suffissi ",lat,lon" delle destinazioni con almeno una entry, senza leggere le righe dello
+        snapshot (le sue colonne sono un solo array)"""
+        with self.lock:
+            used = set()
+            for row in self.rows.values():
+                used.update(row.columns)
+            if self.snapshot_rows:
+                used.update(self.snapshot.used_columns())
+            return [self.column_keys[column] for column in used]
+
+    def lookup_many(self, keys):
+        """Cerca più chiavi aggiornando l'ordine LRU una volta per origine; ritorna {chiave: valore}
+        per le sole chiavi trovate.
+
+        Le chiavi di una richiesta hanno di solito la stessa origine: prefisso e riga vengono
+        cercati solo quando l'origine cambia, per le altre chiavi basta la colonna del suffisso.
+        """
+        now = time.time()
+        found = {}
+        expired = []
+        with self.lock:
+            prefix = None
+            row = None
+            touched = False
+            for key in keys:
+                suffix = key[len(prefix):] if prefix is not None and key.startswith(prefix) else ""
+                if suffix[:1] != ',' or suffix.count(',') != 2:
+                    prefix, suffix = split_cache_key(key)
+                    row = self._row(prefix)
+                    touched = False
+                column = self.columns.get(suffix) if row is not None else None
+                position = row.find(column) if column is not None else -1
+                if position < 0:
+                    self.stats["misses"] += 1
+                    continue
+                if self._is_expired(row.cached_at[position], now):
+                    self._delete(prefix, row, position)
+                    if prefix not in self.rows:
+                        row = None
+                    self.stats["expirations"] += 1
+                    self.stats["misses"] += 1
+                    expired.append(key)
+                    continue
+                found[key] = row.value(position)
+                self.stats["hits"] += 1
+                if not touched:
+                    touched = True
+                    self.rows.move_to_end(prefix)
+        self._removed(expired, "expiration")
+        return found
+
+    def lookup(self, key):
+        """Ritorna il valore in cache (aggiornando l'ordine LRU) oppure None"""
+        return self.lookup_many([key]).get(key)
+
+    def store(self, key, distance, duration):
+        """Inserisce una entry ed elimina le origini meno usate oltre la capacità"""
+        with self.lock:
+            self._set(key, distance, duration, time.time())
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def insert(self, key, value):
+        """Inserisce una entry già completa (es. letta dalla cache condivisa) mantenendo cached_at"""
+        with self.lock:
+            self._set(key, value["distance"], value["duration"], value.get("cached_at") or time.time())
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def replay(self, changes):
+        """Riapplica le modifiche del log di persistenza ({chiave: valore oppure None se cancellata}).
+
+        Le cancellazioni sono già persistite e non vengono notificate a on_remove.
+        """
+        with self.lock:
+            for key, value in changes.items():
+                if value is None:
+                    location = self._locate(key)
+                    if location is not None:
+                        self._delete(*location)
+                else:
+                    self._set(key, value["distance"], value["duration"], value.get("cached_at") or time.time())
+            evicted = self._evict()
+        self._removed(evicted, "eviction")
+
+    def get(self, key, default=None):
+        """Valore della chiave senza statistiche né aggiornamento LRU (come dict.get)"""
+        with self.lock:
+            location = self._locate(key)
+            if location is None:
+                return default
+            _, row, position = location
+            return row.value(position)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.size + self.snapshot_entries
+
+    def keys(self):
+        """Tutte le chiavi (dalla origine meno usata di recente)"""
+        with self.lock:
+            self._load_snapshot_rows()
+            return [prefix + self.column_keys[column] for prefix, row in self.rows.items() for column in row.columns]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        with self.lock:
+            self._load_snapshot_rows()
+            return [
+                (prefix + self.column_keys[column], row.value(position))
+                for prefix, row in self.rows.items()
+                for position, column in enumerate(row.columns)
+            ]
+
+    def invalidate(self, predicate):
+        """Rimuove tutte le chiavi per cui predicate(key) è vero, ritorna quante"""
+        keys = []
+        with self.lock:
+            self._load_snapshot_rows()
+            for prefix, row in list(self.rows.items()):
+                for position in range(len(row.columns) - 1, -1, -1):
+                    key = prefix + self.column_keys[row.columns[position]]
+                    if predicate(key):
+                        keys.append(key)
+                        self._delete(prefix, row, position)
+            self.stats["invalidations"] += len(keys)
+        self._removed(keys, "invalidation")
+        return len(keys)
+
+    def _clear(self):
+        self.rows.clear()
+        self.columns.clear()
+        self.column_keys = []
+        self.size = 0
+        self.generation += 1
+        self._detach_snapshot()
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def get_stats(self):
+        """Ritorna contatori e configurazione"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            entries=len(self),
+            origins=len(self.rows) + self.snapshot_rows,
+            snapshot_pending_entries=self.snapshot_entries,
+            destinations=len(self.column_keys),
+            max_entries=self.max_entries,
+            ttl_seconds=self.ttl_seconds,
+            hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else None
+        )
+
+class ResponseCache:
+    """Risposte già serializzate (bytes ed ETag) per prefisso di origine, con LRU e durata massima.
+
+    Ogni risposta vale per l'oggetto indicato come version (l'indice dei punti da cui è stata
+    costruita): dopo un reload dei punti non viene più servita. invalidate(prefix) va chiamato
+    quando cambiano le entry di cache di quell'origine; una risposta calcolata da una richiesta
+    iniziata prima dell'ultima invalidazione del prefisso non viene salvata.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "rejected": 0, "invalidations": 0}
+        # prefisso -> (version, body, etag, creata il), dalla meno usata di recente
+        self.entries = OrderedDict()
+        # prefisso -> istante (monotonic) dell'ultima invalidazione, solo entro ttl_seconds
+        self.invalidated_at = OrderedDict()
+        self.cleared_at = -1
+
+    def get(self, prefix, version):
+        """Ritorna (body, etag) oppure None"""
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(prefix)
+            if entry is None or entry[0] is not version or now - entry[3] > self.ttl_seconds:
+                if entry is not None:
+                    del self.entries[prefix]
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(prefix)
+            self.stats["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, prefix, version, body, etag, started_at):
+        """Salva la risposta calcolata da una richiesta iniziata a started_at (monotonic)"""
+        if self.max_entries <= 0:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            invalidated_at = max(self.cleared_at, self.invalidated_at.get(prefix, -1))
+            if now - started_at > self.ttl_seconds or invalidated_at >= started_at:
+                self.stats["rejected"] += 1
+                return False
+            self.entries[prefix] = (version, body, etag, now)
+            self.entries.move_to_end(prefix)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.stats["stores"] += 1
+            return True
+
+    def invalidate(self, prefixes):
+        if self.max_entries <= 0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            for prefix in prefixes:
+                if self.entries.pop(prefix, None) is not None:
+                    self.stats["invalidations"] += 1
+                self.invalidated_at[prefix] = now
+                self.invalidated_at.move_to_end(prefix)
+            # Le richieste più vecchie di ttl_seconds non salvano comunque
+            while self.invalidated_at:
+                prefix, at = next(iter(self.invalidated_at.items()))
+                if now - at <= self.ttl_seconds:
+                    break
+                del self.invalidated_at[prefix]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidated_at.clear()
+            # Anche le richieste in corso non devono salvare
+            self.cleared_at = time.monotonic()
+
+    def get_stats(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            entries=len(self.entries),
+            max_entries=self.max_entries,
+            ttl_seconds=self.ttl_seconds,
+            hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else None
+        )
+
+class OriginIndex:
+    """Indice a griglia delle origini presenti in cache, per il riuso dell'origine più vicina.
+
+    Le origini sono identificate dal prefisso della chiave di cache (tutto tranne gli ultimi due
+    campi, cioè le coordinate della destinazione); decode_origin converte il prefisso in (lat, lon).
+    """
+
+    METERS_PER_DEGREE = 111320
+
+    def __init__(self, radius_m, decode_origin):
+        self.radius_m = radius_m
+        self.cell_deg = max(radius_m, 1) / self.METERS_PER_DEGREE
+        self.decode_origin = decode_origin
+        self.cells = {}
+        self.lock = threading.Lock()
+
+    split_key = staticmethod(split_cache_key)
+
+    def _cell(self, lat, lon):
+        return floor(lat / self.cell_deg), floor(lon / self.cell_deg)
+
+    def add_keys(self, keys):
+        """Registra le origini delle chiavi indicate"""
+        self.add_prefixes([self.split_key(key)[0] for key in keys])
+
+    def add_prefixes(self, prefixes):
+        """Registra le origini dai prefissi delle chiavi"""
+        with self.lock:
+            for prefix in prefixes:
+                try:
+                    lat, lon = self.decode_origin(prefix)
+                except (ValueError, KeyError):
+                    continue
+                self.cells.setdefault(self._cell(lat, lon), {})[prefix] = (lat, lon)
+
+    def discard_prefixes(self, prefixes, is_live=None):
+        """Toglie le origini indicate; con is_live(prefisso) solo quelle senza più entry in cache.
+
+        is_live viene chiamata con il lock dell'indice: un'origine salvata di nuovo nel frattempo
+        resta (o viene registrata subito dopo da add_keys).
+        """
+        with self.lock:
+            for prefix in prefixes:
+                if is_live is not None and is_live(prefix):
+                    continue
+                try:
+                    cell = self._cell(*self.decode_origin(prefix))
+                except (ValueError, KeyError):
+                    continue
+                origins = self.cells.get(cell)
+                if origins is not None and origins.pop(prefix, None) is not None and not origins:
+                    del self.cells[cell]
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(origins) for origins in self.cells.values())
+
+    def clear(self):
+        with self.lock:
+            self.cells.clear()
+
+    def neighbors(self, lat, lon, distance_fn):
+        """Ritorna le origini entro radius_m come lista di (distanza, prefisso), dalla più vicina"""
+        cell_lat, cell_lon = self._cell(lat, lon)
+        # In longitudine un grado è più corto di cos(lat): servono più celle
+        span_lon = int(ceil(1 / max(cos(radians(lat)), 0.01)))
+        found = []
+        with self.lock:
+            for d_lat in (-1, 0, 1):
+                for d_lon in range(-span_lon, span_lon + 1):
+                    for prefix, (o_lat, o_lon) in self.cells.get((cell_lat + d_lat, cell_lon + d_lon), {}).items():
+                        offset = distance_fn(lat, lon, o_lat, o_lon)
+                        if offset <= self.radius_m:
+                            found.append((offset, prefix))
+        found.sort()
+        return found
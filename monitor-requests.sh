@@ -17,7 +17,7 @@ try:
     print(f'Active IPs: {data[\"active_ips\"]}')
     print(f'Rate limit: {data[\"rate_limit_settings\"][\"max_requests\"]} requests per {data[\"rate_limit_settings\"][\"window_seconds\"]} seconds')
     print('')
-    print('IP Statistics:')
+    print('Rate limited IPs:')
     for ip, stats in data['ip_stats'].items():
         status = '🚨 RATE LIMITED' if stats['is_rate_limited'] else '✅ OK'
         print(f'  {ip}: {stats[\"recent_requests\"]} recent requests {status}')
@@ -61,7 +61,7 @@ except:
 
 echo ""
 echo "💡 Tips:"
-echo "- Rate limiting è attivo a livello Flask (Flask-Limiter)"
-echo "- Rate limiting personalizzato: 10 richieste per minuto per IP"
+echo "- Rate limiting: un solo limiter a finestra scorrevole per IP (regole in rate_limit_settings)"
+echo "- /distance: al massimo 5 richieste al minuto per IP"
 echo "- Attività sospette vengono loggdate nella console"
 echo "- Usa /admin/stats per monitorare in tempo reale"
\ No newline at end of file
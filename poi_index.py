@@ -0,0 +1,156 @@
+# poi_index.py - Indice spaziale dei punti di interesse
+from array import array
+from math import floor, radians, cos, sin, sqrt, atan2
+
+try:
+    import numpy as np
+except ImportError:
+    # Senza NumPy i calcoli vettoriali ricadono su array + ciclo Python
+    np = None
+
+EARTH_RADIUS_M = 6371000
+
+class PointIndex:
+    """Indice a griglia (grid hash) dei punti di interesse.
+
+    Ogni punto viene inserito nella cella (floor(lat / cell), floor(lon / cell)) con cell pari
+    alla tolleranza di confronto: un punto entro la tolleranza da (lat, lon) si trova per forza
+    nella cella di (lat, lon) o in una delle 8 adiacenti, quindi la ricerca è O(1).
+
+    Le coordinate in radianti e il coseno della latitudine sono precalcolati in array
+    (NumPy se disponibile) per calcolare in un solo passaggio le distanze verso tutti i punti.
+    """
+
+    def __init__(self, points, tolerance=0.0001):
+        self.tolerance = tolerance
+        self.points = list(points)
+        self.by_id = {}
+        self.grid = {}
+        for position, point in enumerate(self.points):
+            self.by_id[point['id']] = point
+            self.grid.setdefault(self._cell(point['lat'], point['lon']), []).append((position, point))
+        
+        lat_rad = [radians(point['lat']) for point in self.points]
+        lon_rad = [radians(point['lon']) for point in self.points]
+        if np is not None:
+            self.lat_rad = np.array(lat_rad, dtype=np.float64)
+            self.lon_rad = np.array(lon_rad, dtype=np.float64)
+            self.cos_lat = np.cos(self.lat_rad)
+        else:
+            self.lat_rad = array('d', lat_rad)
+            self.lon_rad = array('d', lon_rad)
+            self.cos_lat = array('d', (cos(value) for value in lat_rad))
+
+    def _cell(self, lat, lon):
+        return floor(lat / self.tolerance), floor(lon / self.tolerance)
+
+    def find(self, lat, lon):
+        """Trova il punto entro la tolleranza da (lat, lon); a parità vince il primo della lista"""
+        cell_lat, cell_lon = self._cell(lat, lon)
+        best = None
+        for d_lat in (-1, 0, 1):
+            for d_lon in (-1, 0, 1):
+                for position, point in self.grid.get((cell_lat + d_lat, cell_lon + d_lon), ()):
+                    if abs(point['lat'] - lat) < self.tolerance and abs(point['lon'] - lon) < self.tolerance:
+                        if best is None or position < best[0]:
+                            best = (position, point)
+        return best[1] if best else None
+
+    def haversine_from(self, lat, lon):
+        """Distanze Haversine in metri (interi) da (lat, lon) verso tutti i punti, nell'ordine dell'indice"""
+        lat1 = radians(lat)
+        lon1 = radians(lon)
+        cos_lat1 = cos(lat1)
+        
+        if np is not None:
+            a = np.sin((self.lat_rad - lat1) / 2) ** 2 + cos_lat1 * self.cos_lat * np.sin((self.lon_rad - lon1) / 2) ** 2
+            c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            return (EARTH_RADIUS_M * c).astype(np.int64)
+        
+        distances = array('q')
+        for lat2, lon2, cos_lat2 in zip(self.lat_rad, self.lon_rad, self.cos_lat):
+            a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * sin((lon2 - lon1) / 2) ** 2
+            distances.append(int(EARTH_RADIUS_M * 2 * atan2(sqrt(a), sqrt(1 - a))))
+        return distances
+
+    def nearest(self, lat, lon, k, max_distance=None):
+        """I k punti più vicini in linea d'aria a (lat, lon) come lista di (distanza, punto), dal
+        più vicino (a parità vince il primo della lista); con max_distance (metri) solo quelli
+        entro quella distanza"""
+        distances = self.haversine_from(lat, lon)
+        if k <= 0:
+            return []
+        if np is not None:
+            positions = np.arange(len(distances))
+            if max_distance is not None:
+                positions = positions[distances <= max_distance]
+            if len(positions) > k:
+                # Selezione parziale O(n) fino alla k-esima distanza (compresi i pari merito, così
+                # l'ordinamento stabile sceglie i primi della lista), poi ordinamento dei soli scelti
+                kth = np.partition(distances[positions], k - 1)[k - 1]
+                positions = positions[distances[positions] <= kth]
+            positions = positions[np.argsort(distances[positions], kind="stable")][:k]
+            return [(int(distances[i]), self.points[i]) for i in positions]
+        
+        found = [(distance, position) for position, distance in enumerate(distances)
+                 if max_distance is None or distance <= max_distance]
+        found.sort()
+        return [(distance, self.points[position]) for distance, position in found[:k]]
+
+    def within(self, lat, lon, radius_m):
+        """Punti entro radius_m metri in linea d'aria da (lat, lon), dal più vicino"""
+        return self.nearest(lat, lon, len(self.points), max_distance=radius_m)
+
+    def get(self, point_id):
+        """Ritorna il punto con l'id indicato oppure None"""
+        return self.by_id.get(point_id)
+
+    def __len__(self):
+        return len(self.points)
+
+def more_than_steps(distances, threshold_km=10):
+    """Per ogni distanza (metri) ritorna lo step "more_than" in km a multipli di threshold_km,
+    oppure 0 se la distanza è entro la soglia. Ritorna una lista di interi.
+    """
+    if np is not None and isinstance(distances, np.ndarray):
+        km = distances / 1000
+        steps = (km // threshold_km * threshold_km).astype(np.int64)
+        steps = np.where(steps < km, steps + threshold_km, steps)
+        return np.where(km > threshold_km, steps, 0).tolist()
+    
+    steps = []
+    for distance in distances:
+        km = distance / 1000
+        if km > threshold_km:
+            step = int((km // threshold_km) * threshold_km)
+            if step < km:
+                step += threshold_km
+            steps.append(step)
+        else:
+            steps.append(0)
+    return steps
+
+def diff_points(old_points, new_points):
+    """Confronta due elenchi di punti per id.
+
+    Ritorna {"added": [nuovi], "removed": [vecchi], "moved": [(vecchio, nuovo)], "updated": [nuovi
+    con le sole altre proprietà cambiate, es. il nome], "unchanged": quanti}.
+    """
+    old_by_id = {point['id']: point for point in old_points}
+    new_ids = set()
+    changes = {"added": [], "removed": [], "moved": [], "updated": [], "unchanged": 0}
+    
+    for point in new_points:
+        new_ids.add(point['id'])
+        old = old_by_id.get(point['id'])
+        if old is None:
+            changes["added"].append(point)
+        elif (old['lat'], old['lon']) != (point['lat'], point['lon']):
+            changes["moved"].append((old, point))
+        elif old != point:
+            changes["updated"].append(point)
+        else:
+            changes["unchanged"] += 1
+    
+    changes["removed"] = [point for point in old_points if point['id'] not in new_ids]
+    return changes
@@ -0,0 +1,179 @@
+# provider_clients.py - Client HTTP condivisi per Google, OpenRouteService e Strapi
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    # Il client asincrono serve solo alla modalità ASGI (app2_asgi.py)
+    httpx = None
+
+# Dimensione dei pool keep-alive e retry (solo su errori di connessione)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+HTTP_CONNECT_RETRIES = int(os.getenv("HTTP_CONNECT_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.2"))
+
+# Client asincrono: connessioni totali verso tutti gli host (le attese non occupano thread)
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))
+
+# Una sessione per host upstream, creata al primo utilizzo
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Client asincrono condiviso, creato al primo utilizzo dentro l'event loop
+_async_client = None
+
+# Contatori di latenza per host
+_host_stats = {}
+_stats_lock = threading.Lock()
+
+def _host_of(url):
+    """Ritorna scheme://host[:port] dell'URL"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def _build_session():
+    """Crea una sessione con pool keep-alive e retry con backoff sui soli errori di connessione.
+
+    Gli errori di lettura e gli status HTTP non vengono ritentati: la richiesta potrebbe essere
+    già arrivata al provider (e conteggiata nella quota).
+    """
+    retry = Retry(
+        total=HTTP_CONNECT_RETRIES,
+        connect=HTTP_CONNECT_RETRIES,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        allowed_methods=None,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session(url):
+    """Ritorna la sessione condivisa per l'host dell'URL"""
+    host = _host_of(url)
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _build_session()
+                _sessions[host] = session
+    return session
+
+def _record(host, elapsed, failed):
+    """Aggiorna i contatori di latenza di un host"""
+    elapsed_ms = elapsed * 1000
+    with _stats_lock:
+        stats = _host_stats.get(host)
+        if stats is None:
+            stats = {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+            _host_stats[host] = stats
+        stats["requests"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["last_ms"] = elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if failed:
+            stats["errors"] += 1
+
+def http_request(method, url, **kwargs):
+    """Esegue una richiesta sulla sessione dell'host registrando la latenza"""
+    host = _host_of(url)
+    start = time.monotonic()
+    failed = True
+    try:
+        response = get_session(url).request(method, url, **kwargs)
+        failed = response.status_code >= 500
+        return response
+    finally:
+        _record(host, time.monotonic() - start, failed)
+
+def http_get(url, **kwargs):
+    """GET tramite il pool condiviso"""
+    return http_request("GET", url, **kwargs)
+
+def http_post(url, **kwargs):
+    """POST tramite il pool condiviso"""
+    return http_request("POST", url, **kwargs)
+
+def get_async_client():
+    """Ritorna il client httpx asincrono condiviso (keep-alive, retry sui soli errori di connessione)"""
+    global _async_client
+    if _async_client is None:
+        limits = httpx.Limits(
+            max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_POOL_MAXSIZE
+        )
+        _async_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_CONNECT_RETRIES, limits=limits)
+        )
+    return _async_client
+
+async def close_async_client():
+    """Chiude il client asincrono (allo shutdown del server ASGI)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def async_http_request(method, url, **kwargs):
+    """Versione asincrona di http_request: stessa interfaccia (raise_for_status, json) e statistiche"""
+    host = _host_of(url)
+    start = time.monotonic()
+    failed = True
+    try:
+        response = await get_async_client().request(method, url, **kwargs)
+        failed = response.status_code >= 500
+        return response
+    finally:
+        _record(host, time.monotonic() - start, failed)
+
+async def async_http_get(url, **kwargs):
+    """GET tramite il client asincrono"""
+    return await async_http_request("GET", url, **kwargs)
+
+async def async_http_post(url, **kwargs):
+    """POST tramite il client asincrono"""
+    return await async_http_request("POST", url, **kwargs)
+
+def get_host_stats():
+    """Ritorna le statistiche di latenza per host"""
+    with _stats_lock:
+        return {
+            host: {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "avg_ms": round(stats["total_ms"] / stats["requests"], 1) if stats["requests"] else 0,
+                "max_ms": round(stats["max_ms"], 1),
+                "last_ms": round(stats["last_ms"], 1)
+            }
+            for host, stats in _host_stats.items()
+        }
+
+def get_pool_settings():
+    """Ritorna la configurazione dei pool HTTP"""
+    return {
+        "pool_connections": HTTP_POOL_CONNECTIONS,
+        "pool_maxsize": HTTP_POOL_MAXSIZE,
+        "connect_retries": HTTP_CONNECT_RETRIES,
+        "retry_backoff": HTTP_RETRY_BACKOFF,
+        "hosts": sorted(_sessions.keys()),
+        "async_max_connections": ASYNC_HTTP_MAX_CONNECTIONS,
+        "async_client": _async_client is not None
+    }
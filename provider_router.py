@@ -0,0 +1,371 @@
+# provider_router.py - Scelta del provider di routing (Google, OpenRouteService) in base allo stato
+#
+# Per ogni provider vengono tenute le ultime chiamate (latenza ed esito) in una finestra mobile:
+# da queste si calcolano percentili di latenza e tasso di errore. Una chiamata fallisce solo se
+# solleva un'eccezione (rete, HTTP, stato di errore dell'API): una risposta valida senza percorso
+# (ZERO_RESULTS, NOT_FOUND) è un successo per il breaker, anche se il router prova comunque il
+# provider successivo. La latenza viene misurata dopo aver ottenuto il posto nel limite di
+# concorrenza del provider, così l'attesa in coda non conta come lentezza del provider. Il circuit breaker si apre dopo
+# failure_threshold errori consecutivi, oppure con un tasso di errore oltre error_rate_threshold.
+# Mentre è aperto il provider viene saltato; dopo open_seconds una sola chiamata di prova
+# (half-open) decide se richiuderlo. I provider disponibili vengono provati dal punteggio
+# migliore (p95 pesato con il tasso di errore e con l'ordine configurato): un provider degradato
+# perde il primo posto senza aspettare i suoi timeout.
+#
+# Con l'hedging, se il primo provider non risponde entro il suo p95 (limitato tra
+# hedge_min_delay e hedge_max_delay) parte una seconda richiesta al successivo e vince il primo
+# risultato valido.
+import time
+import math
+import asyncio
+import threading
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+def percentile(values, pct):
+    """Percentile (nearest rank) di una lista già ordinata"""
+    if not values:
+        return None
+    rank = min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+class ProviderHealth:
+    """Finestra mobile delle chiamate e circuit breaker di un provider"""
+
+    def __init__(self, name, priority, window, window_seconds):
+        self.name = name
+        self.priority = priority
+        self.window_seconds = window_seconds
+        # (istante, latenza in secondi, esito)
+        self.samples = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.consecutive_failures = 0
+        self.counters = {"calls": 0, "failures": 0, "skipped": 0, "opened": 0, "hedged": 0, "hedge_wins": 0}
+
+    def prune(self, now):
+        while self.samples and now - self.samples[0][0] > self.window_seconds:
+            self.samples.popleft()
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, _, ok in self.samples if not ok) / len(self.samples)
+
+    def latencies(self):
+        return sorted(latency for _, latency, _ in self.samples)
+
+class ProviderRouter:
+    """Ordine dei provider, circuit breaker e hedging delle chiamate upstream"""
+
+    def __init__(self, providers, window=100, window_seconds=300, min_samples=10, failure_threshold=5,
+                 error_rate_threshold=0.5, open_seconds=30, default_latency=1.0, error_penalty=4,
+                 priority_penalty=0.5, hedge=False, hedge_percentile=95, hedge_min_delay=0.2,
+                 hedge_max_delay=5.0, max_workers=8, max_concurrency=None):
+        self.providers = {
+            name: ProviderHealth(name, priority, window, window_seconds)
+            for priority, name in enumerate(providers)
+        }
+        # Chiamate contemporanee massime per provider (thread e coroutine hanno limiti separati)
+        max_concurrency = max_concurrency or {}
+        self.semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in max_concurrency.items()}
+        self.async_semaphores = {name: asyncio.Semaphore(limit) for name, limit in max_concurrency.items()}
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.open_seconds = open_seconds
+        self.default_latency = default_latency
+        self.error_penalty = error_penalty
+        self.priority_penalty = priority_penalty
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.lock = threading.Lock()
+        # Pool separato dal pool upstream: le chiamate vi arrivano già da un suo worker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider-hedge") if hedge else None
+
+    def _scores(self, names):
+        """Punteggi (più basso è meglio): p95 pesato con tasso di errore e priorità.
+
+        Un provider con meno di min_samples chiamate nella finestra vale come il miglior p95
+        misurato, senza penalità di errore: un errore isolato non sposta il traffico (gli errori
+        consecutivi aprono il circuito) e un provider retrocesso torna a essere scelto per
+        priorità quando i suoi campioni escono dalla finestra.
+        """
+        measured = {}
+        for name in names:
+            latencies = self.providers[name].latencies()
+            if len(latencies) >= self.min_samples:
+                measured[name] = percentile(latencies, 95)
+        baseline = min(measured.values(), default=self.default_latency)
+        scores = {}
+        for name in names:
+            health = self.providers[name]
+            if name in measured:
+                score = measured[name] * (1 + self.error_penalty * health.error_rate())
+            else:
+                score = baseline
+            scores[name] = score * (1 + self.priority_penalty * health.priority)
+        return scores
+
+    def _available(self, health, now):
+        """True se il circuit breaker lascia passare una chiamata (in half-open una sola di prova)"""
+        if health.state == OPEN and now - health.opened_at >= self.open_seconds:
+            health.state = HALF_OPEN
+            health.trial_in_flight = False
+        if health.state == HALF_OPEN:
+            return not health.trial_in_flight
+        return health.state == CLOSED
+
+    def order(self, names=None, count_skipped=True):
+        """Provider da provare, dal migliore; quelli con il circuito aperto vengono esclusi"""
+        now = time.monotonic()
+        with self.lock:
+            # I provider non configurati (PROVIDER_ORDER) non vengono usati
+            names = [name for name in names or self.providers if name in self.providers]
+            for name in names:
+                self.providers[name].prune(now)
+            scores = self._scores(names)
+            candidates = []
+            for name in names:
+                health = self.providers[name]
+                if self._available(health, now):
+                    candidates.append((scores[name], health.priority, name))
+                elif count_skipped:
+                    health.counters["skipped"] += 1
+        return [name for _, _, name in sorted(candidates)]
+
+    def _begin(self, name):
+        """Registra l'inizio di una chiamata; False se nel frattempo il circuito non la permette"""
+        with self.lock:
+            health = self.providers[name]
+            if not self._available(health, time.monotonic()):
+                return False
+            if health.state == HALF_OPEN:
+                health.trial_in_flight = True
+            health.counters["calls"] += 1
+            return True
+
+    def record(self, name, latency, ok):
+        """Registra l'esito di una chiamata e aggiorna il circuit breaker"""
+        now = time.monotonic()
+        with self.lock:
+            health = self.providers[name]
+            health.samples.append((now, latency, ok))
+            health.prune(now)
+            if ok:
+                health.consecutive_failures = 0
+                if health.state != CLOSED:
+                    print(f"✅ Provider {name} recovered, circuit closed")
+                health.state = CLOSED
+                health.trial_in_flight = False
+                return
+
+            health.counters["failures"] += 1
+            health.consecutive_failures += 1
+            too_many = (
+                health.consecutive_failures >= self.failure_threshold
+                or (len(health.samples) >= self.min_samples and health.error_rate() >= self.error_rate_threshold)
+            )
+            if health.state == HALF_OPEN or (health.state == CLOSED and too_many):
+                health.state = OPEN
+                health.opened_at = now
+                health.trial_in_flight = False
+                health.counters["opened"] += 1
+                print(f"⚠️  Provider {name} circuit open for {self.open_seconds}s "
+                      f"({health.consecutive_failures} consecutive failures, error rate {health.error_rate():.0%})")
+
+    def hedge_delay(self, name):
+        """Attesa prima della richiesta di riserva: percentile della latenza del provider"""
+        with self.lock:
+            latencies = self.providers[name].latencies()
+        if len(latencies) < self.min_samples:
+            delay = self.hedge_max_delay
+        else:
+            delay = percentile(latencies, self.hedge_percentile)
+        return min(max(delay, self.hedge_min_delay), self.hedge_max_delay)
+
+    def _call(self, name, func, succeeded):
+        """Esegue una chiamata; ritorna (risultato, True se è quello da usare)"""
+        with self.semaphores.get(name) or nullcontext():
+            started = time.monotonic()
+            try:
+                result = func()
+                answered = True
+            except Exception as e:
+                print(f"❌ Provider {name} error: {e}")
+                result, answered = None, False
+            latency = time.monotonic() - started
+        self.record(name, latency, answered)
+        return result, answered and succeeded(result)
+
+    def run(self, calls, succeeded, default=None):
+        """Esegue calls (nome -> funzione senza argomenti) nell'ordine del router.
+
+        Ritorna (nome, risultato) del primo risultato per cui succeeded è vero; se nessun
+        provider lo fornisce (o tutti hanno il circuito aperto) ritorna (None, default).
+        Solo le eccezioni contano come errori del provider.
+        """
+        names = self.order(list(calls))
+        if self.hedge and len(names) > 1:
+            return self._run_hedged(names, calls, succeeded, default)
+
+        for name in names:
+            if not self._begin(name):
+                continue
+            result, ok = self._call(name, calls[name], succeeded)
+            if ok:
+                return name, result
+        return None, default
+
+    def _run_hedged(self, names, calls, succeeded, default):
+        pending = {}
+        queue = list(names)
+
+        def start_next():
+            while queue:
+                name = queue.pop(0)
+                if self._begin(name):
+                    pending[self.executor.submit(self._call, name, calls[name], succeeded)] = name
+                    return name
+            return None
+
+        current = start_next()
+        while pending:
+            # Finché c'è un solo provider in corso, dopo il suo p95 parte la richiesta di riserva
+            timeout = self.hedge_delay(current) if queue and len(pending) == 1 else None
+            done, _ = wait_futures(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = start_next()
+                if hedged is not None:
+                    with self.lock:
+                        self.providers[hedged].counters["hedged"] += 1
+                    current = hedged
+                continue
+            for future in done:
+                name = pending.pop(future)
+                result, ok = future.result()
+                if ok:
+                    self._hedge_won(name, names[0])
+                    return name, result
+            if not pending:
+                # Errore prima del p95: il successivo parte subito, come senza hedging
+                current = start_next()
+        return None, default
+
+    def _hedge_won(self, name, first):
+        if name != first:
+            with self.lock:
+                self.providers[name].counters["hedge_wins"] += 1
+
+    async def run_async(self, calls, succeeded, default=None):
+        """Come run per coroutine: calls mappa nome -> funzione che ritorna una coroutine"""
+        names = self.order(list(calls))
+
+        async def call(name):
+            async with self.async_semaphores.get(name) or nullcontext():
+                started = time.monotonic()
+                try:
+                    result = await calls[name]()
+                    answered = True
+                except Exception as e:
+                    print(f"❌ Provider {name} error: {e}")
+                    result, answered = None, False
+                latency = time.monotonic() - started
+            self.record(name, latency, answered)
+            return name, result, answered and succeeded(result)
+
+        if not (self.hedge and len(names) > 1):
+            for name in names:
+                if not self._begin(name):
+                    continue
+                _, result, ok = await call(name)
+                if ok:
+                    return name, result
+            return None, default
+
+        pending = set()
+        queue = list(names)
+
+        def start_next():
+            while queue:
+                name = queue.pop(0)
+                if self._begin(name):
+                    pending.add(asyncio.ensure_future(call(name)))
+                    return name
+            return None
+
+        current = start_next()
+        try:
+            while pending:
+                timeout = self.hedge_delay(current) if queue and len(pending) == 1 else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = start_next()
+                    if hedged is not None:
+                        with self.lock:
+                            self.providers[hedged].counters["hedged"] += 1
+                        current = hedged
+                    continue
+                for task in done:
+                    pending.discard(task)
+                    name, result, ok = task.result()
+                    if ok:
+                        self._hedge_won(name, names[0])
+                        return name, result
+                if not pending:
+                    current = start_next()
+        finally:
+            # La richiesta perdente continua: il suo esito aggiorna comunque le statistiche
+            for task in pending:
+                task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return None, default
+
+    def get_stats(self):
+        """Stato per /admin/stats: circuito, percentili, tasso di errore e contatori per provider"""
+        now = time.monotonic()
+        with self.lock:
+            for health in self.providers.values():
+                health.prune(now)
+            scores = self._scores(list(self.providers))
+            providers = {}
+            for name, health in self.providers.items():
+                latencies = health.latencies()
+                providers[name] = dict(
+                    health.counters,
+                    state=health.state,
+                    samples=len(latencies),
+                    p50_ms=round(percentile(latencies, 50) * 1000) if latencies else None,
+                    p95_ms=round(percentile(latencies, 95) * 1000) if latencies else None,
+                    p99_ms=round(percentile(latencies, 99) * 1000) if latencies else None,
+                    error_rate=round(health.error_rate(), 3),
+                    consecutive_failures=health.consecutive_failures,
+                    reopens_in_seconds=(
+                        round(max(0, self.open_seconds - (now - health.opened_at)), 1)
+                        if health.state == OPEN else None
+                    ),
+                    score=round(scores[name], 3)
+                )
+        return {
+            "order": self.order(count_skipped=False),
+            "hedging": {
+                "enabled": self.hedge,
+                "percentile": self.hedge_percentile,
+                "min_delay_seconds": self.hedge_min_delay,
+                "max_delay_seconds": self.hedge_max_delay
+            },
+            "breaker": {
+                "failure_threshold": self.failure_threshold,
+                "error_rate_threshold": self.error_rate_threshold,
+                "min_samples": self.min_samples,
+                "open_seconds": self.open_seconds
+            },
+            "providers": providers
+        }
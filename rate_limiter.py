@@ -0,0 +1,297 @@
+# rate_limiter.py - Rate limiting per IP con contatori a finestra scorrevole a memoria fissa
+#
+# Storage dei contatori (RATE_LIMIT_STORAGE_URI):
+#   memory://              - solo nel processo (default)
+#   sqlite:///percorso.db  - file SQLite (WAL) sul volume condiviso, per più worker o container
+#   redis://host:6379/0    - server Redis o compatibile (richiede il pacchetto redis)
+# Con uno store condiviso le richieste vengono decise sui contatori locali; un thread in
+# background invia allo store gli incrementi accumulati e riceve i totali di tutte le repliche.
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    # Necessario solo con RATE_LIMIT_STORAGE_URI=redis://...
+    redis = None
+
+class SlidingWindowRateLimiter:
+    """Limiti per chiave (IP) con l'algoritmo sliding window counter.
+
+    Ogni regola è nome -> (max_richieste, finestra_secondi). Per ogni coppia (regola, chiave)
+    vengono tenuti solo due contatori, finestra fissa corrente e precedente: le richieste
+    nell'ultima finestra sono stimate come precedente * (frazione residua) + corrente, quindi
+    memoria e costo per richiesta sono O(1). Le chiavi inattive da due finestre (i cui contatori
+    sono ormai a zero) vengono eliminate, e per regola non si tengono più di max_keys chiavi
+    (oltre si elimina la meno recente). Il riepilogo per /admin/stats è mantenuto ad ogni
+    richiesta, senza scorrere tutte le chiavi.
+
+    Con uno store condiviso gli incrementi locali si accumulano in pending e vengono inviati
+    a blocchi da sync(): i contatori locali diventano il totale globale più le richieste locali
+    non ancora inviate. Tra una sincronizzazione e l'altra ogni replica può superare il limite
+    al massimo delle richieste ricevute in quell'intervallo.
+    """
+
+    def __init__(self, rules, max_keys=100000, store=None):
+        self.rules = dict(rules)
+        self.max_keys = max_keys
+        self.store = store
+        # regola -> OrderedDict chiave -> [inizio finestra, corrente, precedente, ultimo accesso,
+        # richieste totali da quando la chiave è tracciata]
+        self.counters = {name: OrderedDict() for name in self.rules}
+        # chiave -> regola che la sta limitando (solo le chiavi attualmente limitate)
+        self.limited = {}
+        # (regola, chiave, inizio finestra) -> incrementi non ancora inviati allo store
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.sync_event = threading.Event()
+        self.sync_max_pending = 0
+        self.stats = {"requests": 0, "limited_requests": 0, "evicted_keys": 0, "syncs": 0, "sync_errors": 0}
+        self.last_sync_at = None
+
+    def _estimate(self, name, state, now):
+        """Aggiorna le finestre di state a now e ritorna le richieste stimate nell'ultima finestra"""
+        window = self.rules[name][1]
+        window_start = int(now // window) * window
+        if window_start != state[0]:
+            state[2] = state[1] if window_start - state[0] == window else 0
+            state[1] = 0
+            state[0] = window_start
+        return state[2] * (1 - (now - window_start) / window) + state[1]
+
+    def _evict(self, name, now):
+        counters = self.counters[name]
+        idle_after = 2 * self.rules[name][1]
+        evicted = 0
+        while counters:
+            key, state = next(iter(counters.items()))
+            if len(counters) <= self.max_keys and now - state[3] < idle_after:
+                break
+            counters.popitem(last=False)
+            if self.limited.get(key) == name:
+                del self.limited[key]
+            evicted += 1
+        self.stats["evicted_keys"] += evicted
+
+    def hit(self, key, rule_names, now=None):
+        """Registra una richiesta di key sulle regole indicate.
+
+        Ritorna (regola che limita oppure None, richieste stimate). Come nel limiter storico una
+        richiesta limitata non viene conteggiata.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.stats["requests"] += 1
+            states = []
+            for name in rule_names:
+                counters = self.counters[name]
+                state = counters.get(key)
+                if state is None:
+                    state = counters[key] = [int(now // self.rules[name][1]) * self.rules[name][1], 0, 0, now, 0]
+                else:
+                    counters.move_to_end(key)
+                state[3] = now
+                state[4] += 1
+                count = self._estimate(name, state, now)
+                if count >= self.rules[name][0]:
+                    self.stats["limited_requests"] += 1
+                    self.limited[key] = name
+                    return name, int(count)
+                states.append((state, count))
+
+            for name, (state, _) in zip(rule_names, states):
+                state[1] += 1
+                if self.store is not None:
+                    pending_key = (name, key, state[0])
+                    self.pending[pending_key] = self.pending.get(pending_key, 0) + 1
+            if self.sync_max_pending and len(self.pending) >= self.sync_max_pending:
+                self.sync_event.set()
+            self.limited.pop(key, None)
+            for name in rule_names:
+                self._evict(name, now)
+            return None, int(states[0][1]) + 1 if states else 0
+
+    def count(self, key, rule_name, now=None):
+        """Richieste stimate di key nell'ultima finestra della regola"""
+        now = time.time() if now is None else now
+        with self.lock:
+            state = self.counters[rule_name].get(key)
+            if state is None:
+                return 0
+            return int(self._estimate(rule_name, list(state), now))
+
+    def total(self, key, rule_name):
+        """Richieste di key (anche quelle limitate) da quando è tracciata nella regola; una chiave
+        inattiva da due finestre viene eliminata e riparte da zero"""
+        with self.lock:
+            state = self.counters[rule_name].get(key)
+            return state[4] if state is not None else 0
+
+    def limited_keys(self, now=None):
+        """Ritorna {chiave: (regola, richieste stimate)} per le sole chiavi attualmente limitate"""
+        now = time.time() if now is None else now
+        found = {}
+        with self.lock:
+            for key, name in list(self.limited.items()):
+                count = self._estimate(name, list(self.counters[name][key]), now)
+                if count >= self.rules[name][0]:
+                    found[key] = (name, int(count))
+                else:
+                    # Finestra ormai scorsa: la chiave non è più limitata
+                    del self.limited[key]
+        return found
+
+    def sync(self, now=None):
+        """Invia allo store gli incrementi accumulati e aggiorna i contatori locali con i totali"""
+        if self.store is None:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+
+        try:
+            totals = self.store.add_counts(
+                {(name, key, window_start): (count, window_start + 2 * self.rules[name][1])
+                 for (name, key, window_start), count in batch.items()},
+                now
+            )
+        except Exception as e:
+            print(f"❌ Error syncing rate limit counters: {e}")
+            with self.lock:
+                # Gli incrementi verranno reinviati alla prossima sincronizzazione
+                for pending_key, count in batch.items():
+                    self.pending[pending_key] = self.pending.get(pending_key, 0) + count
+                self.stats["sync_errors"] += 1
+            return
+
+        with self.lock:
+            for (name, key, window_start), total in totals.items():
+                state = self.counters[name].get(key)
+                if state is None:
+                    continue
+                # Totale globale più le richieste locali arrivate durante la sincronizzazione
+                local = self.pending.get((name, key, window_start), 0)
+                if state[0] == window_start:
+                    state[1] = max(state[1], total + local)
+                elif state[0] == window_start + self.rules[name][1]:
+                    state[2] = max(state[2], total)
+            self.stats["syncs"] += 1
+            self.last_sync_at = now
+
+    def start_sync(self, interval_seconds, max_pending):
+        """Avvia il thread che sincronizza i contatori con lo store ogni interval_seconds
+        (o prima, appena le chiavi in attesa sono max_pending)"""
+        if self.store is None:
+            return
+        self.sync_max_pending = max_pending
+
+        def sync_loop():
+            while True:
+                self.sync_event.wait(interval_seconds)
+                self.sync_event.clear()
+                self.sync()
+
+        threading.Thread(target=sync_loop, name="rate-limit-sync", daemon=True).start()
+
+    def get_stats(self):
+        """Ritorna il riepilogo mantenuto incrementalmente"""
+        with self.lock:
+            return dict(
+                self.stats,
+                tracked_keys={name: len(counters) for name, counters in self.counters.items()},
+                limited_keys=len(self.limited),
+                max_keys=self.max_keys,
+                storage=self.store.name if self.store is not None else "memory",
+                pending_updates=len(self.pending),
+                seconds_since_last_sync=round(time.time() - self.last_sync_at, 3) if self.last_sync_at else None
+            )
+
+class SqliteLimiterStore:
+    """Contatori condivisi su un file SQLite in modalità WAL (es. sul volume condiviso)"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pruned_at = 0
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_counters ("
+                "rule TEXT NOT NULL, key TEXT NOT NULL, window_start INTEGER NOT NULL, "
+                "count INTEGER NOT NULL, expires_at INTEGER NOT NULL, "
+                "PRIMARY KEY (rule, key, window_start))"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def add_counts(self, updates, now):
+        """Somma gli incrementi {(regola, chiave, inizio finestra): (incremento, scadenza)} in una
+        sola transazione e ritorna i totali aggiornati per le stesse chiavi"""
+        totals = {}
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                for (name, key, window_start), (count, expires_at) in updates.items():
+                    conn.execute(
+                        "INSERT INTO rate_limit_counters (rule, key, window_start, count, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (rule, key, window_start) DO UPDATE SET count = count + excluded.count",
+                        (name, key, window_start, count, expires_at)
+                    )
+                    totals[(name, key, window_start)] = conn.execute(
+                        "SELECT count FROM rate_limit_counters WHERE rule = ? AND key = ? AND window_start = ?",
+                        (name, key, window_start)
+                    ).fetchone()[0]
+                # Pulizia dei contatori scaduti al massimo una volta al minuto
+                if now - self.pruned_at >= 60:
+                    self.pruned_at = now
+                    conn.execute("DELETE FROM rate_limit_counters WHERE expires_at < ?", (int(now),))
+        return totals
+
+class RedisLimiterStore:
+    """Contatori condivisi su Redis (o server compatibile): una pipeline INCRBY per sincronizzazione"""
+
+    name = "redis"
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("redis package not installed (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def add_counts(self, updates, now):
+        keys = list(updates)
+        pipeline = self.client.pipeline(transaction=False)
+        for name, key, window_start in keys:
+            count, expires_at = updates[(name, key, window_start)]
+            redis_key = f"rate_limit:{name}:{key}:{window_start}"
+            pipeline.incrby(redis_key, count)
+            pipeline.expireat(redis_key, expires_at)
+        results = pipeline.execute()
+        return {pending_key: int(results[2 * i]) for i, pending_key in enumerate(keys)}
+
+def create_limiter_store(uri):
+    """Crea lo store dei contatori indicato da RATE_LIMIT_STORAGE_URI (None = solo memoria)"""
+    if not uri or uri.startswith("memory://"):
+        return None
+    if uri.startswith("sqlite://"):
+        path = uri[len("sqlite://"):]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SqliteLimiterStore(path)
+    if uri.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLimiterStore(uri)
+    print(f"⚠️  Unknown RATE_LIMIT_STORAGE_URI '{uri}', using memory")
+    return None
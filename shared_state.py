@@ -0,0 +1,39 @@
+# shared_state.py - Stato condiviso tra worker (e container) tramite SQLite sul volume condiviso
+#
+# Usato quando SHARED_STATE è attivo: la generazione della cache vive in un database SQLite
+# in modalità WAL che tutti i processi vedono (i contatori di rate limiting sono in rate_limiter.py).
+import sqlite3
+import threading
+
+class SharedState:
+    """Metadati condivisi su SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        return self.conn
+
+    def get_value(self, name):
+        """Legge un metadato intero (0 se assente)"""
+        with self.lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def increment_value(self, name):
+        """Incrementa un metadato intero e ritorna il nuovo valore"""
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO meta (name, value) VALUES (?, 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1",
+                (name,)
+            )
+            return conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
@@ -0,0 +1,140 @@
+# strapi_client.py - Lettura paginata e condizionale dei punti di interesse da Strapi
+#
+# Ogni reload parte da una richiesta di controllo piccola (un solo record, ordinato per
+# updatedAt decrescente, con If-None-Match/If-Modified-Since): se Strapi risponde 304, oppure
+# numero totale di record e updatedAt più recente sono quelli dell'ultimo reload, i punti non
+# sono cambiati e il reload costa quella sola richiesta. Altrimenti vengono letti solo i record
+# modificati dopo l'ultimo reload (filtro updatedAt) e uniti a quelli già noti; se il totale non
+# torna (record eliminati) si rilegge tutto. Le pagine successive alla prima vengono richieste
+# in parallelo e si chiedono solo i campi usati (Latitude, Longitude, Name).
+#
+# Lo stato (ETag, Last-Modified, totale, updatedAt e record letti) è salvato in un file sul
+# volume condiviso, così anche gli altri worker partono dall'ultimo reload.
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from provider_clients import http_get
+
+POINT_FIELDS = ("Latitude", "Longitude", "Name", "updatedAt")
+
+class StrapiPointsFetcher:
+    """Lettura dei record di /api/points con paginazione e controllo delle modifiche"""
+
+    def __init__(self, url, token, state_path, page_size=100, concurrency=4, timeout=10):
+        self.url = url
+        self.token = token
+        self.state_path = state_path
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Lo stato vale solo per lo stesso endpoint
+        return state if state.get("url") == self.url else {}
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _params(self, page, page_size, updated_after=None):
+        params = {
+            "pagination[page]": page,
+            "pagination[pageSize]": page_size,
+            "sort": "id:asc"
+        }
+        for i, field in enumerate(POINT_FIELDS):
+            params[f"fields[{i}]"] = field
+        if updated_after:
+            params["filters[updatedAt][$gt]"] = updated_after
+        return params
+
+    def _get(self, params, headers=None):
+        request_headers = {"Authorization": f"Bearer {self.token}"}
+        request_headers.update(headers or {})
+        return http_get(self.url, params=params, headers=request_headers, timeout=self.timeout)
+
+    def _fetch_pages(self, updated_after=None):
+        """Legge tutte le pagine (la prima per sapere quante sono, le altre in parallelo).
+
+        Ritorna (record, richieste eseguite).
+        """
+        def fetch_page(page):
+            response = self._get(self._params(page, self.page_size, updated_after))
+            response.raise_for_status()
+            return response.json()
+
+        first = fetch_page(1)
+        items = list(first.get('data', []))
+        page_count = first.get('meta', {}).get('pagination', {}).get('pageCount', 1)
+        if page_count > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="strapi-page") as executor:
+                for data in executor.map(fetch_page, range(2, page_count + 1)):
+                    items.extend(data.get('data', []))
+        return items, page_count
+
+    def fetch(self, full=False):
+        """Ritorna (record oppure None se nulla è cambiato dall'ultimo reload, riepilogo).
+
+        Con full i record vengono riletti tutti senza controlli.
+        """
+        state = {} if full else self._load_state()
+        info = {"mode": "full", "requests": 0}
+
+        # Controllo: un solo record, il più recente, e il totale nei metadati di paginazione
+        conditional = {}
+        if state.get("etag"):
+            conditional["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            conditional["If-Modified-Since"] = state["last_modified"]
+        params = self._params(1, 1)
+        params["sort"] = "updatedAt:desc"
+        response = self._get(params, conditional)
+        info["requests"] += 1
+        if response.status_code == 304 and state.get("items") is not None:
+            info["mode"] = "unchanged"
+            return None, info
+        response.raise_for_status()
+
+        probe = response.json()
+        total = probe.get('meta', {}).get('pagination', {}).get('total', len(probe.get('data', [])))
+        latest = probe['data'][0].get('updatedAt') if probe.get('data') else None
+        known = state.get("items")
+        if known is not None and state.get("total") == total and state.get("updated_at") == latest:
+            info["mode"] = "unchanged"
+            return None, info
+
+        items = None
+        if known is not None and state.get("updated_at") and latest:
+            # Solo i record modificati dopo l'ultimo reload, uniti per id a quelli già noti
+            changed, pages = self._fetch_pages(updated_after=state["updated_at"])
+            info["requests"] += pages
+            merged = {item['id']: item for item in known}
+            merged.update((item['id'], item) for item in changed)
+            if len(merged) == total:
+                items = sorted(merged.values(), key=lambda item: item['id'])
+                info["mode"] = "incremental"
+                info["changed"] = len(changed)
+
+        if items is None:
+            # Primo reload, record eliminati o updatedAt non disponibile: si rilegge tutto
+            items, pages = self._fetch_pages()
+            info["requests"] += pages
+
+        self._save_state({
+            "url": self.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "total": total,
+            "updated_at": latest,
+            "items": items
+        })
+        info["total"] = len(items)
+        return items, info
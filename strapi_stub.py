@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# strapi_stub.py - Server Strapi minimo per provare in locale il reload dei punti
+#
+# Serve GET /api/points dai record di un file JSON (riletto ad ogni richiesta, quindi
+# modificandolo si simulano aggiunte, spostamenti ed eliminazioni) con i parametri usati da
+# strapi_client: pagination[page], pagination[pageSize], fields[n], sort (id:asc o
+# updatedAt:desc) e filters[updatedAt][$gt]. Risponde con ETag e 304 su If-None-Match.
+#
+# Uso: python strapi_stub.py shared/points_stub.json --port 1337
+#      STRAPI_POINTS_URL=http://localhost:1337/api/points python app2.py
+# Il file contiene una lista di {"id", "Name", "Latitude", "Longitude", "updatedAt"}.
+import json
+import hashlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+class StrapiStubHandler(BaseHTTPRequestHandler):
+    points_file = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != "/api/points":
+            self.send_error(404)
+            return
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        with open(self.points_file, 'r') as f:
+            items = json.load(f)
+
+        updated_after = params.get("filters[updatedAt][$gt]")
+        if updated_after:
+            items = [item for item in items if item.get("updatedAt", "") > updated_after]
+        if params.get("sort") == "updatedAt:desc":
+            items.sort(key=lambda item: item.get("updatedAt", ""), reverse=True)
+        else:
+            items.sort(key=lambda item: item["id"])
+
+        fields = [value for key, value in params.items() if key.startswith("fields[")]
+        if fields:
+            items = [{"id": item["id"], **{field: item.get(field) for field in fields}} for item in items]
+
+        page = int(params.get("pagination[page]", 1))
+        page_size = int(params.get("pagination[pageSize]", 25))
+        total = len(items)
+        body = json.dumps({
+            "data": items[(page - 1) * page_size:page * page_size],
+            "meta": {"pagination": {
+                "page": page,
+                "pageSize": page_size,
+                "pageCount": max((total + page_size - 1) // page_size, 1),
+                "total": total
+            }}
+        }).encode()
+
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local Strapi stub serving /api/points")
+    parser.add_argument("points_file", help="JSON list of points (id, Name, Latitude, Longitude, updatedAt)")
+    parser.add_argument("--port", type=int, default=1337)
+    args = parser.parse_args()
+
+    StrapiStubHandler.points_file = args.points_file
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StrapiStubHandler)
+    print(f"🚀 Strapi stub on http://127.0.0.1:{args.port}/api/points ({args.points_file})")
+    server.serve_forever()
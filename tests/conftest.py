@@ -0,0 +1,107 @@
+# I moduli del servizio sono nella radice del repository
+import atexit
+import json
+import os
+import sys
+import urllib.parse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Punti di interesse di prova (Ferrara), entro 10 km dalle origini dei test
+POINTS = [
+    {"id": 1, "lat": 44.8381, "lon": 11.6198, "name": "Castello"},
+    {"id": 2, "lat": 44.8352, "lon": 11.6202, "name": "Duomo"},
+    {"id": 3, "lat": 44.8429, "lon": 11.6166, "name": "Palazzo dei Diamanti"},
+    {"id": 4, "lat": 44.8301, "lon": 11.6250, "name": "Casa Romei"},
+]
+
+@pytest.fixture(scope="session")
+def app2(tmp_path_factory):
+    """Modulo app2 importato in una directory temporanea (legge e scrive ./shared)"""
+    directory = tmp_path_factory.mktemp("service")
+    os.makedirs(directory / "shared")
+    with open(directory / "shared" / "points_of_interest.json", 'w') as f:
+        json.dump(POINTS, f)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import app2
+        yield app2
+        # I salvataggi allo shutdown userebbero ./shared della directory di lavoro originale
+        atexit.unregister(app2.save_cache_to_file)
+        atexit.unregister(app2.compact_cache_snapshot)
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture
+def service(app2, monkeypatch):
+    """app2 con i punti di prova, cache vuote e senza rate limiting"""
+    monkeypatch.setattr(app2, "check_rate_limit", lambda *args, **kwargs: None)
+    monkeypatch.setattr(app2, "points_of_interest", [dict(point) for point in POINTS])
+    app2.rebuild_point_index()
+    app2.distance_cache.clear()
+    app2.origin_index.clear()
+    app2.response_cache.clear()
+    return app2
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.data
+
+class FakeProviders:
+    """Google Distance Matrix e ORS finti: distanza = 1000 * riga + 10 * colonna + 100, durata
+    = distanza / 2. Registra le chiamate come (provider, origini, destinazioni)"""
+
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def coords(text):
+        return [tuple(map(float, item.split(','))) for item in text.split('|')]
+
+    def get(self, url, **kwargs):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        origins = self.coords(query['origins'][0])
+        dests = self.coords(query['destinations'][0])
+        self.calls.append(("google", origins, dests))
+        return FakeResponse({"status": "OK", "rows": [
+            {"elements": [
+                {"status": "OK", "distance": {"value": 1000 * row + 10 * column + 100},
+                 "duration": {"value": (1000 * row + 10 * column + 100) // 2}}
+                for column in range(len(dests))
+            ]}
+            for row in range(len(origins))
+        ]})
+
+    def post(self, url, json=None, **kwargs):
+        if 'coordinates' in json:
+            # Directions: una sola coppia
+            (origin_lon, origin_lat), (dest_lon, dest_lat) = json['coordinates']
+            self.calls.append(("openroute", [(origin_lat, origin_lon)], [(dest_lat, dest_lon)]))
+            return FakeResponse({"routes": [{"summary": {"distance": 100, "duration": 50}}]})
+        locations = [(lat, lon) for lon, lat in json['locations']]
+        sources = json['sources']
+        dests = json['destinations']
+        self.calls.append(("openroute", [locations[i] for i in sources], [locations[i] for i in dests]))
+        return FakeResponse({
+            "distances": [[1000 * row + 10 * column + 100 for column in range(len(dests))] for row in range(len(sources))],
+            "durations": [[(1000 * row + 10 * column + 100) // 2 for column in range(len(dests))] for row in range(len(sources))]
+        })
+
+@pytest.fixture
+def providers(service, monkeypatch):
+    """Provider finti al posto delle chiamate HTTP di app2"""
+    fake = FakeProviders()
+    monkeypatch.setattr(service, "http_get", fake.get)
+    monkeypatch.setattr(service, "http_post", fake.post)
+    return fake
@@ -0,0 +1,55 @@
+from conftest import POINTS, FakeResponse
+
+ORIGIN = "44.8301,11.6201"
+
+def coords(point):
+    return point['lat'], point['lon']
+
+def distances(response):
+    return {entry["id"]: entry.get("distance") for entry in response.get_json()}
+
+def test_destinations_split_in_chunks(service, providers, monkeypatch):
+    monkeypatch.setattr(service, "GOOGLE_MATRIX_MAX_DESTINATIONS", 3)
+    response = service.app.test_client().get(f"/all_distances?origin={ORIGIN}")
+    assert response.status_code == 200
+    # Un blocco di 3 destinazioni e uno di 1, ognuno con una sola chiamata matrix
+    calls = sorted(providers.calls, key=lambda call: -len(call[2]))
+    assert [(provider, len(dests)) for provider, _, dests in calls] == [("google", 3), ("google", 1)]
+    assert [coords(point) for point in POINTS] == calls[0][2] + calls[1][2]
+    assert distances(response) == {1: 100, 2: 110, 3: 120, 4: 100}
+
+    # Tutto in cache: nessuna nuova chiamata
+    providers.calls.clear()
+    assert distances(service.app.test_client().get(f"/all_distances?origin={ORIGIN}")) == {1: 100, 2: 110, 3: 120, 4: 100}
+    assert providers.calls == []
+
+def test_only_misses_are_requested(service, providers):
+    castello = POINTS[0]
+    service.distance_cache.store(service.get_cache_key(44.8301, 11.6201, *coords(castello)), 900, 700)
+    # Stesse coordinate del Duomo: una sola destinazione nella chiamata
+    twin = dict(POINTS[1], id=5, name="Sagrato")
+    service.points_of_interest.append(twin)
+    service.rebuild_point_index()
+
+    response = service.app.test_client().get(f"/all_distances?origin={ORIGIN}")
+    (_, origins, dests), = providers.calls
+    assert origins == [(44.8301, 11.6201)]
+    assert dests == [coords(point) for point in POINTS[1:]]
+    assert distances(response) == {1: 900, 2: 100, 3: 110, 4: 120, 5: 100}
+
+def test_missing_elements_fall_back_to_ors(service, providers, monkeypatch):
+    get = providers.get
+
+    def partial(url, **kwargs):
+        # Google non trova un percorso verso la seconda destinazione
+        data = get(url, **kwargs).json()
+        data["rows"][0]["elements"][1] = {"status": "ZERO_RESULTS"}
+        return FakeResponse(data)
+
+    monkeypatch.setattr(service, "http_get", partial)
+    response = service.app.test_client().get(f"/all_distances?origin={ORIGIN}")
+    (google, _, _), (ors, _, ors_dests) = providers.calls
+    assert (google, ors) == ("google", "openroute")
+    # Solo l'elemento mancante va al provider successivo
+    assert ors_dests == [coords(POINTS[1])]
+    assert distances(response) == {1: 100, 2: 100, 3: 120, 4: 130}
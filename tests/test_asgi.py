@@ -0,0 +1,138 @@
+import json
+import threading
+
+import pytest
+from starlette.testclient import TestClient
+
+from conftest import POINTS
+
+ORIGIN = "44.8301,11.6201"
+
+@pytest.fixture
+def asgi(service, providers, monkeypatch):
+    """Client dell'app ASGI con gli stessi provider finti dell'app Flask"""
+    import app2_asgi
+
+    async def get(url, **kwargs):
+        return providers.get(url, **kwargs)
+
+    async def post(url, **kwargs):
+        return providers.post(url, **kwargs)
+
+    monkeypatch.setattr(app2_asgi, "async_http_get", get)
+    monkeypatch.setattr(app2_asgi, "async_http_post", post)
+    with TestClient(app2_asgi.app) as client:
+        yield client
+
+def reset(service, providers):
+    service.distance_cache.clear()
+    service.origin_index.clear()
+    service.response_cache.clear()
+    providers.calls.clear()
+
+def both(service, providers, asgi, method, url, **kwargs):
+    """La stessa richiesta all'app Flask e all'app ASGI, ognuna con la cache vuota"""
+    reset(service, providers)
+    flask_response = getattr(service.app.test_client(), method)(url, **kwargs)
+    flask_calls = list(providers.calls)
+    reset(service, providers)
+    asgi_response = getattr(asgi, method)(url, **kwargs)
+    assert providers.calls == flask_calls
+    return flask_response, asgi_response
+
+def assert_same_json(flask_response, asgi_response):
+    assert asgi_response.status_code == flask_response.status_code
+    assert asgi_response.json() == flask_response.get_json()
+    # Stessa serializzazione di jsonify: chiavi ordinate, formato compatto
+    assert asgi_response.content == flask_response.data
+
+@pytest.mark.parametrize("query", [
+    f"origin={ORIGIN}&destination={POINTS[0]['lat']},{POINTS[0]['lon']}",
+    f"origin={ORIGIN}",
+    f"origin=x&destination=1,2",
+    f"origin={ORIGIN}&destination=44.9,11.7",
+    f"origin=45.5,11.62&destination={POINTS[0]['lat']},{POINTS[0]['lon']}",
+])
+def test_distance_matches_flask(service, providers, asgi, query):
+    assert_same_json(*both(service, providers, asgi, "get", f"/distance?{query}"))
+
+def test_distance_contract(service, providers, asgi):
+    castello = POINTS[0]
+    url = f"/distance?origin={ORIGIN}&destination={castello['lat']},{castello['lon']}"
+    assert asgi.get(url).json() == {"distance": 100, "duration": 50, "id": 1}
+    # Seconda richiesta dalla cache
+    assert asgi.get(url).json() == {"distance": 100, "duration": 50, "id": 1}
+    assert len(providers.calls) == 1
+    assert asgi.get(f"/distance?origin=45.5,11.62&destination={castello['lat']},{castello['lon']}").json() == {"more_than": 80}
+
+def test_all_distances_matches_flask(service, providers, asgi):
+    flask_response, asgi_response = both(service, providers, asgi, "get", f"/all_distances?origin={ORIGIN}")
+    assert_same_json(flask_response, asgi_response)
+    assert [entry["id"] for entry in asgi_response.json()] == [point["id"] for point in POINTS]
+    assert all(set(entry) == {"distance", "duration", "id"} for entry in asgi_response.json())
+
+    # Origine ormai tutta in cache: risposta già serializzata con ETag, poi 304
+    cached = asgi.get(f"/all_distances?origin={ORIGIN}")
+    assert cached.json() == asgi_response.json()
+    etag = cached.headers["etag"]
+    assert asgi.get(f"/all_distances?origin={ORIGIN}", headers={"If-None-Match": etag}).status_code == 304
+
+@pytest.mark.parametrize("stream_format", ["ndjson", "sse"])
+def test_all_distances_stream_matches_flask(service, providers, asgi, stream_format):
+    flask_response, asgi_response = both(
+        service, providers, asgi, "get", f"/all_distances?origin={ORIGIN}&stream={stream_format}"
+    )
+    assert asgi_response.headers["content-type"].startswith(flask_response.mimetype)
+    flask_lines = flask_response.get_data(as_text=True).splitlines()
+    asgi_lines = asgi_response.text.splitlines()
+    # Ordine di arrivo dei risultati upstream: confronto a meno dell'ordine, fine stream in coda
+    assert sorted(asgi_lines) == sorted(flask_lines)
+    if stream_format == "sse":
+        assert asgi_lines[-3:-1] == ["event: end", 'data: {"count":4}']
+
+@pytest.mark.parametrize("url", [f"/nearest?origin={ORIGIN}&k=2", f"/within?origin={ORIGIN}&radius=600", "/nearest?k=2"])
+def test_nearby_matches_flask(service, providers, asgi, url):
+    assert_same_json(*both(service, providers, asgi, "get", url))
+
+def test_batch_matches_flask(service, providers, asgi):
+    pairs = [
+        {"origin": ORIGIN, "id": 1},
+        {"origin": ORIGIN, "destination": f"{POINTS[1]['lat']},{POINTS[1]['lon']}"},
+        {"origin": "44.8381,11.6198", "id": 2},
+        {"origin": ORIGIN, "destination": "44.9,11.7"},
+    ]
+    flask_response, asgi_response = both(service, providers, asgi, "post", "/distances/batch", json=pairs)
+    assert_same_json(flask_response, asgi_response)
+    assert set(asgi_response.json()) == {"results", "summary"}
+    assert asgi_response.json()["summary"]["invalid"] == 1
+
+def test_batch_ndjson_matches_flask(service, providers, asgi):
+    body = "".join(json.dumps({"origin": ORIGIN, "id": point["id"]}) + "\n" for point in POINTS)
+    reset(service, providers)
+    flask_response = service.app.test_client().post(
+        "/distances/batch", data=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+    reset(service, providers)
+    asgi_response = asgi.post("/distances/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert asgi_response.headers["content-type"].startswith("application/x-ndjson")
+    assert asgi_response.text == flask_response.get_data(as_text=True)
+    assert [json.loads(line)["id"] for line in asgi_response.text.splitlines()] == [point["id"] for point in POINTS]
+
+def test_async_request_waits_for_thread_lookup(service, providers, asgi):
+    """Single-flight condiviso: una chiave in corso su un thread non viene richiesta di nuovo"""
+    castello = POINTS[0]
+    cache_key = service.get_cache_key(44.8301, 11.6201, castello['lat'], castello['lon'])
+    futures, owned = service.claim_inflight([cache_key])
+    assert owned == [0]
+
+    def complete():
+        service.store_distance_results([cache_key], [(777, 555)])
+        service.complete_inflight(futures, [cache_key], [(777, 555)])
+
+    timer = threading.Timer(0.2, complete)
+    timer.start()
+    response = asgi.get(f"/distance?origin={ORIGIN}&destination={castello['lat']},{castello['lon']}")
+    timer.join()
+    assert response.json() == {"distance": 777, "duration": 555, "id": 1}
+    assert providers.calls == []
+    assert cache_key not in service.inflight_lookups
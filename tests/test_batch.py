@@ -0,0 +1,126 @@
+import json
+import time
+
+import pytest
+
+from conftest import POINTS
+
+ORIGIN = "44.8301,11.6201"
+OTHER = "44.8322,11.618"
+
+def point_coords(point):
+    return f"{point['lat']},{point['lon']}"
+
+def test_pairs_grouped_by_cache_key(service, providers):
+    castello, duomo = POINTS[0], POINTS[1]
+    service.distance_cache.store(service.get_cache_key(44.8322, 11.618, duomo['lat'], duomo['lon']), 640, 500)
+    pairs = [
+        {"origin": ORIGIN, "id": 1},
+        # Stessa cella di origine e stesso punto (per coordinate): una sola coppia da risolvere
+        {"origin": "44.83012,11.62008", "destination": point_coords(castello)},
+        {"origin": ORIGIN, "id": 2},
+        {"origin": OTHER, "id": 2},
+        {"origin": "45.5,11.62", "id": 1},
+        {"origin": ORIGIN, "id": 99},
+        {"origin": ORIGIN},
+    ]
+    response = service.app.test_client().post("/distances/batch", json=pairs)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["summary"] == {
+        "pairs": 7, "unique": 3, "cache_hits": 1, "misses": 2, "more_than": 1, "invalid": 2, "timed_out": 0
+    }
+    results = data["results"]
+    # Una sola chiamata matrix per le due coppie mancanti della stessa origine
+    (provider, origins, dests), = providers.calls
+    assert provider == "google" and origins == [(44.8301, 11.6201)]
+    assert dests == [(castello['lat'], castello['lon']), (duomo['lat'], duomo['lon'])]
+    assert results[0] == {"distance": 100, "duration": 50, "id": 1, "origin": ORIGIN}
+    assert results[1] == dict(results[0], origin="44.83012,11.62008")
+    assert results[2] == {"distance": 110, "duration": 55, "id": 2, "origin": ORIGIN}
+    assert results[3] == {"distance": 640, "duration": 500, "id": 2, "origin": OTHER}
+    assert results[4] == {"more_than": 80, "id": 1, "origin": "45.5,11.62"}
+    assert results[5] == {"error": "Invalid destination point"}
+    assert results[6] == {"error": "Destination or id is required"}
+
+def test_ndjson_body_and_response(service, providers):
+    body = "\n".join(json.dumps({"origin": ORIGIN, "id": point['id']}) for point in POINTS) + "\n"
+    response = service.app.test_client().post(
+        "/distances/batch", data=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line["id"] for line in lines] == [1, 2, 3, 4]
+    assert all(line["origin"] == ORIGIN and "distance" in line for line in lines)
+
+def test_invalid_bodies(service, monkeypatch):
+    client = service.app.test_client()
+    assert client.post("/distances/batch", data="{", content_type="application/json").status_code == 400
+    assert client.post("/distances/batch", json=[]).status_code == 400
+    assert client.post("/distances/batch", json={"pairs": [{"origin": ORIGIN, "id": 1}]}).status_code == 200
+    monkeypatch.setattr(service, "BATCH_MAX_PAIRS", 2)
+    response = client.post("/distances/batch", json=[{"origin": ORIGIN, "id": 1}] * 3)
+    assert response.status_code == 413
+
+def items(origins, dests):
+    return [((lat, 11.6), (44.9, lon), f"{lat},{lon}") for lat in origins for lon in dests]
+
+@pytest.mark.parametrize("origins, dests, sizes", [
+    # Limite di origini per chiamata
+    (40, 1, [25, 15]),
+    # Limite di elementi: 10 origini × 20 destinazioni in blocchi da 5 × 20
+    (10, 20, [100, 100]),
+    # Limite di destinazioni: le coppie di un'origine vengono divise
+    (1, 30, [25, 5]),
+])
+def test_plan_matrix_blocks_limits(service, origins, dests, sizes):
+    pairs = items([44.8 + i / 1000 for i in range(origins)], [11.6 + j / 1000 for j in range(dests)])
+    blocks = service.plan_matrix_blocks(pairs)
+    assert [len(block) for block in blocks] == sizes
+    assert sorted(item for block in blocks for item in block) == sorted(pairs)
+    for block in blocks:
+        block_origins, block_dests, _ = service.matrix_block_parts(block)
+        assert len(block_origins) <= service.GOOGLE_MATRIX_MAX_ORIGINS
+        assert len(block_dests) <= service.GOOGLE_MATRIX_MAX_DESTINATIONS
+        assert len(block_origins) * len(block_dests) <= service.GOOGLE_MATRIX_MAX_ELEMENTS
+
+def test_multi_origin_block_mapping(service, providers):
+    # Due origini con destinazioni in parte comuni: 2 righe × 3 colonne in una chiamata
+    block = [
+        ((44.83, 11.62), (44.84, 11.61), "a"),
+        ((44.83, 11.62), (44.85, 11.62), "b"),
+        ((44.82, 11.63), (44.85, 11.62), "c"),
+        ((44.82, 11.63), (44.86, 11.63), "d"),
+    ]
+    assert service.matrix_block_parts(block) == (
+        [(44.83, 11.62), (44.82, 11.63)],
+        [(44.84, 11.61), (44.85, 11.62), (44.86, 11.63)],
+        [(0, 0), (0, 1), (1, 1), (1, 2)]
+    )
+    expected = [(100, 50), (110, 55), (1110, 555), (1120, 560)]
+    assert service.resolve_distances_block(block) == expected
+    (provider, origins, dests), = providers.calls
+    assert provider == "google" and len(origins) == 2 and len(dests) == 3
+
+    # Google non disponibile: stesso blocco con ORS matrix (sources/destinations)
+    def failing(url, **kwargs):
+        raise RuntimeError("google down")
+
+    providers.calls.clear()
+    service.http_get = failing
+    assert service.resolve_distances_block(block) == expected
+    (provider, origins, dests), = providers.calls
+    assert provider == "openroute" and len(origins) == 2 and len(dests) == 3
+
+def test_blocks_after_deadline_are_skipped(service, providers):
+    castello = POINTS[0]
+    misses = {
+        service.get_cache_key(44.8301, 11.6201, castello['lat'], castello['lon']): ((44.8301, 11.6201), castello, [0])
+    }
+    skipped = service.upstream_stats["skipped_after_deadline"]
+    futures = service.start_batch_misses(misses, deadline=time.monotonic() - 1)
+    (future,) = futures.values()
+    assert future.result(timeout=5) is None
+    assert service.upstream_stats["skipped_after_deadline"] == skipped + 1
+    assert providers.calls == []
+    assert not service.inflight_lookups
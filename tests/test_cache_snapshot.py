@@ -0,0 +1,137 @@
+import json
+import os
+import time
+from array import array
+
+import pytest
+
+from cache_backends import SnapshotCacheBackend
+from conftest import POINTS
+from cache_snapshot import CacheSnapshot, HEADER, VERSION, rows_from_entries, write_snapshot
+from memory_cache import CompactDistanceCache, OriginIndex
+
+ENTRIES = {
+    "44.8301,11.6201,44.838,11.6198": {"distance": 1805, "duration": 1479, "cached_at": 1700000000},
+    "44.8301,11.6201,44.84,11.62": {"distance": 950, "duration": 700, "cached_at": 1700000100},
+    "44.85,11.63,44.838,11.6198": {"distance": 2400, "duration": 1900, "cached_at": 1700000200},
+}
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "distance_cache.snap")
+    write_snapshot(path, *rows_from_entries(ENTRIES))
+    return path
+
+def test_round_trip(snapshot_path):
+    snapshot = CacheSnapshot(snapshot_path)
+    try:
+        assert snapshot.row_count == 2
+        assert snapshot.entry_count == 3
+        assert snapshot.to_dict() == ENTRIES
+    finally:
+        snapshot.close()
+
+def test_find_and_read_row(snapshot_path):
+    snapshot = CacheSnapshot(snapshot_path)
+    try:
+        row = snapshot.find("44.8301,11.6201")
+        assert row is not None
+        assert snapshot.find("44.9,11.7") is None
+        columns, distances, durations, cached_at = array('I'), array('i'), array('i'), array('I')
+        assert snapshot.read_row(row, (columns, distances, durations, cached_at)) == 2
+        assert sorted(distances) == [950, 1805]
+    finally:
+        snapshot.close()
+
+def test_empty_snapshot(tmp_path):
+    path = str(tmp_path / "empty.snap")
+    assert write_snapshot(path, *rows_from_entries({})) == 0
+    snapshot = CacheSnapshot(path)
+    try:
+        assert snapshot.to_dict() == {}
+    finally:
+        snapshot.close()
+
+def test_rejects_other_version(snapshot_path):
+    with open(snapshot_path, 'r+b') as f:
+        header = list(HEADER.unpack(f.read(HEADER.size)))
+        header[1] = VERSION + 1
+        f.seek(0)
+        f.write(HEADER.pack(*header))
+    with pytest.raises(ValueError, match="version"):
+        CacheSnapshot(snapshot_path)
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_snapshot.snap"
+    path.write_bytes(b"NOTASNAP" + bytes(HEADER.size))
+    with pytest.raises(ValueError, match="not a cache snapshot"):
+        CacheSnapshot(str(path))
+
+def test_backend_log_and_compaction(tmp_path):
+    path = str(tmp_path / "distance_cache.snap")
+    backend = SnapshotCacheBackend(path)
+    cache = CompactDistanceCache()
+    for key, value in ENTRIES.items():
+        cache.store(key, value["distance"], value["duration"])
+    backend.save(cache, list(ENTRIES))
+    removed = "44.85,11.63,44.838,11.6198"
+    cache.invalidate(lambda key: key == removed)
+    backend.delete(cache, [removed])
+    expected = {key: ENTRIES[key]["distance"] for key in ENTRIES if key != removed}
+
+    # Prima della compattazione le modifiche sono solo nel log, sopra lo snapshot vuoto
+    write_snapshot(path, [], [])
+    assert {key: value["distance"] for key, value in backend.load().items()} == expected
+
+    assert backend.compact(cache) == 2
+    assert not os.path.exists(backend.log_path)
+    # Niente da compattare se il log è vuoto
+    assert backend.compact(cache) is None
+
+    reopened = SnapshotCacheBackend(path)
+    restored = CompactDistanceCache()
+    restored.attach_snapshot(reopened.open_snapshot())
+    restored.replay(reopened.load_log())
+    for key, distance in expected.items():
+        assert restored.get(key)["distance"] == distance
+    assert restored.get(removed) is None
+
+def test_destinations_without_reading_rows(snapshot_path):
+    cache = CompactDistanceCache()
+    cache.attach_snapshot(CacheSnapshot(snapshot_path))
+    cache.store("44.86,11.64,44.85,11.65", 300, 200)
+    assert sorted(cache.destinations()) == [",44.838,11.6198", ",44.84,11.62", ",44.85,11.65"]
+    assert cache.get_stats()["snapshot_pending_entries"] == 3
+
+def test_first_start_imports_json_cache(service, tmp_path, monkeypatch):
+    """Con il backend snapshot e nessuno snapshot su disco, la cache JSON esistente viene importata"""
+    now = int(time.time())
+    origins = [(44.8301, 11.6201), (44.8322, 11.618)]
+    entries = {
+        service.get_cache_key(*origin, point['lat'], point['lon']): {"distance": 1000 + i, "duration": 800, "cached_at": now}
+        for i, (origin, point) in enumerate((origin, point) for origin in origins for point in POINTS)
+    }
+    json_path = tmp_path / "distance_cache.json"
+    json_path.write_text(json.dumps(entries))
+    backend = SnapshotCacheBackend(str(tmp_path / "distance_cache.snap"))
+    monkeypatch.setattr(service, "cache_backend", backend)
+    monkeypatch.setattr(service, "CACHE_FILE", str(json_path))
+    monkeypatch.setattr(service, "CACHE_NEIGHBOR_RADIUS_M", 100)
+    monkeypatch.setattr(service, "origin_index", OriginIndex(100, service.decode_origin_key))
+
+    service.load_cache_from_file()
+    assert backend.exists()
+    assert len(service.distance_cache) == len(entries)
+    assert len(service.origin_index) == 2
+    # Il file JSON resta com'era (si può tornare a CACHE_BACKEND=json)
+    assert json.loads(json_path.read_text()) == entries
+
+    # Riavvio: lo snapshot esiste, il JSON non viene importato di nuovo
+    json_path.write_text(json.dumps({key: dict(value, distance=1) for key, value in entries.items()}))
+    service.distance_cache.clear()
+    service.origin_index.clear()
+    service.load_cache_from_file()
+    assert service.distance_cache.snapshot is not None
+    assert {key: service.distance_cache.get(key)["distance"] for key in entries} == \
+        {key: value["distance"] for key, value in entries.items()}
+    assert len(service.origin_index) == 2
@@ -0,0 +1,40 @@
+from conftest import POINTS
+
+ORIGIN = "44.8301,11.6201"
+
+def test_provider_gets_point_coordinates(service, providers):
+    castello = POINTS[0]
+    client = service.app.test_client()
+    # Destinazione indicata con coordinate diverse di meno della tolleranza
+    response = client.get(f"/distance?origin={ORIGIN}&destination={castello['lat'] + 0.00004},{castello['lon'] - 0.00004}")
+    assert response.status_code == 200
+    assert response.get_json() == {"distance": 100, "duration": 50, "id": 1}
+    (_, _, dests), = providers.calls
+    assert dests == [(castello['lat'], castello['lon'])]
+    assert service.distance_cache.get(service.get_cache_key(44.8301, 11.6201, castello['lat'], castello['lon'])) is not None
+
+    # Stessa cella e stesso punto con le coordinate esatte: dalla cache
+    response = client.get(f"/distance?origin={ORIGIN}&destination={castello['lat']},{castello['lon']}")
+    assert response.get_json() == {"distance": 100, "duration": 50, "id": 1}
+    assert len(providers.calls) == 1
+
+def test_distance_errors(service):
+    client = service.app.test_client()
+    assert client.get(f"/distance?origin={ORIGIN}").status_code == 400
+    assert client.get(f"/distance?origin=x&destination=1,2").get_json() == {"error": "Invalid coordinate format. Use lat,lon"}
+    assert client.get(f"/distance?origin={ORIGIN}&destination=44.9,11.7").get_json() == {"error": "Invalid destination point"}
+    assert client.get(f"/distance?origin=45.5,11.62&destination=44.8381,11.6198").get_json() == {"more_than": 80}
+
+def test_legacy_destination_keys_are_dropped(service):
+    castello = POINTS[0]
+    current = service.get_cache_key(44.8301, 11.6201, castello['lat'], castello['lon'])
+    legacy = service.get_cache_key(44.8301, 11.6201, castello['lat'] + 0.00004, castello['lon'])
+    service.distance_cache.store(current, 500, 400)
+    service.distance_cache.store(legacy, 510, 410)
+
+    assert service.drop_legacy_destination_keys() == 1
+    assert service.distance_cache.get(legacy) is None
+    assert service.distance_cache.get(current) is not None
+    assert legacy in service.removed_cache_keys
+    # Già migrata: niente da eliminare
+    assert service.drop_legacy_destination_keys() == 0
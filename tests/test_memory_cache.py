@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+from cache_snapshot import CacheSnapshot, rows_from_entries, write_snapshot
+from memory_cache import BoundedDistanceCache, CompactDistanceCache
+
+A = "44.8301,11.6201"
+B = "44.8322,11.618"
+C = "44.85,11.63"
+DESTS = [",44.8381,11.6198", ",44.8352,11.6202", ",44.8429,11.6166"]
+
+def entries(origins, now=None):
+    now = int(now or time.time())
+    return {
+        origin + dest: {"distance": 1000 * i + j, "duration": 500 * i + j, "cached_at": now}
+        for i, origin in enumerate(origins) for j, dest in enumerate(DESTS)
+    }
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "distance_cache.snap")
+    write_snapshot(path, *rows_from_entries(entries([A, B, C])))
+    snapshot = CacheSnapshot(path)
+    yield snapshot
+    snapshot.close()
+
+def test_same_interface_as_dict_cache():
+    for cache in (CompactDistanceCache(), BoundedDistanceCache()):
+        for key, value in entries([A, B]).items():
+            cache.store(key, value["distance"], value["duration"])
+        assert len(cache) == 6
+        assert cache.lookup(A + DESTS[1])["distance"] == 1
+        assert cache.get(B + DESTS[2])["duration"] == 502
+        assert cache.lookup(C + DESTS[0]) is None
+        found = cache.lookup_many([A + DESTS[0], B + DESTS[0], C + DESTS[0]])
+        assert sorted(found) == [A + DESTS[0], B + DESTS[0]]
+        assert sorted(cache.keys()) == sorted(entries([A, B]))
+
+def test_lazy_rows_from_snapshot(snapshot):
+    cache = CompactDistanceCache()
+    cache.attach_snapshot(snapshot)
+    assert len(cache) == 9
+    assert not cache.rows
+    # has_origin e origins non leggono le righe
+    assert cache.has_origin(B) and not cache.has_origin("44.9,11.7")
+    assert sorted(cache.origins()) == sorted([A, B, C])
+    assert not cache.rows
+
+    # Il primo accesso copia in memoria la sola riga dell'origine
+    assert cache.lookup_many([B + dest for dest in DESTS]) == {
+        B + dest: {"distance": 1000 + j, "duration": 500 + j, "cached_at": cache.get(B + dest)["cached_at"]}
+        for j, dest in enumerate(DESTS)
+    }
+    assert list(cache.rows) == [B]
+    stats = cache.get_stats()
+    assert stats["snapshot_pending_entries"] == 6
+    assert stats["origins"] == 3
+    assert len(cache) == 9
+
+def test_eviction_drops_unread_snapshot_rows_first(snapshot):
+    removed = []
+    cache = CompactDistanceCache(max_entries=7, on_remove=lambda keys, reason: removed.append((reason, sorted(keys))))
+    cache.attach_snapshot(snapshot)
+    # Oltre la capacità: la prima riga dello snapshot (la meno usata quando è stato salvato)
+    assert removed == [("eviction", sorted(A + dest for dest in DESTS))]
+    assert len(cache) == 6
+
+    cache.lookup(C + DESTS[0])
+    cache.store("44.86,11.64" + DESTS[0], 1, 1)
+    assert len(removed) == 1
+    cache.store("44.86,11.64" + DESTS[1], 1, 1)
+    # Poi B, ancora nello snapshot, prima di C appena letta
+    assert removed[-1] == ("eviction", sorted(B + dest for dest in DESTS))
+    assert cache.has_origin(C) and not cache.has_origin(B)
+
+def test_expired_entries_are_dropped_on_lookup():
+    removed = []
+    cache = CompactDistanceCache(ttl_seconds=60, on_remove=lambda keys, reason: removed.append((reason, keys)))
+    old = entries([A], now=time.time() - 120)
+    cache.load_entries(dict(old, **entries([B])))
+    # Scadute già al caricamento
+    assert removed == [("expiration", list(old))]
+    assert len(cache) == 3
+    cache.insert(B + DESTS[0], {"distance": 5, "duration": 5, "cached_at": time.time() - 120})
+    assert cache.lookup(B + DESTS[0]) is None
+    assert removed[-1] == ("expiration", [B + DESTS[0]])
+    assert cache.get_stats()["expirations"] == 4
+
+def test_compaction_keeps_lazy_and_modified_rows(snapshot, tmp_path):
+    cache = CompactDistanceCache()
+    cache.attach_snapshot(snapshot)
+    cache.store(A + DESTS[0], 7, 7)
+    cache.store("44.86,11.64,44.9,11.7", 8, 8)
+    cache.invalidate(lambda key: key.startswith(C) and key.endswith(DESTS[2]))
+
+    expected = {key: value["distance"] for key, value in entries([A, B, C]).items()}
+    expected[A + DESTS[0]] = 7
+    expected["44.86,11.64,44.9,11.7"] = 8
+    del expected[C + DESTS[2]]
+
+    path = str(tmp_path / "compacted.snap")
+    write_snapshot(path, *cache.snapshot_data(batch_rows=1))
+    compacted = CacheSnapshot(path)
+    try:
+        assert {key: value["distance"] for key, value in compacted.to_dict().items()} == expected
+        # Riaperto: stesso contenuto, ancora senza leggere le righe
+        restored = CompactDistanceCache()
+        restored.attach_snapshot(compacted)
+        assert len(restored) == len(expected)
+        assert {key: restored.get(key)["distance"] for key in expected} == expected
+    finally:
+        compacted.close()
+
+def test_clear_invalidates_snapshot_copy(snapshot):
+    cache = CompactDistanceCache()
+    cache.attach_snapshot(snapshot)
+    generation = cache.generation
+    cache.clear()
+    assert cache.generation == generation + 1
+    assert len(cache) == 0 and cache.snapshot is None
+    assert cache.snapshot_data() == ([], [])
@@ -0,0 +1,74 @@
+import pytest
+
+import poi_index
+from conftest import POINTS
+from poi_index import PointIndex
+
+ORIGIN = (44.8301, 11.6201)
+# In linea d'aria da ORIGIN: Casa Romei, Duomo, Castello, Palazzo dei Diamanti
+BY_DISTANCE = [4, 2, 1, 3]
+
+@pytest.fixture(params=["numpy", "python"])
+def index(request, monkeypatch):
+    """Indice dei punti di prova, con NumPy (se installato) e con il ciclo Python"""
+    if request.param == "python":
+        monkeypatch.setattr(poi_index, "np", None)
+    return PointIndex(POINTS)
+
+def test_nearest(index):
+    found = index.nearest(*ORIGIN, 4)
+    assert [point['id'] for _, point in found] == BY_DISTANCE
+    assert [distance for distance, _ in found] == sorted(int(d) for d in index.haversine_from(*ORIGIN))
+    assert all(isinstance(distance, int) for distance, _ in found)
+    assert [point['id'] for _, point in index.nearest(*ORIGIN, 2)] == BY_DISTANCE[:2]
+    assert [point['id'] for _, point in index.nearest(*ORIGIN, 10)] == BY_DISTANCE
+    assert index.nearest(*ORIGIN, 0) == []
+
+def test_nearest_ties_keep_list_order(index):
+    twins = PointIndex([dict(POINTS[0], id=10), dict(POINTS[0], id=11), dict(POINTS[1], id=12)])
+    assert [point['id'] for _, point in twins.nearest(*ORIGIN, 2)] == [12, 10]
+    assert [point['id'] for _, point in twins.nearest(POINTS[0]['lat'], POINTS[0]['lon'], 2)] == [10, 11]
+
+def test_within(index):
+    castello = dict(zip(BY_DISTANCE, index.nearest(*ORIGIN, 4)))[1][0]
+    assert [point['id'] for _, point in index.within(*ORIGIN, castello)] == [4, 2, 1]
+    assert [point['id'] for _, point in index.within(*ORIGIN, castello - 1)] == [4, 2]
+    assert index.within(*ORIGIN, 10) == []
+    assert PointIndex([]).within(*ORIGIN, 1000) == []
+
+def test_nearest_endpoint_orders_by_walking_distance(service, providers):
+    # Palazzo dei Diamanti è il più lontano in linea d'aria ma il più vicino a piedi
+    diamanti = POINTS[2]
+    service.distance_cache.store(service.get_cache_key(*ORIGIN, diamanti['lat'], diamanti['lon']), 50, 40)
+    response = service.app.test_client().get("/nearest?origin=44.8301,11.6201&k=2")
+    assert response.status_code == 200
+    entries = response.get_json()
+    assert [entry["id"] for entry in entries] == [3, 4]
+    assert entries[0]["distance"] == 50
+    assert all(entry["haversine"] > 0 for entry in entries)
+    # Solo i k * NEAREST_CANDIDATE_FACTOR candidati in linea d'aria vengono risolti
+    (_, _, dests), = providers.calls
+    assert len(dests) == 3
+
+def test_within_endpoint(service, providers):
+    response = service.app.test_client().get("/within?origin=44.8301,11.6201&radius=600")
+    entries = response.get_json()
+    assert [entry["id"] for entry in entries] == [4, 2]
+    assert all(entry["haversine"] <= 600 for entry in entries)
+    (_, _, dests), = providers.calls
+    assert len(dests) == 2
+
+@pytest.mark.parametrize("query, error", [
+    ("/nearest?k=2", "Origin is required"),
+    ("/nearest?origin=44.83&k=2", "Invalid coordinate format. Use lat,lon"),
+    ("/nearest?origin=44.8301,11.6201&k=abc", "k must be an integer"),
+    ("/nearest?origin=44.8301,11.6201&k=0", "k must be between 1 and 50"),
+    ("/within?origin=44.8301,11.6201", "Radius is required"),
+    ("/within?origin=44.8301,11.6201&radius=far", "radius must be a number of meters"),
+    ("/within?origin=44.8301,11.6201&radius=20000", "radius must be between 0 and 10000 meters"),
+])
+def test_invalid_parameters(service, providers, query, error):
+    response = service.app.test_client().get(query)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+    assert providers.calls == []
@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+from conftest import POINTS
+from geo import geohash_cell_size, geohash_decode, geohash_encode
+from memory_cache import BoundedDistanceCache, OriginIndex
+
+RADIUS_M = 100
+ORIGIN = (44.8301, 11.6201)
+
+@pytest.fixture
+def neighbors(service, monkeypatch):
+    """app2 con il riuso dell'origine vicina entro RADIUS_M"""
+    monkeypatch.setattr(service, "CACHE_NEIGHBOR_RADIUS_M", RADIUS_M)
+    monkeypatch.setattr(service, "origin_index", OriginIndex(RADIUS_M, service.decode_origin_key))
+    monkeypatch.setattr(service, "neighbor_stats", {"hits": 0, "total_error_m": 0, "max_error_m": 0})
+    return service
+
+def store(service, origin, point, distance=1000, duration=800):
+    service.store_distance_results([service.get_cache_key(*origin, point['lat'], point['lon'])], [(distance, duration)])
+
+def test_haversine_delta_and_approximation(neighbors):
+    castello = POINTS[0]
+    store(neighbors, ORIGIN, castello)
+    # 0.0005 gradi di latitudine più a nord (~56 m), verso il punto
+    lat, lon = ORIGIN[0] + 0.0005, ORIGIN[1]
+
+    result = neighbors.get_neighbor_distance(lat, lon, castello)
+    offset = neighbors.haversine_distance(lat, lon, *ORIGIN)
+    delta = (neighbors.haversine_distance(lat, lon, castello['lat'], castello['lon'])
+             - neighbors.haversine_distance(*ORIGIN, castello['lat'], castello['lon']))
+    assert delta < 0
+    assert result == {
+        "distance": 1000 + delta,
+        "duration": round(800 * (1000 + delta) / 1000),
+        "approximate": True,
+        "approximation_m": offset
+    }
+    assert neighbors.get_cache_key_stats()["neighbor_max_error_m"] == offset
+
+def test_no_neighbor_beyond_radius(neighbors):
+    store(neighbors, ORIGIN, POINTS[0])
+    assert neighbors.get_neighbor_distance(ORIGIN[0] + 0.002, ORIGIN[1], POINTS[0]) is None
+    # Origine vicina ma senza quella destinazione
+    assert neighbors.get_neighbor_distance(ORIGIN[0] + 0.0005, ORIGIN[1], POINTS[1]) is None
+
+def test_evicted_origin_is_not_a_neighbor(neighbors, monkeypatch):
+    monkeypatch.setattr(neighbors.distance_cache, "max_entries", 2)
+    store(neighbors, ORIGIN, POINTS[0])
+    store(neighbors, ORIGIN, POINTS[1])
+    nearby = (ORIGIN[0] + 0.0005, ORIGIN[1])
+    assert [prefix for _, prefix in neighbors.origin_index.neighbors(*nearby, neighbors.haversine_distance)] == ["44.8301,11.6201"]
+
+    # Una terza entry di un'altra origine (lontana) elimina la riga di ORIGIN
+    store(neighbors, (44.8500, 11.6500), POINTS[0])
+    assert neighbors.distance_cache.get(neighbors.get_cache_key(*ORIGIN, POINTS[0]['lat'], POINTS[0]['lon'])) is None
+    assert neighbors.origin_index.neighbors(*nearby, neighbors.haversine_distance) == []
+    assert neighbors.get_neighbor_distance(*nearby, POINTS[0]) is None
+    assert len(neighbors.origin_index) == 1
+
+def test_invalidation_keeps_origins_with_other_entries(neighbors):
+    store(neighbors, ORIGIN, POINTS[0])
+    store(neighbors, ORIGIN, POINTS[1])
+    store(neighbors, (44.8500, 11.6500), POINTS[0])
+
+    neighbors.invalidate_point_cache([POINTS[0]])
+    assert len(neighbors.origin_index) == 1
+    assert neighbors.get_neighbor_distance(ORIGIN[0] + 0.0005, ORIGIN[1], POINTS[1]) is not None
+
+    neighbors.invalidate_point_cache([POINTS[1]])
+    assert len(neighbors.origin_index) == 0
+
+def test_neighbor_stats_are_not_lost(neighbors):
+    store(neighbors, ORIGIN, POINTS[0])
+
+    def lookups():
+        for _ in range(200):
+            neighbors.get_neighbor_distance(ORIGIN[0] + 0.0005, ORIGIN[1], POINTS[0])
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert neighbors.get_cache_key_stats()["neighbor_hits"] == 1600
+
+def test_bounded_cache_tracks_origins():
+    cache = BoundedDistanceCache(max_entries=2)
+    cache.store("44.83,11.62,44.8381,11.6198", 100, 80)
+    cache.store("44.83,11.62,44.8352,11.6202", 100, 80)
+    assert cache.origins() == ["44.83,11.62"]
+    cache.store("44.85,11.65,44.8381,11.6198", 100, 80)
+    assert cache.has_origin("44.83,11.62")
+    cache.store("44.85,11.65,44.8352,11.6202", 100, 80)
+    assert not cache.has_origin("44.83,11.62")
+    assert cache.origins() == ["44.85,11.65"]
+    cache.clear()
+    assert cache.origins() == []
+
+def test_geohash_encode_decode():
+    # Esempio di riferimento di geohash.org
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    d_lat, d_lon = geohash_cell_size(8)
+    assert d_lat == pytest.approx(180 / 2 ** 20)
+    assert d_lon == pytest.approx(360 / 2 ** 20)
+    lat, lon = geohash_decode(geohash_encode(*ORIGIN, 8))
+    assert abs(lat - ORIGIN[0]) <= d_lat / 2
+    assert abs(lon - ORIGIN[1]) <= d_lon / 2
+
+def test_geohash_cache_keys(service, monkeypatch):
+    monkeypatch.setattr(service, "CACHE_KEY_MODE", "geohash")
+    monkeypatch.setattr(service, "CACHE_GEOHASH_PRECISION", 7)
+    key = service.get_origin_key(*ORIGIN)
+    assert key == geohash_encode(*ORIGIN, 7)
+    # Due origini nella stessa cella condividono la chiave, una cella più a nord no
+    d_lat, _ = geohash_cell_size(7)
+    center = service.decode_origin_key(key)
+    assert service.get_origin_key(center[0] + d_lat / 4, center[1]) == key
+    assert service.get_origin_key(center[0] + d_lat, center[1]) != key
+    assert service.get_cache_key(*ORIGIN, 44.8381, 11.6198) == f"{key},44.8381,11.6198"
@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import POINTS
+
+ORIGINS = [(44.8301, 11.6201), (44.8322, 11.6180)]
+
+@pytest.fixture
+def client(service):
+    for origin in ORIGINS:
+        for point in POINTS:
+            service.distance_cache.store(service.get_cache_key(*origin, point['lat'], point['lon']), 1000, 800)
+    return service.app.test_client()
+
+def strapi_items(points):
+    return [{"id": point['id'], "Latitude": point['lat'], "Longitude": point['lon'], "Name": point['name']}
+            for point in points]
+
+def cached(app2, point):
+    return [app2.distance_cache.get(app2.get_cache_key(*origin, point['lat'], point['lon'])) is not None
+            for origin in ORIGINS]
+
+def test_reload_invalidates_only_moved_and_removed_points(app2, client, monkeypatch):
+    castello, duomo, diamanti, romei = POINTS
+    moved = dict(duomo, lat=44.8355)
+    renamed = dict(castello, name="Castello Estense")
+    added = {"id": 5, "lat": 44.8370, "lon": 11.6300, "name": "Palazzo Schifanoia"}
+    monkeypatch.setattr(app2.strapi_fetcher, "fetch", lambda full=False: (
+        strapi_items([renamed, moved, romei, added]), {"mode": "full", "requests": 1}
+    ))
+
+    response = client.get(f"/get_points?secret={app2.ADMIN_SECRET}")
+    assert response.status_code == 200
+    changes = response.get_json()["changes"]
+    assert changes["added"] == [5]
+    assert changes["removed"] == [3]
+    assert changes["moved"] == [2]
+    assert changes["updated"] == [1]
+    assert changes["unchanged"] == 1
+    assert changes["invalidated_entries"] == 4
+
+    # Le entry dei punti rinominati o invariati restano valide
+    assert cached(app2, castello) == [True, True]
+    assert cached(app2, romei) == [True, True]
+    assert cached(app2, duomo) == [False, False]
+    assert cached(app2, diamanti) == [False, False]
+    assert [point['id'] for point in app2.points_of_interest] == [1, 2, 4, 5]
+
+def test_coordinates_still_used_are_kept(app2, client, monkeypatch):
+    castello, duomo, diamanti, romei = POINTS
+    # Il punto 3 viene rimosso ma un nuovo punto ha le stesse coordinate
+    replacement = dict(diamanti, id=6, name="Pinacoteca")
+    monkeypatch.setattr(app2.strapi_fetcher, "fetch", lambda full=False: (
+        strapi_items([castello, duomo, romei, replacement]), {"mode": "full", "requests": 1}
+    ))
+
+    changes = client.get(f"/get_points?secret={app2.ADMIN_SECRET}").get_json()["changes"]
+    assert changes["removed"] == [3]
+    assert changes["added"] == [6]
+    assert changes["invalidated_entries"] == 0
+    assert cached(app2, diamanti) == [True, True]
+
+def test_unchanged_on_strapi_keeps_everything(app2, client, monkeypatch):
+    monkeypatch.setattr(app2.strapi_fetcher, "fetch", lambda full=False: (None, {"mode": "delta", "requests": 1}))
+
+    changes = client.get(f"/get_points?secret={app2.ADMIN_SECRET}").get_json()["changes"]
+    assert changes["invalidated_entries"] == 0
+    assert changes["unchanged"] == len(POINTS)
+    assert all(all(cached(app2, point)) for point in POINTS)
+
+def test_requires_admin_secret(client):
+    assert client.get("/get_points?secret=wrong").status_code == 401
@@ -0,0 +1,68 @@
+import time
+
+from provider_router import CLOSED, HALF_OPEN, OPEN, ProviderRouter
+
+OPEN_SECONDS = 0.05
+
+def failing():
+    raise RuntimeError("upstream error")
+
+def found(value):
+    return value is not None
+
+def make_router():
+    return ProviderRouter(["google", "openroute"], failure_threshold=3, open_seconds=OPEN_SECONDS)
+
+def open_circuit(router):
+    for _ in range(3):
+        router.run({"google": failing}, found)
+    assert router.providers["google"].state == OPEN
+
+def test_consecutive_failures_open_the_circuit():
+    router = make_router()
+    for _ in range(2):
+        assert router.run({"google": failing}, found) == (None, None)
+    assert router.providers["google"].state == CLOSED
+    router.run({"google": failing}, found)
+    assert router.providers["google"].state == OPEN
+
+    # Con il circuito aperto il provider viene saltato
+    assert router.order() == ["openroute"]
+    assert router.run({"google": lambda: 1, "openroute": lambda: 2}, found) == ("openroute", 2)
+    assert router.get_stats()["providers"]["google"]["skipped"] >= 1
+
+def test_half_open_allows_a_single_trial():
+    router = make_router()
+    open_circuit(router)
+    time.sleep(OPEN_SECONDS)
+    assert router.order() == ["google", "openroute"]
+    assert router.providers["google"].state == HALF_OPEN
+    assert router._begin("google")
+    # La chiamata di prova è in corso: nessun'altra passa
+    assert not router._begin("google")
+    assert router.order() == ["openroute"]
+
+def test_successful_trial_closes_the_circuit():
+    router = make_router()
+    open_circuit(router)
+    time.sleep(OPEN_SECONDS)
+    assert router.run({"google": lambda: 1}, found) == ("google", 1)
+    assert router.providers["google"].state == CLOSED
+    assert router.providers["google"].consecutive_failures == 0
+
+def test_failed_trial_reopens_the_circuit():
+    router = make_router()
+    open_circuit(router)
+    time.sleep(OPEN_SECONDS)
+    router.run({"google": failing}, found)
+    assert router.providers["google"].state == OPEN
+    assert router.providers["google"].counters["opened"] == 2
+    assert router.order() == ["openroute"]
+
+def test_no_route_answer_is_not_a_failure():
+    router = make_router()
+    for _ in range(5):
+        # Il provider risponde ma senza risultato: si passa al successivo, il circuito resta chiuso
+        assert router.run({"google": lambda: None, "openroute": lambda: 2}, found) == ("openroute", 2)
+    assert router.providers["google"].state == CLOSED
+    assert router.providers["google"].counters["failures"] == 0
@@ -0,0 +1,91 @@
+import time
+
+from rate_limiter import SlidingWindowRateLimiter
+
+RULES = {"minute": (10, 60)}
+
+def fill(limiter, key, count, now):
+    for _ in range(count):
+        assert limiter.hit(key, ["minute"], now=now)[0] is None
+
+def test_limit_within_window():
+    limiter = SlidingWindowRateLimiter(RULES)
+    fill(limiter, "1.1.1.1", 10, now=60)
+    assert limiter.hit("1.1.1.1", ["minute"], now=119) == ("minute", 10)
+    # Le chiavi hanno contatori separati
+    assert limiter.hit("2.2.2.2", ["minute"], now=119) == (None, 1)
+
+def test_previous_window_weighted_by_remaining_fraction():
+    limiter = SlidingWindowRateLimiter(RULES)
+    fill(limiter, "1.1.1.1", 10, now=60)
+    # A metà della finestra successiva la precedente pesa 10 * 0.5 = 5
+    assert limiter.count("1.1.1.1", "minute", now=150) == 5
+    fill(limiter, "1.1.1.1", 5, now=150)
+    assert limiter.hit("1.1.1.1", ["minute"], now=150)[0] == "minute"
+    # A tre quarti pesa 10 * 0.25 = 2.5, più le 5 correnti
+    assert limiter.count("1.1.1.1", "minute", now=165) == 7
+
+def test_counters_reset_after_two_windows():
+    limiter = SlidingWindowRateLimiter(RULES)
+    fill(limiter, "1.1.1.1", 10, now=60)
+    assert limiter.count("1.1.1.1", "minute", now=185) == 0
+    fill(limiter, "1.1.1.1", 10, now=185)
+
+def test_limited_requests_are_not_counted():
+    limiter = SlidingWindowRateLimiter(RULES)
+    fill(limiter, "1.1.1.1", 10, now=60)
+    for _ in range(20):
+        assert limiter.hit("1.1.1.1", ["minute"], now=90)[0] == "minute"
+    assert limiter.count("1.1.1.1", "minute", now=150) == 5
+
+def test_limited_keys_expire_with_the_window():
+    limiter = SlidingWindowRateLimiter(RULES)
+    fill(limiter, "1.1.1.1", 10, now=60)
+    limiter.hit("1.1.1.1", ["minute"], now=90)
+    assert limiter.limited_keys(now=90) == {"1.1.1.1": ("minute", 10)}
+    assert limiter.limited_keys(now=150) == {}
+    assert limiter.get_stats()["limited_keys"] == 0
+
+def test_total_counts_every_request_while_tracked():
+    limiter = SlidingWindowRateLimiter(RULES)
+    fill(limiter, "1.1.1.1", 10, now=60)
+    for _ in range(5):
+        limiter.hit("1.1.1.1", ["minute"], now=90)
+    # Le richieste recenti sono stimate sulla finestra, il totale conta anche quelle limitate
+    assert limiter.limited_keys(now=90) == {"1.1.1.1": ("minute", 10)}
+    assert limiter.total("1.1.1.1", "minute") == 15
+    fill(limiter, "1.1.1.1", 5, now=150)
+    assert limiter.total("1.1.1.1", "minute") == 20
+    assert limiter.total("2.2.2.2", "minute") == 0
+    # Inattiva da due finestre: eliminata, il totale riparte
+    limiter.hit("2.2.2.2", ["minute"], now=400)
+    assert limiter.total("1.1.1.1", "minute") == 0
+
+def test_admin_stats_report_totals(service, monkeypatch):
+    limiter = SlidingWindowRateLimiter(dict(RULES, distance_api=(500, 86400)))
+    now = time.time()
+    fill(limiter, "1.1.1.1", 10, now=now)
+    for _ in range(3):
+        limiter.hit("1.1.1.1", ["minute"], now=now)
+    monkeypatch.setattr(service, "rate_limiter", limiter)
+    stats = service.app.test_client().get("/admin/stats").get_json()
+    assert stats["ip_stats"]["1.1.1.1"] == {
+        "recent_requests": 10, "total_requests": 13, "is_rate_limited": True, "rule": "minute"
+    }
+
+def test_every_rule_is_checked():
+    limiter = SlidingWindowRateLimiter({"minute": (10, 60), "hour": (15, 3600)})
+    for _ in range(10):
+        assert limiter.hit("1.1.1.1", ["minute", "hour"], now=3600)[0] is None
+    assert limiter.hit("1.1.1.1", ["minute", "hour"], now=3600)[0] == "minute"
+    for _ in range(5):
+        assert limiter.hit("1.1.1.1", ["minute", "hour"], now=3700)[0] is None
+    assert limiter.hit("1.1.1.1", ["minute", "hour"], now=3700) == ("hour", 15)
+
+def test_least_recent_keys_evicted():
+    limiter = SlidingWindowRateLimiter(RULES, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.hit(key, ["minute"], now=60)
+    assert limiter.get_stats()["tracked_keys"] == {"minute": 2}
+    assert limiter.count("a", "minute", now=60) == 0
+    assert limiter.count("c", "minute", now=60) == 1
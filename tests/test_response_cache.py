@@ -0,0 +1,106 @@
+import time
+
+from conftest import POINTS
+from memory_cache import ResponseCache
+
+ORIGIN = "44.8301,11.6201"
+
+def test_version_and_invalidation():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    version = object()
+    started_at = time.monotonic()
+    assert cache.put("a", version, b"[]", "e1", started_at)
+    assert cache.get("a", version) == (b"[]", "e1")
+    # Altra versione dei punti: non più servita
+    assert cache.get("a", object()) is None
+    assert cache.get("a", version) is None
+
+    # Calcolata prima dell'ultima invalidazione del prefisso: non salvata
+    cache.invalidate({"b"})
+    assert not cache.put("b", version, b"[]", "e2", started_at)
+    assert cache.put("b", version, b"[]", "e2", time.monotonic())
+    cache.invalidate({"b"})
+    assert cache.get("b", version) is None
+    stats = cache.get_stats()
+    assert stats["rejected"] == 1 and stats["invalidations"] == 1
+
+def test_lru_and_clear():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    version = object()
+    for prefix in ("a", "b"):
+        cache.put(prefix, version, prefix.encode(), prefix, time.monotonic())
+    cache.get("a", version)
+    cache.put("c", version, b"c", "c", time.monotonic())
+    assert cache.get("b", version) is None
+    assert cache.get("a", version) == (b"a", "a")
+
+    # Anche le richieste iniziate prima di clear() non salvano
+    started_at = time.monotonic()
+    cache.clear()
+    assert cache.get("a", version) is None
+    assert not cache.put("a", version, b"a", "a", started_at)
+
+def test_expired_entries():
+    cache = ResponseCache(ttl_seconds=0.05)
+    version = object()
+    started_at = time.monotonic()
+    cache.put("a", version, b"a", "a", started_at)
+    time.sleep(0.06)
+    assert cache.get("a", version) is None
+    # Richiesta durata più del ttl
+    assert not cache.put("a", version, b"a", "a", started_at)
+
+def test_etag_and_not_modified(service, providers):
+    client = service.app.test_client()
+    # Con cache miss la risposta non viene salvata né marcata con ETag
+    first = client.get(f"/all_distances?origin={ORIGIN}")
+    assert "ETag" not in first.headers
+    second = client.get(f"/all_distances?origin={ORIGIN}")
+    etag = second.headers["ETag"]
+    assert second.get_json() == first.get_json()
+    assert second.headers["Cache-Control"] == f"public, max-age={service.RESPONSE_MAX_AGE_SECONDS}"
+
+    hits = service.response_cache.get_stats()["hits"]
+    third = client.get(f"/all_distances?origin={ORIGIN}")
+    assert third.headers["ETag"] == etag and third.data == second.data
+    assert service.response_cache.get_stats()["hits"] == hits + 1
+
+    # Stessa versione: 304 senza corpo, anche con l'ETag debole riscritto da nginx dopo il gzip
+    for header in (etag, f"W/{etag}", f'"other", {etag}'):
+        response = client.get(f"/all_distances?origin={ORIGIN}", headers={"If-None-Match": header})
+        assert response.status_code == 304 and response.data == b""
+        assert response.headers["ETag"] == etag
+    assert client.get(f"/all_distances?origin={ORIGIN}", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert len(providers.calls) == 1
+
+def test_cache_changes_invalidate_response(service, providers):
+    client = service.app.test_client()
+    client.get(f"/all_distances?origin={ORIGIN}")
+    etag = client.get(f"/all_distances?origin={ORIGIN}").headers["ETag"]
+
+    # Nuova distanza salvata per una destinazione della stessa cella
+    castello = POINTS[0]
+    key = service.get_cache_key(44.8301, 11.6201, castello['lat'], castello['lon'])
+    service.store_distance_results([key], [(777, 555)])
+    response = client.get(f"/all_distances?origin={ORIGIN}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert {entry["id"]: entry["distance"] for entry in response.get_json()}[1] == 777
+
+    # Pulizia della cache da admin: nessuna risposta salvata sopravvive
+    client.post(f"/admin/cache/clear?secret={service.ADMIN_SECRET}")
+    assert "ETag" not in client.get(f"/all_distances?origin={ORIGIN}").headers
+    assert len(providers.calls) == 2
+
+def test_points_reload_invalidates_response(service, providers, monkeypatch):
+    client = service.app.test_client()
+    client.get(f"/all_distances?origin={ORIGIN}")
+    etag = client.get(f"/all_distances?origin={ORIGIN}").headers["ETag"]
+
+    # Nuovo indice dei punti (come dopo /get_points): la risposta salvata non vale più
+    monkeypatch.setattr(service, "points_of_interest", [dict(point) for point in POINTS[:3]])
+    service.rebuild_point_index()
+    response = client.get(f"/all_distances?origin={ORIGIN}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert sorted(entry["id"] for entry in response.get_json()) == [1, 2, 3]
+    assert response.headers["ETag"] != etag
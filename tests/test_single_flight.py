@@ -0,0 +1,92 @@
+import threading
+import time
+
+from conftest import POINTS
+
+ORIGIN = "44.8301,11.6201"
+
+def keys(service, origin=(44.8301, 11.6201)):
+    return [service.get_cache_key(*origin, point['lat'], point['lon']) for point in POINTS]
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_claim_and_complete(service):
+    first, second, cached = keys(service)[:3]
+    service.distance_cache.store(cached, 300, 200)
+    coalesced = service.upstream_stats["coalesced_lookups"]
+
+    futures, owned = service.claim_inflight([first, second, first, cached])
+    # Chiave ripetuta nella stessa richiesta: una sola Future; chiave in cache: già completata
+    assert owned == [0, 1]
+    assert len(futures) == 3
+    assert futures[cached].result(timeout=0) == (300, 200)
+
+    # Un'altra richiesta per le stesse chiavi riusa le Future in corso
+    others, others_owned = service.claim_inflight([second, first])
+    assert others_owned == []
+    assert others[first] is futures[first] and others[second] is futures[second]
+    assert service.upstream_stats["coalesced_lookups"] == coalesced + 2
+
+    service.complete_inflight(futures, [first, second], [(100, 50), (110, 55)])
+    assert others[second].result(timeout=0) == (110, 55)
+    assert not service.inflight_lookups
+    # Già completate (es. dopo la deadline): un secondo completamento non le cambia
+    service.complete_inflight(futures, [first], [None])
+    assert futures[first].result(timeout=0) == (100, 50)
+
+def test_concurrent_requests_share_one_upstream_call(service, providers, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    get = providers.get
+
+    def slow(url, **kwargs):
+        started.set()
+        release.wait(5)
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(service, "http_get", slow)
+    coalesced = service.upstream_stats["coalesced_lookups"]
+    responses = []
+
+    def request():
+        responses.append(service.app.test_client().get(f"/all_distances?origin={ORIGIN}").get_json())
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    threads[0].start()
+    try:
+        assert started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # Le altre due richieste attendono la chiamata già in corso per tutte e 4 le destinazioni
+        assert wait_until(lambda: service.upstream_stats["coalesced_lookups"] == coalesced + 8)
+    finally:
+        release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(providers.calls) == 1
+    assert len(responses) == 3
+    assert responses[0] == responses[1] == responses[2]
+    assert all("distance" in entry for entry in responses[0])
+    assert not service.inflight_lookups
+
+def test_failed_call_releases_waiters(service, providers, monkeypatch):
+    def failing(url, **kwargs):
+        raise RuntimeError("provider down")
+
+    monkeypatch.setattr(service, "http_get", failing)
+    monkeypatch.setattr(service, "http_post", failing)
+    cache_keys = keys(service)
+    futures, owned = service.claim_inflight(cache_keys)
+    others, _ = service.claim_inflight(cache_keys)
+    service.run_inflight(futures, [cache_keys[i] for i in owned], service.resolve_distances_chunk,
+                         (44.8301, 11.6201), [(point['lat'], point['lon']) for point in POINTS],
+                         cache_keys)
+    # Chi attendeva riceve l'esito (non risolto), e la chiave si può richiedere di nuovo
+    assert all(others[key].result(timeout=0) == (None, None) for key in cache_keys)
+    assert not service.inflight_lookups
+    assert len(service.distance_cache) == 0
@@ -0,0 +1,103 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from strapi_client import StrapiPointsFetcher
+from strapi_stub import StrapiStubHandler
+
+def records(count):
+    return [
+        {"id": i, "Name": f"Punto {i}", "Latitude": 44.83 + i / 1000, "Longitude": 11.62,
+         "Description": "non richiesto", "updatedAt": f"2024-01-01T00:00:{i:02d}.000Z"}
+        for i in range(1, count + 1)
+    ]
+
+@pytest.fixture
+def strapi(tmp_path):
+    """strapi_stub su una porta libera; registra (query, status) di ogni richiesta"""
+    points_file = tmp_path / "points.json"
+    points_file.write_text(json.dumps(records(23)))
+    log = []
+
+    class Handler(StrapiStubHandler):
+        def send_response(self, code, message=None):
+            log.append(({key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}, code))
+            super().send_response(code, message)
+
+        def log_message(self, format, *args):
+            pass
+
+    Handler.points_file = str(points_file)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fetcher = StrapiPointsFetcher(
+        f"http://127.0.0.1:{server.server_address[1]}/api/points", "token", str(tmp_path / "strapi_state.json"),
+        page_size=5
+    )
+    fetcher.points_file = points_file
+    fetcher.log = log
+    yield fetcher
+    server.shutdown()
+    server.server_close()
+
+def test_pagination_and_projection(strapi):
+    items, info = strapi.fetch()
+    assert info == {"mode": "full", "requests": 6, "total": 23}
+    assert [item["id"] for item in items] == list(range(1, 24))
+    # Solo i campi richiesti con fields[]
+    assert all(set(item) == {"id", "Latitude", "Longitude", "Name", "updatedAt"} for item in items)
+
+    probe, *pages = [query for query, _ in strapi.log]
+    assert probe["sort"] == "updatedAt:desc" and probe["pagination[pageSize]"] == "1"
+    assert sorted(int(query["pagination[page]"]) for query in pages) == [1, 2, 3, 4, 5]
+    assert all(query["pagination[pageSize]"] == "5" and query["fields[2]"] == "Name" for query in pages)
+
+def test_unchanged_reload_costs_one_request(strapi):
+    strapi.fetch()
+    strapi.log.clear()
+    items, info = strapi.fetch()
+    assert items is None
+    assert info == {"mode": "unchanged", "requests": 1}
+    (_, status), = strapi.log
+    assert status == 304
+
+def test_incremental_fetch_merges_updates(strapi):
+    strapi.fetch()
+    data = records(23)
+    data[3]["Name"] = "Spostato"
+    data[3]["Latitude"] = 44.9
+    data[3]["updatedAt"] = "2024-02-01T00:00:00.000Z"
+    data.append({"id": 24, "Name": "Nuovo", "Latitude": 44.85, "Longitude": 11.61,
+                 "updatedAt": "2024-02-02T00:00:00.000Z"})
+    strapi.points_file.write_text(json.dumps(data))
+    strapi.log.clear()
+
+    items, info = strapi.fetch()
+    assert info == {"mode": "incremental", "requests": 2, "changed": 2, "total": 24}
+    assert [item["id"] for item in items] == list(range(1, 25))
+    assert items[3]["Name"] == "Spostato" and items[3]["Latitude"] == 44.9
+    # Solo i record modificati dopo l'ultimo reload
+    _, (query, _) = strapi.log
+    assert query["filters[updatedAt][$gt]"] == "2024-01-01T00:00:23.000Z"
+
+def test_deletions_are_merged_with_a_full_read(strapi):
+    strapi.fetch()
+    data = [item for item in records(23) if item["id"] != 7]
+    data[0]["Name"] = "Aggiornato"
+    data[0]["updatedAt"] = "2024-02-01T00:00:00.000Z"
+    strapi.points_file.write_text(json.dumps(data))
+
+    items, info = strapi.fetch()
+    # Il filtro updatedAt non vede le eliminazioni: il totale non torna e si rilegge tutto
+    assert info["mode"] == "full"
+    assert info["requests"] == 1 + 1 + 5
+    assert [item["id"] for item in items] == [i for i in range(1, 24) if i != 7]
+    assert items[0]["Name"] == "Aggiornato"
+
+    # Lo stato salvato è quello nuovo: il reload successivo non costa altro
+    strapi.log.clear()
+    assert strapi.fetch() == (None, {"mode": "unchanged", "requests": 1})
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+import pytest
+
+from conftest import POINTS
+
+ORIGIN = "44.8301,11.6201"
+# Oltre le soglie di distanza: elemento more_than, senza chiamate upstream
+BOLOGNA = {"id": 5, "lat": 44.4949, "lon": 11.3426, "name": "Bologna"}
+
+def test_get_stream_format(service):
+    assert service.get_stream_format("ndjson", None) == "ndjson"
+    assert service.get_stream_format("sse", "application/json") == "sse"
+    assert service.get_stream_format(None, "text/event-stream") == "sse"
+    assert service.get_stream_format(None, "application/x-ndjson, */*") == "ndjson"
+    assert service.get_stream_format("xml", "application/json") is None
+    assert service.get_stream_format(None, None) is None
+
+def test_framing(service):
+    entry = {"id": 1, "distance": 100, "duration": 50}
+    assert service.format_stream_entry(entry, "ndjson") == '{"distance":100,"duration":50,"id":1}\n'
+    assert service.format_stream_entry(entry, "sse") == 'data: {"distance":100,"duration":50,"id":1}\n\n'
+    assert service.format_stream_end("ndjson", 4) == ""
+    assert service.format_stream_end("sse", 4) == 'event: end\ndata: {"count":4}\n\n'
+
+def sse_events(text):
+    """Eventi SSE come (nome, dati)"""
+    events = []
+    for block in text.split("\n\n")[:-1]:
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+@pytest.fixture
+def points(service, monkeypatch):
+    monkeypatch.setattr(service, "points_of_interest", [dict(point) for point in POINTS] + [BOLOGNA])
+    service.rebuild_point_index()
+    castello = POINTS[0]
+    service.distance_cache.store(service.get_cache_key(44.8301, 11.6201, castello['lat'], castello['lon']), 900, 700)
+    return service
+
+def test_ndjson_stream(points, providers):
+    response = points.app.test_client().get(f"/all_distances?origin={ORIGIN}&stream=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["X-Accel-Buffering"] == "no"
+    assert response.headers["Cache-Control"] == "no-cache"
+    text = response.get_data(as_text=True)
+    assert text.endswith("\n")
+    lines = [json.loads(line) for line in text.splitlines()]
+    # Prima gli elementi già pronti (cache e more_than), poi quelli upstream
+    assert lines[0] == {"distance": 900, "duration": 700, "id": 1}
+    assert lines[1]["id"] == 5 and "more_than" in lines[1]
+    assert sorted(line["id"] for line in lines[2:]) == [2, 3, 4]
+    assert all("distance" in line for line in lines[2:])
+    assert len(providers.calls) == 1
+
+def test_sse_stream(points, providers):
+    response = points.app.test_client().get(
+        f"/all_distances?origin={ORIGIN}", headers={"Accept": "text/event-stream"}
+    )
+    assert response.mimetype == "text/event-stream"
+    events = sse_events(response.get_data(as_text=True))
+    assert [name for name, _ in events] == ["message"] * 5 + ["end"]
+    assert sorted(data["id"] for _, data in events[:-1]) == [1, 2, 3, 4, 5]
+    assert events[-1] == ("end", {"count": 5})
+
+def test_stream_timeouts(service, providers, monkeypatch):
+    release = threading.Event()
+    get = providers.get
+
+    def slow(url, **kwargs):
+        release.wait(5)
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(service, "http_get", slow)
+    monkeypatch.setattr(service, "REQUEST_DEADLINE_SECONDS", 0.1)
+    timed_out = service.upstream_stats["timed_out_requests"]
+    try:
+        response = service.app.test_client().get(f"/all_distances?origin={ORIGIN}&stream=ndjson")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    finally:
+        release.set()
+    # Ogni punto non risolto alla deadline ha il suo elemento di errore
+    assert sorted(line["id"] for line in lines) == [1, 2, 3, 4]
+    assert all(line["error"] == "Distance calculation timed out, please retry" for line in lines)
+    assert service.upstream_stats["timed_out_requests"] == timed_out + 1
+    deadline = time.monotonic() + 5
+    while service.inflight_lookups and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not service.inflight_lookups
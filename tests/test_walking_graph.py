@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+
+import walking_graph as wg
+from conftest import POINTS
+
+ORIGIN = (44.8301, 11.6201)
+# Via pedonale lungo il meridiano 11.62 tra l'origine e il Castello, nodi ogni ~111 m
+LINE = [(44.8301 + 0.001 * i, 11.6200) for i in range(9)]
+
+def write_osm(path, ways):
+    """Estratto OSM in XML: ways è una lista di (coordinate dei nodi, tag della via)"""
+    nodes, way_elements = [], []
+    node_id = 0
+    for way_id, (coords, tags) in enumerate(ways, 1):
+        refs = []
+        for lat, lon in coords:
+            node_id += 1
+            nodes.append(f'<node id="{node_id}" lat="{lat}" lon="{lon}"/>')
+            refs.append(f'<nd ref="{node_id}"/>')
+        tag_elements = "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+        way_elements.append(f'<way id="{way_id}">{"".join(refs)}{tag_elements}</way>')
+    path.write_text(f'<?xml version="1.0"?><osm version="0.6">{"".join(nodes)}{"".join(way_elements)}</osm>')
+    return str(path)
+
+@pytest.fixture
+def graph_file(tmp_path):
+    osm = write_osm(tmp_path / "area.osm", [
+        (LINE, {"highway": "footway"}),
+        # Non percorribile a piedi: non entra nel grafo
+        ([(44.8301, 11.6250), (44.8311, 11.6250)], {"highway": "motorway"}),
+        ([(44.8301, 11.6260), (44.8311, 11.6260)], {"highway": "residential", "foot": "no"}),
+    ])
+    path = str(tmp_path / "walking_graph.bin")
+    assert wg.build_from_osm(osm, path) == (len(LINE), 2 * (len(LINE) - 1))
+    return path
+
+def test_nearest_node(graph_file):
+    graph = wg.WalkingGraph(graph_file, max_snap_m=200)
+    node, distance = graph.nearest_node(44.83012, 11.6201)
+    assert (graph.lat[node], graph.lon[node]) == LINE[0]
+    assert distance == pytest.approx(wg.haversine_m(44.83012, 11.6201, *LINE[0]))
+    # Vie escluse e punti oltre max_snap_m
+    assert graph.nearest_node(44.8301, 11.6250) is None
+    assert graph.nearest_node(44.8500, 11.6200) is None
+
+def test_shortest_path_distance(graph_file):
+    graph = wg.WalkingGraph(graph_file, speed_mps=1.25)
+    castello = (POINTS[0]["lat"], POINTS[0]["lon"])
+    expected = sum(wg.haversine_m(*a, *b) for a, b in zip(LINE, LINE[1:]))
+    expected += wg.haversine_m(*ORIGIN, *LINE[0]) + wg.haversine_m(*castello, *LINE[-1])
+    distance, duration = graph.distance(ORIGIN, castello)
+    assert distance == int(round(expected))
+    assert duration == int(round(distance / 1.25))
+    # Più destinazioni con una sola ricerca: stessi risultati di A*
+    assert graph.distances_from(ORIGIN, [castello, LINE[4]])[0] == (distance, duration)
+    assert graph.get_stats()["queries"] == 2
+
+def test_beyond_max_snap_is_unresolved(graph_file):
+    graph = wg.WalkingGraph(graph_file, max_snap_m=200)
+    romei = (POINTS[3]["lat"], POINTS[3]["lon"])
+    assert graph.distances_from(ORIGIN, [romei, LINE[2]])[0] == (None, None)
+    assert graph.distance((44.8301, 11.6250), LINE[2]) == (None, None)
+    stats = graph.get_stats()
+    # Origine non agganciata: una per destinazione
+    assert stats["snap_failures"] == 2
+    assert stats["resolved"] == 1
+
+def test_reload_keeps_old_mapping(graph_file, tmp_path):
+    graph = wg.WalkingGraph(graph_file)
+    before = graph.distance(ORIGIN, LINE[8])
+    # Ricostruzione con os.replace: il grafo aperto continua a leggere il file precedente
+    osm = write_osm(tmp_path / "short.osm", [(LINE[:3], {"highway": "path"})])
+    assert wg.build_from_osm(osm, graph_file) == (3, 4)
+    assert graph.distance(ORIGIN, LINE[8]) == before
+
+    reloaded = wg.load_walking_graph(graph_file)
+    assert reloaded.nodes == 3
+    assert reloaded.distance(ORIGIN, LINE[8]) == (None, None)
+    assert reloaded.distance(ORIGIN, LINE[2])[0] is not None
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / "broken.bin"
+    path.write_bytes(b"NOTAGRPH" + bytes(8))
+    assert wg.load_walking_graph(str(path)) is None
+    assert wg.load_walking_graph(str(tmp_path / "missing.bin")) is None
+
+def test_stats_under_threads(graph_file):
+    graph = wg.WalkingGraph(graph_file)
+
+    def run():
+        for _ in range(50):
+            graph.distances_from(ORIGIN, [LINE[8], LINE[4]])
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = graph.get_stats()
+    assert stats["queries"] == 400
+    assert stats["resolved"] == 800
+
+def test_service_uses_graph_pool_then_providers(service, providers, graph_file, monkeypatch):
+    graph = wg.WalkingGraph(graph_file, max_snap_m=200)
+    duomo = POINTS[1]
+    expected_castello = graph.distance(ORIGIN, (POINTS[0]["lat"], POINTS[0]["lon"]))
+    expected_duomo = graph.distance((44.8302, 11.6201), (duomo["lat"], duomo["lon"]))
+    threads = []
+    search = graph.distances_from
+
+    def recorded(origin_coords, dest_coords_list):
+        threads.append(threading.current_thread().name)
+        return search(origin_coords, dest_coords_list)
+
+    monkeypatch.setattr(graph, "distances_from", recorded)
+    monkeypatch.setattr(service, "walking_graph", graph)
+    client = service.app.test_client()
+
+    entries = {entry["id"]: entry for entry in client.get("/all_distances?origin=44.8301,11.6201").get_json()}
+    assert (entries[1]["distance"], entries[1]["duration"]) == expected_castello
+    # Palazzo dei Diamanti e Casa Romei sono oltre max_snap_m: una sola chiamata matrix per entrambi
+    (_, _, dests), = providers.calls
+    assert sorted(dests) == sorted((point["lat"], point["lon"]) for point in POINTS if point["id"] in (3, 4))
+    assert threads and all(name.startswith("walking-graph") for name in threads)
+
+    # /distance: risolta dal grafo, nessuna chiamata ai provider
+    response = client.get(f"/distance?origin=44.8302,11.6201&destination={duomo['lat']},{duomo['lon']}")
+    assert response.get_json() == {"distance": expected_duomo[0], "duration": expected_duomo[1], "id": 2}
+    assert len(providers.calls) == 1
+    assert all(name.startswith("walking-graph") for name in threads)
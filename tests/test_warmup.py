@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+from conftest import POINTS
+from geo import geohash_encode
+from poi_index import PointIndex
+from warmup import WarmupJob, build_grid, estimate_elements, service_bounds
+
+BOUNDS = (44.83, 11.61, 44.84, 11.63)
+
+def test_build_grid_round():
+    origins = build_grid(BOUNDS, step_m=500)
+    # ~1.1 km × ~1.6 km a passo 500 m: 3 righe × 4 colonne, da sud-ovest riga per riga
+    assert len(origins) == 12
+    assert origins[0] == (44.83, 11.61)
+    assert origins[:4] == sorted(origins[:4], key=lambda origin: origin[1])
+    assert all(origin == (round(origin[0], 4), round(origin[1], 4)) for origin in origins)
+    assert all(BOUNDS[0] <= lat <= BOUNDS[2] and BOUNDS[1] <= lon <= BOUNDS[3] for lat, lon in origins)
+
+def test_build_grid_geohash():
+    origins = build_grid(BOUNDS, geohash_precision=6)
+    cells = {geohash_encode(lat, lon, 6) for lat, lon in origins}
+    # Una origine (il centro) per cella, e ogni punto dell'area cade in una delle celle
+    assert len(cells) == len(origins)
+    for lat in (44.83, 44.835, 44.84):
+        for lon in (11.61, 11.62, 11.63):
+            assert geohash_encode(lat, lon, 6) in cells
+
+def test_estimate_elements():
+    index = PointIndex(POINTS)
+    near = [(44.8301, 11.6201), (44.84, 11.62)]
+    far = [(45.5, 11.62)]
+    # Sotto sample_size la stima è esatta: 4 punti entro 10 km per ogni origine vicina
+    assert estimate_elements(index, near + far) == 8
+    assert estimate_elements(index, far) == 0
+    assert estimate_elements(index, []) == 0
+    assert estimate_elements(PointIndex([]), near) == 0
+    # Campione di una griglia uniforme: scala sul totale
+    assert estimate_elements(index, near * 500, sample_size=10) == 4000
+
+@pytest.fixture
+def job(tmp_path):
+    """WarmupJob con un resolve finto che registra le origini richieste"""
+    requested = []
+
+    def resolve(origin, dests, keys):
+        requested.append(origin)
+        if job.stop_after and len(requested) == job.stop_after:
+            job.stop()
+        return [(100, 50)] * len(dests)
+
+    job = WarmupJob(
+        str(tmp_path / "warmup_state.json"),
+        resolve=resolve,
+        cached_keys=lambda keys: set(),
+        cache_key=lambda lat, lon, dest_lat, dest_lon: f"{lat},{lon},{dest_lat},{dest_lon}",
+        persist=lambda: None
+    )
+    job.requested = requested
+    job.stop_after = 0
+    return job
+
+def test_checkpoint_resume(job):
+    index = PointIndex(POINTS)
+    origins = build_grid(service_bounds(POINTS, 200), step_m=100)
+    signature = {"cells": len(origins)}
+    assert len(origins) > WarmupJob.CHECKPOINT_EVERY
+
+    # Interrotto a metà: il checkpoint riparte dalla cella successiva all'ultima richiesta
+    job.stop_after = 25
+    status = job.run(index, origins, signature)
+    assert status["state"] == "stopped"
+    assert status["next_cell"] == 25
+    first = list(job.requested)
+
+    job.stop_after = 0
+    status = job.run(index, origins, signature)
+    assert status["state"] == "completed"
+    assert status["start_cell"] == 25
+    second = job.requested[len(first):]
+    # Nessuna cella richiesta due volte, tutte richieste
+    assert not set(first) & set(second)
+    assert first + second == origins
+    assert status["resolved"] == 4 * len(second)
+
+    # Giro completato: il prossimo riparte da capo
+    job.requested.clear()
+    assert job.run(index, origins, signature)["start_cell"] == 0
+
+def test_changed_signature_invalidates_checkpoint(job):
+    index = PointIndex(POINTS)
+    origins = build_grid(service_bounds(POINTS, 200), step_m=100)
+    job.stop_after = 5
+    job.run(index, origins, {"cells": len(origins), "step_m": 100})
+
+    job.stop_after = 0
+    job.requested.clear()
+    status = job.run(index, origins, {"cells": len(origins), "step_m": 50})
+    assert status["start_cell"] == 0
+    assert job.requested == origins
+
+def test_timeouts_are_counted(job):
+    job.resolve = lambda origin, dests, keys: [None] * len(dests)
+    status = job.run(PointIndex(POINTS), [(44.8301, 11.6201)], {"cells": 1})
+    assert status["failed"] == status["timed_out"] == 4
+    assert status["resolved"] == 0
+
+def test_service_warmup_uses_own_pool(service, providers, monkeypatch):
+    threads = []
+    get = providers.get
+
+    def recorded(url, **kwargs):
+        threads.append(threading.current_thread().name)
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(service, "http_get", recorded)
+    monkeypatch.setattr(service, "CACHE_NEIGHBOR_RADIUS_M", 400)
+    status = service.run_warmup(step_m=500, background=False, restart=True, bounds="44.83,11.615,44.835,11.62")
+    assert status["state"] == "completed"
+    assert status["resolved"] == 4 * status["cells_total"]
+    assert threads and all(name.startswith("warmup") for name in threads)
+
+def test_service_warmup_chunk_deadline(service, providers, monkeypatch):
+    release = threading.Event()
+    get = providers.get
+
+    def slow(url, **kwargs):
+        release.wait(5)
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(service, "http_get", slow)
+    monkeypatch.setattr(service, "CACHE_NEIGHBOR_RADIUS_M", 400)
+    monkeypatch.setattr(service, "WARMUP_CHUNK_DEADLINE_SECONDS", 0.1)
+    try:
+        status = service.run_warmup(step_m=500, background=False, restart=True, bounds="44.83,11.615,44.83,11.615")
+    finally:
+        release.set()
+    assert status["cells_total"] == 1
+    assert status["timed_out"] == 4
+    assert status["state"] == "completed"
+    # La chiamata scaduta finisce comunque in cache
+    deadline = time.monotonic() + 5
+    while service.inflight_lookups and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not service.inflight_lookups
+    assert len(service.distance_cache) == 4
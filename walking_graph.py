@@ -0,0 +1,330 @@
+# walking_graph.py - Routing pedonale locale su un grafo preelaborato (provider senza quota)
+#
+# Il grafo dell'area servita è un file binario con le adiacenze in formato CSR, aperto con mmap:
+# l'avvio non legge né copia il file, le pagine vengono caricate dal sistema operativo al
+# primo accesso e sono condivise tra i worker. Formato (little-endian):
+#
+#   header   "WLKGRPH1", uint32 nodi, uint32 archi
+#   lat      float64[nodi]     nodi ordinati per latitudine (aggancio con ricerca binaria)
+#   lon      float64[nodi]
+#   offsets  uint32[nodi + 1]  gli archi del nodo i sono targets[offsets[i]:offsets[i + 1]]
+#   targets  uint32[archi]
+#   lengths  float32[archi]    lunghezza in metri
+#
+# Le distanze sono calcolate con A* (una destinazione) o con un solo Dijkstra limitato per
+# origine (più destinazioni), la durata con una velocità di cammino costante. Origine e
+# destinazione vengono agganciate al nodo più vicino entro max_snap_m; se non c'è un nodo o la
+# destinazione non viene raggiunta il risultato è (None, None) e si passa ai provider remoti.
+#
+# Costruzione da un estratto OpenStreetMap in XML (un .osm.pbf va prima convertito, es. con
+# "osmium cat estratto.osm.pbf -o estratto.osm"):
+#   python walking_graph.py build estratto.osm shared/walking_graph.bin
+#   python walking_graph.py route shared/walking_graph.bin 44.8381,11.6198 44.8357,11.6300
+import os
+import sys
+import mmap
+import time
+import heapq
+import struct
+import argparse
+import threading
+from bisect import bisect_left, bisect_right
+from math import radians, cos, sin, sqrt, atan2
+
+MAGIC = b"WLKGRPH1"
+HEADER = struct.Struct("<8sII")
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEGREE = 111320
+
+# Strade percorribili a piedi (salvo foot=no) e valori di foot che rendono percorribile una via
+WALKABLE_HIGHWAYS = {
+    "footway", "path", "pedestrian", "living_street", "residential", "service", "unclassified",
+    "tertiary", "tertiary_link", "secondary", "secondary_link", "primary", "primary_link",
+    "steps", "track", "cycleway", "bridleway", "road", "corridor"
+}
+FOOT_ALLOWED = {"yes", "designated", "permissive"}
+FOOT_DENIED = {"no", "private"}
+
+def is_walkable(tags):
+    """Una via OSM (dizionario dei tag) è percorribile a piedi"""
+    foot = tags.get("foot")
+    if foot in FOOT_ALLOWED:
+        return True
+    if foot in FOOT_DENIED or tags.get("access") in FOOT_DENIED:
+        return False
+    return tags.get("highway") in WALKABLE_HIGHWAYS
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distanza Haversine in metri"""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_M * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+class WalkingGraph:
+    """Grafo pedonale in sola lettura su un file mappato in memoria.
+
+    Gli archi hanno come lunghezza la distanza Haversine tra i nodi, quindi la distanza in
+    linea d'aria è una stima ammissibile per A*. max_distance_m limita la ricerca (le
+    destinazioni più lontane sono oltre la soglia more_than e non vengono mai risolte),
+    detour_factor la ferma quando il percorso supera di quel fattore la distanza in linea d'aria.
+    """
+
+    def __init__(self, path, speed_mps=1.39, max_snap_m=200, max_distance_m=15000, detour_factor=2.5):
+        if sys.byteorder != "little":
+            raise RuntimeError("walking graph files are little-endian")
+        self.path = path
+        self.speed_mps = speed_mps
+        self.max_snap_m = max_snap_m
+        self.max_distance_m = max_distance_m
+        self.detour_factor = detour_factor
+
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nodes, edges = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a walking graph file")
+
+        view = memoryview(self.mm)
+        offset = HEADER.size
+        self.lat = view[offset:offset + 8 * nodes].cast('d')
+        offset += 8 * nodes
+        self.lon = view[offset:offset + 8 * nodes].cast('d')
+        offset += 8 * nodes
+        self.offsets = view[offset:offset + 4 * (nodes + 1)].cast('I')
+        offset += 4 * (nodes + 1)
+        self.targets = view[offset:offset + 4 * edges].cast('I')
+        offset += 4 * edges
+        self.lengths = view[offset:offset + 4 * edges].cast('f')
+        self.nodes = nodes
+        self.edges = edges
+        self.stats = {"queries": 0, "resolved": 0, "unreachable": 0, "snap_failures": 0, "settled_nodes": 0, "total_ms": 0.0}
+        # Le ricerche girano su più thread: i contatori di una ricerca vengono sommati insieme
+        self.stats_lock = threading.Lock()
+
+    def nearest_node(self, lat, lon):
+        """Nodo più vicino a (lat, lon) entro max_snap_m: (nodo, distanza in metri) oppure None"""
+        d_lat = self.max_snap_m / METERS_PER_DEGREE
+        d_lon = self.max_snap_m / (METERS_PER_DEGREE * max(cos(radians(lat)), 0.01))
+        best = None
+        # Nodi ordinati per latitudine: solo la fascia entro max_snap_m
+        for node in range(bisect_left(self.lat, lat - d_lat), bisect_right(self.lat, lat + d_lat)):
+            node_lon = self.lon[node]
+            if abs(node_lon - lon) > d_lon:
+                continue
+            distance = haversine_m(lat, lon, self.lat[node], node_lon)
+            if distance <= self.max_snap_m and (best is None or distance < best[1]):
+                best = (node, distance)
+        return best
+
+    def _search(self, source, targets, limit, goal=None):
+        """Dijkstra da source fino a raggiungere tutti i targets o a superare limit metri.
+
+        Con goal (lat, lon) di un'unica destinazione diventa A* con la distanza in linea d'aria
+        come stima. Ritorna ({nodo: distanza} per i targets raggiunti, nodi visitati).
+        """
+        offsets, node_targets, lengths = self.offsets, self.targets, self.lengths
+        best = {source: 0.0}
+        found = {}
+        remaining = set(targets)
+        heuristic = (lambda node: haversine_m(self.lat[node], self.lon[node], goal[0], goal[1])) if goal else (lambda node: 0.0)
+        queue = [(heuristic(source), 0.0, source)]
+        settled = 0
+
+        while queue and remaining:
+            estimate, distance, node = heapq.heappop(queue)
+            if distance > best.get(node, float("inf")):
+                continue
+            if estimate > limit:
+                break
+            settled += 1
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = distance
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = node_targets[edge]
+                candidate = distance + lengths[edge]
+                if candidate < best.get(target, float("inf")):
+                    best[target] = candidate
+                    heapq.heappush(queue, (candidate + heuristic(target), candidate, target))
+
+        return found, settled
+
+    def _add_stats(self, counters):
+        with self.stats_lock:
+            for name, value in counters.items():
+                self.stats[name] += value
+
+    def distances_from(self, origin_coords, dest_coords_list):
+        """Distanze a piedi da origin verso le destinazioni con una sola ricerca.
+
+        Ritorna una lista di tuple (distance, duration) in metri e secondi nello stesso ordine
+        di dest_coords_list, con (None, None) per le destinazioni non risolte.
+        """
+        start = time.monotonic()
+        results = [(None, None)] * len(dest_coords_list)
+        counters = {"queries": 1, "resolved": 0, "unreachable": 0, "snap_failures": 0, "settled_nodes": 0}
+
+        origin = self.nearest_node(*origin_coords)
+        if origin is None:
+            counters["snap_failures"] = len(dest_coords_list)
+            self._add_stats(counters)
+            return results
+
+        snapped = []
+        limit = 0
+        for position, dest_coords in enumerate(dest_coords_list):
+            dest = self.nearest_node(*dest_coords)
+            if dest is None:
+                counters["snap_failures"] += 1
+                continue
+            snapped.append((position, dest))
+            limit = max(limit, haversine_m(origin_coords[0], origin_coords[1], dest_coords[0], dest_coords[1]))
+
+        if snapped:
+            limit = min(limit * self.detour_factor + 2 * self.max_snap_m, self.max_distance_m)
+            goal = None
+            if len(snapped) == 1:
+                # Una sola destinazione: A* verso il suo nodo
+                goal_node = snapped[0][1][0]
+                goal = (self.lat[goal_node], self.lon[goal_node])
+            found, counters["settled_nodes"] = self._search(origin[0], {dest for _, (dest, _) in snapped}, limit, goal)
+
+            for position, (dest, dest_snap) in snapped:
+                if dest not in found:
+                    counters["unreachable"] += 1
+                    continue
+                if dest == origin[0]:
+                    # Stesso nodo: i due punti sono vicini, vale la distanza in linea d'aria
+                    distance = haversine_m(origin_coords[0], origin_coords[1], *dest_coords_list[position])
+                else:
+                    # Percorso più i tratti in linea d'aria tra i punti e i nodi agganciati
+                    distance = found[dest] + origin[1] + dest_snap
+                distance = int(round(distance))
+                results[position] = (distance, int(round(distance / self.speed_mps)))
+                counters["resolved"] += 1
+
+        counters["total_ms"] = (time.monotonic() - start) * 1000
+        self._add_stats(counters)
+        return results
+
+    def distance(self, origin_coords, dest_coords):
+        """Distanza a piedi verso una sola destinazione (A*): (distance, duration) oppure (None, None)"""
+        return self.distances_from(origin_coords, [dest_coords])[0]
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        queries = stats["queries"]
+        return dict(
+            stats,
+            total_ms=round(stats["total_ms"], 1),
+            avg_ms=round(stats["total_ms"] / queries, 2) if queries else None,
+            file=self.path,
+            nodes=self.nodes,
+            edges=self.edges,
+            speed_mps=self.speed_mps,
+            max_snap_m=self.max_snap_m
+        )
+
+def load_walking_graph(path, **options):
+    """Apre il grafo se il file esiste; None altrimenti o se il file non è valido"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        graph = WalkingGraph(path, **options)
+    except Exception as e:
+        print(f"❌ Error loading walking graph {path}: {e}")
+        return None
+    print(f"✅ Loaded walking graph from {path}: {graph.nodes} nodes, {graph.edges} edges")
+    return graph
+
+def write_graph(path, coords, adjacency):
+    """Scrive il file del grafo.
+
+    coords è la lista (lat, lon) dei nodi già ordinati per latitudine, adjacency la lista per
+    nodo di (nodo di arrivo, lunghezza in metri).
+    """
+    from array import array
+
+    lats = array('d', (lat for lat, _ in coords))
+    lons = array('d', (lon for _, lon in coords))
+    offsets = array('I', [0])
+    targets = array('I')
+    lengths = array('f')
+    for edges in adjacency:
+        for target, length in edges:
+            targets.append(target)
+            lengths.append(length)
+        offsets.append(len(targets))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(coords), len(targets)))
+        for values in (lats, lons, offsets, targets, lengths):
+            if sys.byteorder != "little":
+                values.byteswap()
+            values.tofile(f)
+    os.replace(tmp_path, path)
+
+def build_from_osm(osm_path, out_path):
+    """Costruisce il grafo pedonale da un estratto OSM in XML (vie percorribili a piedi, archi
+    nei due sensi); ritorna (nodi, archi)"""
+    import xml.etree.ElementTree as ElementTree
+
+    node_coords = {}
+    edges = set()
+    way_nodes = []
+    tags = {}
+    # Eventi "end": nd e tag arrivano prima dell'elemento (nodo, via, relazione) che li contiene
+    for _, element in ElementTree.iterparse(osm_path, events=("end",)):
+        if element.tag == "nd":
+            way_nodes.append(int(element.get("ref")))
+            continue
+        if element.tag == "tag":
+            tags[element.get("k")] = element.get("v")
+            continue
+        if element.tag == "node":
+            node_coords[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+        elif element.tag == "way" and is_walkable(tags):
+            for a, b in zip(way_nodes, way_nodes[1:]):
+                if a != b and a in node_coords and b in node_coords:
+                    edges.add((min(a, b), max(a, b)))
+        way_nodes = []
+        tags = {}
+        element.clear()
+
+    # Solo i nodi usati dalle vie, ordinati per latitudine
+    used = sorted({node for edge in edges for node in edge}, key=lambda node: node_coords[node])
+    position = {node: i for i, node in enumerate(used)}
+    coords = [node_coords[node] for node in used]
+    adjacency = [[] for _ in used]
+    for a, b in edges:
+        length = haversine_m(*node_coords[a], *node_coords[b])
+        adjacency[position[a]].append((position[b], length))
+        adjacency[position[b]].append((position[a], length))
+
+    write_graph(out_path, coords, adjacency)
+    return len(coords), 2 * len(edges)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local walking graph for the distance service")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build the graph file from an OSM XML extract")
+    build.add_argument("osm_file")
+    build.add_argument("graph_file")
+    route = commands.add_parser("route", help="walking distance between two points")
+    route.add_argument("graph_file")
+    route.add_argument("origin", help="lat,lon")
+    route.add_argument("destination", help="lat,lon")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.time()
+        nodes, edges = build_from_osm(args.osm_file, args.graph_file)
+        print(f"✅ Built {args.graph_file}: {nodes} nodes, {edges} edges in {time.time() - start:.1f}s")
+    else:
+        graph = WalkingGraph(args.graph_file)
+        origin = tuple(map(float, args.origin.split(',')))
+        destination = tuple(map(float, args.destination.split(',')))
+        distance, duration = graph.distance(origin, destination)
+        print(f"🎯 distance={distance} m duration={duration} s ({graph.get_stats()['total_ms']} ms)")
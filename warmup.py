@@ -0,0 +1,265 @@
+# warmup.py - Precalcolo delle distanze su una griglia di origini attorno ai punti di interesse
+#
+# Il job percorre una griglia di origini che copre l'area servita (bounding box dei punti più
+# un margine) e riempie distance_cache per ogni coppia (cella, punto entro 10 km) passando dal
+# percorso batch dei provider. Ogni esecuzione è limitata da un budget di elementi (quota dei
+# provider) e da un ritmo massimo; l'avanzamento viene salvato in un checkpoint e l'esecuzione
+# successiva riparte dalla cella dove si era fermata.
+#
+# Le origini della griglia coincidono con le chiavi di cache: con CACHE_KEY_MODE=geohash sono i
+# centri delle celle geohash, altrimenti punti a passo WARMUP_STEP_M arrotondati a 4 decimali:
+# in modalità round il warm-up parte solo con CACHE_NEIGHBOR_RADIUS_M >= passo/√2, così ogni
+# origine servita ha un'origine della griglia entro il raggio. Prima di partire la dimensione
+# stimata (origini × punti entro 10 km) viene confrontata con CACHE_MAX_ENTRIES e con il budget.
+# Le chiamate del warm-up girano su un pool dedicato e piccolo (WARMUP_POOL_SIZE) con una deadline
+# per cella: le destinazioni non risolte in tempo contano come fallite (timed_out) e il job prosegue.
+#
+# Uso: python warmup.py [--step-m 100] [--margin-m 1000] [--bounds lat,lon,lat,lon] [--max-elements 100000] [--restart]
+#      oppure POST /admin/warmup?secret=...&action=start con il server avviato
+import os
+import json
+import time
+import argparse
+import threading
+from math import cos, radians, floor
+
+from geo import geohash_cell_size
+from poi_index import more_than_steps
+
+METERS_PER_DEGREE = 111320
+
+def service_bounds(points, margin_m):
+    """Bounding box (min_lat, min_lon, max_lat, max_lon) dei punti allargata di margin_m metri"""
+    lats = [point['lat'] for point in points]
+    lons = [point['lon'] for point in points]
+    margin_lat = margin_m / METERS_PER_DEGREE
+    margin_lon = margin_m / (METERS_PER_DEGREE * max(cos(radians((min(lats) + max(lats)) / 2)), 0.01))
+    return min(lats) - margin_lat, min(lons) - margin_lon, max(lats) + margin_lat, max(lons) + margin_lon
+
+def build_grid(bounds, step_m=100, geohash_precision=None):
+    """Origini (lat, lon) della griglia sull'area, riga per riga da sud-ovest.
+
+    Con geohash_precision le origini sono i centri delle celle geohash della precisione indicata,
+    altrimenti punti a passo step_m metri arrotondati a 4 decimali.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds
+    origins = []
+
+    if geohash_precision:
+        # Le celle geohash sono allineate a (-90, -180)
+        d_lat, d_lon = geohash_cell_size(geohash_precision)
+        for i in range(floor((min_lat + 90) / d_lat), floor((max_lat + 90) / d_lat) + 1):
+            for j in range(floor((min_lon + 180) / d_lon), floor((max_lon + 180) / d_lon) + 1):
+                origins.append((-90 + (i + 0.5) * d_lat, -180 + (j + 0.5) * d_lon))
+        return origins
+
+    d_lat = step_m / METERS_PER_DEGREE
+    d_lon = step_m / (METERS_PER_DEGREE * max(cos(radians((min_lat + max_lat) / 2)), 0.01))
+    rows = int((max_lat - min_lat) / d_lat) + 1
+    cols = int((max_lon - min_lon) / d_lon) + 1
+    for i in range(rows):
+        for j in range(cols):
+            origins.append((round(min_lat + i * d_lat, 4), round(min_lon + j * d_lon, 4)))
+    return origins
+
+def estimate_elements(index, origins, sample_size=200):
+    """Stima delle coppie (origine, punto entro 10 km) della griglia: conta i punti vicini su al
+    massimo sample_size origini distribuite sulla griglia e scala sul totale (esatta sotto soglia)"""
+    if not origins or not len(index):
+        return 0
+    step = max(len(origins) / sample_size, 1)
+    sample = [origins[int(i * step)] for i in range(min(sample_size, len(origins)))]
+    near = sum(
+        sum(1 for value in more_than_steps(index.haversine_from(lat, lon)) if not value)
+        for lat, lon in sample
+    )
+    return round(near * len(origins) / len(sample))
+
+class WarmupJob:
+    """Job di warm-up della cache, eseguibile in primo piano (CLI) o in un thread (admin).
+
+    resolve(origin, dests, keys) risolve e salva in cache un insieme di destinazioni (percorso
+    batch, None per quelle non completate entro la deadline), cached_keys(keys) ritorna le chiavi già in cache, cache_key(lat, lon, dest_lat,
+    dest_lon) genera la chiave e persist() salva la cache su disco.
+    """
+
+    CHECKPOINT_EVERY = 20
+
+    def __init__(self, state_path, resolve, cached_keys, cache_key, persist):
+        self.state_path = state_path
+        self.resolve = resolve
+        self.cached_keys = cached_keys
+        self.cache_key = cache_key
+        self.persist = persist
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.status = {"state": "idle"}
+
+    def _load_checkpoint(self, signature):
+        try:
+            with open(self.state_path, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return checkpoint if checkpoint.get("signature") == signature else None
+
+    def _save_checkpoint(self, signature, next_cell):
+        checkpoint = {
+            "signature": signature,
+            "next_cell": next_cell,
+            "state": self.status["state"],
+            "updated_at": time.time()
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _report(self, cell):
+        status = self.status
+        done = cell - status["start_cell"]
+        elapsed = time.monotonic() - status["_started"]
+        remaining = status["cells_total"] - cell
+        status["next_cell"] = cell
+        status["elapsed_seconds"] = round(elapsed, 1)
+        status["eta_seconds"] = round(elapsed / done * remaining, 1) if done else None
+        print(f"🔄 Warm-up: {cell}/{status['cells_total']} cells "
+              f"({100 * cell / max(status['cells_total'], 1):.1f}%), "
+              f"{status['elements_requested']} elements requested, {status['failed']} failed, "
+              f"ETA {status['eta_seconds']}s")
+
+    def run(self, index, origins, signature, max_elements=0, elements_per_second=0, restart=False,
+            estimated_elements=None):
+        """Esegue il warm-up delle origini indicate verso i punti di index (PointIndex) entro 10 km.
+
+        max_elements limita gli elementi richiesti ai provider in questa esecuzione (0 = nessun
+        limite), elements_per_second il ritmo medio. Ritorna lo stato finale.
+        """
+        checkpoint = None if restart else self._load_checkpoint(signature)
+        start_cell = checkpoint["next_cell"] if checkpoint else 0
+        self.stop_event.clear()
+        self.status = {
+            "state": "running",
+            "cells_total": len(origins),
+            "start_cell": start_cell,
+            "next_cell": start_cell,
+            "points": len(index),
+            "estimated_elements": estimated_elements,
+            "max_elements": max_elements,
+            "elements_per_second": elements_per_second,
+            "elements_requested": 0,
+            "resolved": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "already_cached": 0,
+            "started_at": time.time(),
+            "elapsed_seconds": 0,
+            "eta_seconds": None,
+            "_started": time.monotonic()
+        }
+        status = self.status
+        if start_cell:
+            print(f"🔄 Resuming warm-up from cell {start_cell}/{len(origins)}")
+
+        cell = start_cell
+        try:
+            while cell < len(origins):
+                if self.stop_event.is_set():
+                    status["state"] = "stopped"
+                    break
+
+                lat, lon = origins[cell]
+                steps = more_than_steps(index.haversine_from(lat, lon))
+                points = [point for point, step in zip(index.points, steps) if not step]
+                keys = [self.cache_key(lat, lon, point['lat'], point['lon']) for point in points]
+                cached = self.cached_keys(keys)
+                misses = [(point, key) for point, key in zip(points, keys) if key not in cached]
+                status["already_cached"] += len(points) - len(misses)
+
+                if misses:
+                    if max_elements and status["elements_requested"] + len(misses) > max_elements:
+                        status["state"] = "budget_exhausted"
+                        break
+
+                    results = self.resolve(
+                        (lat, lon),
+                        [(point['lat'], point['lon']) for point, _ in misses],
+                        [key for _, key in misses]
+                    )
+                    status["elements_requested"] += len(misses)
+                    failed = sum(1 for value in results if value is None or value[0] is None)
+                    status["failed"] += failed
+                    status["timed_out"] += sum(1 for value in results if value is None)
+                    status["resolved"] += len(misses) - failed
+
+                    # Ritmo massimo: attende finché la media non rientra (interrompibile da stop)
+                    if elements_per_second > 0:
+                        ahead = status["elements_requested"] / elements_per_second - (time.monotonic() - status["_started"])
+                        if ahead > 0:
+                            self.stop_event.wait(ahead)
+
+                cell += 1
+                if (cell - start_cell) % self.CHECKPOINT_EVERY == 0:
+                    self.persist()
+                    self._save_checkpoint(signature, cell)
+                    self._report(cell)
+            else:
+                status["state"] = "completed"
+        except Exception as e:
+            print(f"❌ Warm-up error: {e}")
+            status["state"] = "error"
+            status["error"] = str(e)
+
+        # Ricomincia da capo al prossimo avvio se il giro è stato completato
+        self.persist()
+        self._save_checkpoint(signature, 0 if status["state"] == "completed" else cell)
+        if cell == start_cell or (cell - start_cell) % self.CHECKPOINT_EVERY:
+            self._report(cell)
+        print(f"✅ Warm-up {status['state']}: {status['resolved']} distances cached, "
+              f"{status['already_cached']} already cached")
+        return self.get_status()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, *args, **kwargs):
+        """Avvia run() in un thread; ritorna False se un warm-up è già in corso"""
+        with self.lock:
+            if self.is_running():
+                return False
+            self.status = {"state": "starting"}
+            self.thread = threading.Thread(target=self.run, args=args, kwargs=kwargs, name="cache-warmup", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Chiede l'interruzione del warm-up in corso (l'avanzamento resta nel checkpoint)"""
+        self.stop_event.set()
+
+    def get_status(self):
+        return {key: value for key, value in self.status.items() if not key.startswith("_")}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Warm-up of distance_cache over an origin grid")
+    parser.add_argument("--step-m", type=float, help="grid step in meters (CACHE_KEY_MODE=round)")
+    parser.add_argument("--margin-m", type=float, help="margin around the points bounding box in meters")
+    parser.add_argument("--max-elements", type=int, help="provider elements budget for this run (0 = no limit)")
+    parser.add_argument("--rate", type=float, help="max provider elements per second (0 = no limit)")
+    parser.add_argument("--bounds", help="area as min_lat,min_lon,max_lat,max_lon (default: points bounding box)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first cell")
+    args = parser.parse_args()
+
+    import app2
+    print("⚠️  Run the CLI warm-up with the service stopped, or use POST /admin/warmup on the running service")
+    status = app2.run_warmup(
+        step_m=args.step_m,
+        margin_m=args.margin_m,
+        max_elements=args.max_elements,
+        elements_per_second=args.rate,
+        restart=args.restart,
+        background=False,
+        bounds=args.bounds
+    )
+    app2.save_cache_to_file()
+    print(json.dumps(status, indent=2))